@@ -0,0 +1,150 @@
+"""
+Бенчмарк: TeleBot (main_db.py) против AsyncTeleBot (main_async.py).
+
+Запуск:
+    python bench_bot.py [/ask] [/note_list] [задержка модели, с]
+
+Пачка апдейтов: /ask от разных пользователей вперемешку с /note_list.
+Модель "отвечает" с заданной задержкой (chat_stream / achat_stream подменены),
+Bot API не вызывается - ответы только записываются. Меряем, через сколько
+после прихода пачки пользователь видит ответ на /note_list, и общее время.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ.setdefault("TOKEN", "123:bench")
+os.environ["LLM_CACHE"] = "0"
+os.environ["LLM_TELEMETRY"] = "0"
+# в бенчмарке все /ask должны дождаться ответа, без отказов "очередь полна"
+os.environ.setdefault("LLM_LANE_QUEUE", "1000")
+
+from telebot import types  # noqa: E402
+
+import db  # noqa: E402
+
+DELTAS = 4
+
+
+def make_updates(asks: int, lists: int) -> list[types.Update]:
+    # быстрые команды приходят вперемешку с медленными: /note_list после каждых step /ask
+    step = max(asks // max(lists, 1), 1)
+    texts = []
+    for i in range(asks):
+        texts.append(f"/ask вопрос {i}")
+        if (i + 1) % step == 0 and texts.count("/note_list") < lists:
+            texts.append("/note_list")
+    texts += ["/note_list"] * (lists - texts.count("/note_list"))
+    updates = []
+    for i, text in enumerate(texts, 1):
+        user_id = 1000 + i
+        updates.append(types.Update.de_json({
+            "update_id": i,
+            "message": {
+                "message_id": i, "date": 0, "text": text,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+            },
+        }))
+    return updates
+
+
+class Recorder:
+    """Записывает ответы вместо Bot API; done срабатывает, когда все команды ответили."""
+
+    def __init__(self, updates: list[types.Update]):
+        self.kind = {u.message.message_id: u.message.text.split()[0] for u in updates}
+        self.pending = len(updates)
+        self.latency: dict[str, list[float]] = {"/ask": [], "/note_list": []}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.t0 = time.perf_counter()
+
+    def finish(self, message_id: int) -> None:
+        with self.lock:
+            self.latency[self.kind[message_id]].append(time.perf_counter() - self.t0)
+            self.pending -= 1
+            if self.pending == 0:
+                self.done.set()
+
+    def reply_to(self, message, text, **kwargs):
+        if self.kind[message.message_id] == "/note_list":
+            self.finish(message.message_id)
+        return SimpleNamespace(chat=message.chat, message_id=message.message_id)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        if not text.endswith("▌"):
+            self.finish(message_id)
+
+    async def areply_to(self, message, text, **kwargs):
+        return self.reply_to(message, text, **kwargs)
+
+    async def aedit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.edit_message_text(text, chat_id, message_id, **kwargs)
+
+
+def run_sync(updates: list[types.Update], delay_s: float) -> Recorder:
+    import main_db
+
+    def chat_stream(messages, **kwargs):
+        for _ in range(DELTAS):
+            time.sleep(delay_s / DELTAS)
+            yield "слово "
+
+    main_db.llm.chat_stream = chat_stream
+    rec = Recorder(updates)
+    main_db.bot.reply_to = rec.reply_to
+    main_db.bot.edit_message_text = rec.edit_message_text
+    main_db.bot.process_new_updates(updates)
+    rec.done.wait()
+    return rec
+
+
+def run_async(updates: list[types.Update], delay_s: float) -> Recorder:
+    import main_async
+
+    async def achat_stream(messages, **kwargs):
+        for _ in range(DELTAS):
+            await asyncio.sleep(delay_s / DELTAS)
+            yield "слово "
+
+    main_async.llm.achat_stream = achat_stream
+    rec = Recorder(updates)
+    main_async.bot.reply_to = rec.areply_to
+    main_async.bot.edit_message_text = rec.aedit_message_text
+    asyncio.run(main_async.bot.process_new_updates(updates))
+    return rec
+
+
+def main() -> None:
+    asks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    lists = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    delay_s = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "bench.db")
+        db.init_db()
+        for i in range(1, asks + lists + 1):
+            db.add_note(1000 + i, "Заметка")
+
+        for name, run in (("TeleBot", run_sync), ("AsyncTeleBot", run_async)):
+            t0 = time.perf_counter()
+            rec = run(make_updates(asks, lists), delay_s)
+            total = time.perf_counter() - t0
+            note_list = rec.latency["/note_list"]
+            print(f"{name:>12}: /note_list p50 {statistics.median(note_list) * 1000:7.0f} мс, "
+                  f"max {max(note_list) * 1000:7.0f} мс; вся пачка {total:6.2f} с "
+                  f"({asks} /ask по {delay_s:g} с, {lists} /note_list)")
+
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Бенчмарк: пул соединений против старого connect-per-call.
+
+Запуск:
+    python bench_db.py [итераций] [потоков]
+
+Одна итерация - запросы, которые всегда идут в SQLite (справочники и персонажи
+отвечают из кэша и соединение не открывают): list_notes, get_note и пара
+add_note + delete_note. Запись - напрямую из потока, без group commit,
+чтобы сравнивалась только стоимость соединения.
+"""
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import db
+
+
+def legacy_connect():
+    # Копия _connect() до пула: новое соединение и три PRAGMA на каждый вызов;
+    # `with conn` только коммитит, закрывает соединение сборщик мусора
+    conn = sqlite3.connect(db.DB_PATH, timeout=5.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def workload(user_id: int, note_id: int, iterations: int) -> None:
+    for i in range(iterations):
+        db.list_notes(user_id)
+        db.get_note(user_id, note_id)
+        db.delete_note(user_id, db.add_note(user_id, f"Черновик {i}"))
+
+
+def run(connect, note_ids: dict[int, int], iterations: int) -> float:
+    db._connect = connect
+    workers = [
+        threading.Thread(target=workload, args=(user_id, note_id, iterations))
+        for user_id, note_id in note_ids.items()
+    ]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "bench.db")
+        db.DB_GROUP_COMMIT = False
+        db.init_db()
+        note_ids = {}
+        for i in range(threads):
+            for j in range(10):
+                note_ids[1000 + i] = db.add_note(1000 + i, f"Заметка {j}")
+
+        pooled_connect = db._connect
+        calls = iterations * threads * 4
+        for name, connect in (("connect-per-call", legacy_connect), ("pool", pooled_connect)):
+            dt = run(connect, note_ids, iterations)
+            print(f"{name:>17}: {dt:7.3f} с, {calls / dt:9.0f} вызовов/с ({threads} потоков)")
+
+        db._connect = pooled_connect
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Бенчмарк: поиск /note_find, когда частое слово есть у всех пользователей.
+
+Запуск:
+    python bench_fts.py [пользователей] [заметок на пользователя] [запросов]
+
+Сравниваются прежний запрос (общий MATCH, фильтр user_id после JOIN) и
+find_notes с user_id внутри MATCH. Остаток глобальной стоимости - IDF для
+bm25 и раскрытие префикса "слово"*: FTS5 читает список документов слова
+целиком, но без JOIN с notes для каждого совпадения.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import db
+
+LEGACY_SCHEMA = """
+CREATE VIRTUAL TABLE notes_fts_legacy USING fts5(
+    text, content='notes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+
+def legacy_find(user_id: int, query_text: str, limit: int = 10):
+    with db._connect() as conn:
+        return conn.execute(
+            """SELECT n.id, n.text,
+                snippet(notes_fts_legacy, 0, ?, ?, '…', 12) AS snippet
+            FROM notes_fts_legacy
+            JOIN notes n ON n.id = notes_fts_legacy.rowid
+            WHERE notes_fts_legacy MATCH ?
+            AND n.user_id = ?
+            ORDER BY bm25(notes_fts_legacy)
+            LIMIT ?""",
+            (db.SNIPPET_OPEN, db.SNIPPET_CLOSE, " ".join(f'"{w}"*' for w in query_text.split()), user_id, limit)
+        ).fetchall()
+
+
+def run(find, users: int, queries: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(queries):
+        find(1000 + i % users, "молоко")
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else db.NOTES_LIMIT
+    queries = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "bench.db")
+        db.init_db()
+        with db._connect() as conn:
+            # заметки пишем напрямую: через add_note с триггерами счётчиков это минуты
+            conn.executemany(
+                "INSERT INTO notes(user_id, text) VALUES (?, ?)",
+                ((1000 + u, f"Купить молоко и хлеб, заметка {n}") for u in range(users) for n in range(per_user))
+            )
+            conn.execute(LEGACY_SCHEMA)
+            conn.execute("INSERT INTO notes_fts_legacy(notes_fts_legacy) VALUES ('rebuild')")
+
+        total = users * per_user
+        for name, find in (("MATCH + JOIN", legacy_find), ("user_id в MATCH", db.find_notes)):
+            dt = run(find, users, queries)
+            print(f"{name:>16}: {dt / queries * 1000:7.2f} мс на запрос ({total} заметок, {users} пользователей)")
+
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Общее для main_db.py (TeleBot) и main_async.py (AsyncTeleBot): настройки,
+тексты, разметка ответов и сборка промптов. Модуль без побочных эффектов -
+не создаёт бота, не открывает БД и не запускает потоков.
+"""
+import html
+import os
+import re
+from functools import lru_cache
+from typing import Callable
+
+from dotenv import load_dotenv
+from telebot import types
+
+import llm
+from db import get_active_model, get_user_character, is_auto_model, SNIPPET_OPEN, SNIPPET_CLOSE, NOTES_LIMIT, \
+    MODEL_STATS_WINDOW, NOTE_MAX_LENGTH
+from notes_io import ImportFileError
+from openrouter import get_breaker
+
+load_dotenv()
+TOKEN = os.getenv("TOKEN")
+if not TOKEN:
+    raise RuntimeError("В .env файле нет TOKEN")
+
+
+# Telegram ID администраторов через запятую: им доступны служебные команды (/limits)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+
+def create_main_keyboard():
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row("/start", "/help", "/note_add", "/note_list", "/note_find", "/note_edit", "/note_del", "/note_export", "/stats", "/ask_model")
+    return kb
+
+
+HELP_TEXT = """
+Доступные команды:
+/note_add <текст> - Добавить заметку
+/note_list - Показать все заметки
+/note_find <запрос> - Найти заметку
+/note_edit <id> <новый текст> - Изменить заметку
+/note_del <id> - Удалить заметку
+/note_export [md|jsonl|csv] [gz|zip] - Экспорт в файл
+/note_import - Импорт из файла экспорта
+/stats - Cтатистика
+/models - Список моделей
+/model <id> - Изменить модель/показать текущую
+/model auto - Отвечает самая быстрая исправная модель
+/model_stats - Задержки и ошибки моделей
+/ask <текст> - Спросить модель
+/ask_model <ID> <Текст> - Спросить модель с конкретным ID
+/ask_all [ID,ID,...] <Текст> - Спросить все (или выбранные) модели сразу
+"""
+
+
+NOTES_PAGE_SIZE = 10
+
+
+def _render_notes_page(page: dict) -> tuple[str, types.InlineKeyboardMarkup | None]:
+    notes = page["notes"]
+    if not notes:
+        return "Заметок пока нет.", None
+
+    text = "Ваши заметки:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in notes])
+
+    buttons = []
+    if page["has_newer"]:
+        buttons.append(types.InlineKeyboardButton("⬅️ Новее", callback_data=f"notes:newer:{notes[0]['id']}"))
+    if page["has_older"]:
+        buttons.append(types.InlineKeyboardButton("Старее ➡️", callback_data=f"notes:older:{notes[-1]['id']}"))
+    if not buttons:
+        return text, None
+
+    kb = types.InlineKeyboardMarkup()
+    kb.row(*buttons)
+    return text, kb
+
+
+def _render_snippet(snippet: str) -> str:
+    # совпадения из find_notes подсвечиваем жирным
+    return html.escape(snippet).replace(SNIPPET_OPEN, "<b>").replace(SNIPPET_CLOSE, "</b>")
+
+
+IMPORT_MAX_FILE_SIZE = 5 * 1024 * 1024
+
+
+def _render_import_report(reports: list[dict], error: Exception | None = None) -> str:
+    """Итог импорта; error - ошибка, на которой чтение файла остановилось."""
+    imported = sum(r["imported"] for r in reports)
+    skipped_limit = sum(r["skipped_limit"] for r in reports)
+    skipped_empty = sum(r["skipped_empty"] for r in reports)
+    skipped_long = sum(r["skipped_long"] for r in reports)
+
+    lines = [f"📥 Импортировано заметок: {imported}"]
+    if skipped_limit:
+        lines.append(f"❌ Пропущено сверх лимита ({NOTES_LIMIT} шт.): {skipped_limit}")
+    if skipped_empty:
+        lines.append(f"⚠️ Пропущено пустых: {skipped_empty}")
+    if skipped_long:
+        lines.append(f"✂️ Пропущено длиннее {NOTE_MAX_LENGTH} символов: {skipped_long}")
+    if len(reports) > 1:
+        lines.append("\nПо пачкам:")
+        lines += [
+            f"#{r['batch']}: +{r['imported']}, сверх лимита {r['skipped_limit']}, пустых {r['skipped_empty']}, "
+            f"длинных {r['skipped_long']}"
+            for r in reports
+        ]
+    if error is not None:
+        reason = str(error) if isinstance(error, ImportFileError) else "файл повреждён или не в UTF-8"
+        where = f" на строке {error.line}" if getattr(error, "line", None) else ""
+        lines.append(f"\n⛔ Импорт остановлен{where}: {reason}. Заметки до этого места сохранены.")
+    return "\n".join(lines)
+
+
+def _render_stats(stats: dict) -> str:
+    total_notes = stats['total_notes']
+
+    BAR_CHAR_FILLED = '█'
+    BAR_CHAR_EMPTY = '░'
+    BAR_LENGTH = 20
+
+    filled_count = int((total_notes / 50) * BAR_LENGTH)
+    empty_count = BAR_LENGTH - filled_count
+
+    histogram = f"{BAR_CHAR_FILLED * filled_count}{BAR_CHAR_EMPTY * empty_count}"
+
+    return (
+        f"📊 **Ваша статистика**\n\n"
+        f"**Занято места для заметок:**\n"
+        f"`{histogram}`\n"
+        f"Использовано **{total_notes}** из **{50}** слотов.\n"
+        f"📝 **Суммарный объем:** `{stats['total_chars']:,}` символов\n"
+        f"────────────────────\n"
+        f"**История действий (всего):**\n"
+        f"✅ Создано: **{stats['total_created']}**\n"
+        f"✍️ Изменено: **{stats['total_edited']}**\n"
+        f"❌ Удалено: **{stats['total_deleted']}**\n"
+        f"────────────────────\n"
+        f"**Активность за неделю:**\n"
+        f"✅ Создано: **{stats['weekly_created']}**\n"
+        f"✍️ Изменено: **{stats['weekly_edited']}**\n"
+        f"❌ Удалено: **{stats['weekly_deleted']}**"
+    )
+
+
+def _render_models(items: list[dict], auto: bool) -> str:
+    lines = ["Доступные модели:"]
+    for m in items:
+        star = "★" if m["active"] else " "
+        lines.append(f"{star} {m['id']}. {m['label']}  [{m['key']}]{_breaker_badge(m['key'])}")
+    lines.append("\nАктивировать: /model <ID> или /model auto" + (" (сейчас включено auto)" if auto else ""))
+    return "\n".join(lines)
+
+
+def _breaker_badge(model_key: str) -> str:
+    """Состояние circuit breaker модели; для исправной - пустая строка."""
+    snap = get_breaker(model_key).snapshot()
+    if snap["state"] == "open":
+        return f"  ⛔ недоступна (проверка через {snap['retry_in_s']} с)"
+    if snap["state"] == "half_open":
+        return "  ⚠️ пробный запрос"
+    if snap["failures"]:
+        return f"  ({snap['failures']}/{snap['calls']} сбоев)"
+    return ""
+
+
+def _is_admin(message: types.Message) -> bool:
+    return message.from_user.id in ADMIN_IDS
+
+
+def _render_limits(snap: dict) -> str:
+    stats = snap["stats"]
+    lines = [
+        "Лимитер запросов к OpenRouter:",
+        f"ждут сейчас: {snap['waiters']} из {snap['max_waiters']}",
+        f"пропущено: {stats.get('granted', 0)} (с ожиданием: {stats.get('waited', 0)}), "
+        f"отказано: {stats.get('rejected', 0)}, очередь полна: {stats.get('rejected_queue_full', 0)}",
+    ]
+    if not snap["buckets"]:
+        lines.append("Запросов ещё не было.")
+    for b in snap["buckets"]:
+        name = f" {b['name']}" if b["name"] else ""
+        lines.append(f"• {b['scope']}{name}: {b['tokens']}/{b['capacity']} ({b['rpm']}/мин)")
+    return "\n".join(lines)
+
+
+def _routed_model_key() -> str:
+    """Активная модель, а в режиме auto - самая быстрая исправная."""
+    active_key = get_active_model()["key"]
+    return llm.fastest_model(active_key) if is_auto_model() else active_key
+
+
+def _render_model_stats(models: list[dict], stats: dict[str, dict]) -> str:
+    lines = [f"Статистика моделей (последние {MODEL_STATS_WINDOW} вызовов каждой):"]
+    for m in models:
+        s = stats.get(m["key"])
+        if not s:
+            continue
+        speed = f"; ≈{s['tokens_per_s']:.0f} ток/с" if s["tokens_per_s"] else ""
+        latency = f"p50 {s['p50']} / p90 {s['p90']} / p99 {s['p99']} мс" if s["p50"] is not None else "нет успешных"
+        lines.append(f"• {m['id']}. {m['label']}: {latency}; ошибки {s['error_rate']:.0%} из {s['calls']}{speed}")
+    if len(lines) == 1:
+        lines.append("Вызовов ещё не было.")
+    return "\n".join(lines)
+
+
+# Не чаще чем раз в столько секунд правим сообщение с ответом (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL_S = float(os.getenv("STREAM_EDIT_INTERVAL_S", "1.0"))
+
+
+def _model_footer(requested: str, suffix: str = "") -> Callable[[llm.Answer], str]:
+    """Подпись с моделью, которая действительно ответила (с fallback или hedge может быть не запрошенная)."""
+    def footer(answer: llm.Answer) -> str:
+        text = f"модель: {answer.model}"
+        if answer.hedged:
+            text += f", ответила быстрее {requested}"
+        elif answer.model != requested:
+            text += f" вместо недоступной {requested}"
+        return text + suffix
+    return footer
+
+
+def _answer_timing(answer: llm.Answer) -> str:
+    if answer.cached:
+        return "из кэша"
+    return f"{answer.ms} мс; первый токен: {answer.ttft_ms if answer.ttft_ms is not None else answer.ms} мс"
+
+
+def _build_messages(user_id: int, user_text: str) -> list[dict]:
+    p = get_user_character(user_id)
+    return [
+        {"role": "system", "content": _character_system_prompt(p['name'], p['prompt'])},
+        {"role": "user", "content": user_text},
+    ]
+
+
+@lru_cache(maxsize=256)
+def _character_system_prompt(name: str, prompt: str) -> str:
+    # Промпт зависит только от персонажа - собираем один раз на персонажа, а не на каждый /ask
+    return (
+        f"Ты отвечаешь строго в образе персонажа: {name}.\n"
+        f"{prompt}\n\n"
+        "Правила:\n"
+        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости - переформулируй.\n"
+        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
+        "3) Не раскрывай, что ты 'играешь роль'.\n"
+        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
+        "5) Если стиль персонажа выражен слабо - переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
+    )
+
+
+def _build_messages_for_character(character: dict, user_text: str) -> list[dict]:
+    system = (
+        f"Ты отвечаешь строго в образе персонажа: {character['name']}.\n"
+        f"{character['prompt']}\n"
+        "Правила:\n"
+        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости – переформулируй.\n"
+        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
+        "3) Не раскрывай, что ты 'играешь роль'.\n"
+        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
+        "5) Если стиль персонажа выражен слабо – переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
+    )
+
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_text},
+    ]
+
+
+def _render_characters(items: list[dict], current: int | None) -> str:
+    lines = ["Доступные персонажи:"]
+    for p in items:
+        star = "★" if current is not None and p["id"] == current else ""
+        lines.append(f"{star}{p['id']}. {p['name']}")
+    lines.append("\nВыбор: /character <ID>")
+    return "\n".join(lines)
+
+
+# Общий дедлайн /ask_all (сек.): кто не ответил - помечается как не уложившийся
+ASK_ALL_DEADLINE_S = float(os.getenv("ASK_ALL_DEADLINE_S", "30"))
+
+
+# Сколько символов сообщения (из 4096) делить между ответами моделей
+ASK_ALL_TEXT_BUDGET = 3500
+
+
+def _parse_ask_all(text: str) -> tuple[list[int] | None, str]:
+    """"/ask_all 1,3 вопрос" -> ([1, 3], "вопрос"); без списка ID - (None, вопрос)."""
+    rest = text.replace("/ask_all", "", 1).strip()
+    ids_arg, _, tail = rest.partition(" ")
+    if re.fullmatch(r"\d+(,\d+)*", ids_arg):
+        return list(dict.fromkeys(int(x) for x in ids_arg.split(","))), tail.strip()
+    return None, rest
+
+
+def _ask_all_result(result: tuple[str, int] | Exception, budget: int) -> str:
+    if isinstance(result, Exception):
+        return f"❌ {result}"
+    text, ms = result
+    text = (text or "").strip()
+    return f"✅ {ms} мс\n{text[:budget]}{'…' if len(text) > budget else ''}"
+
+
+def _render_ask_all(models: list[dict], results: dict[str, str], deadline_s: float) -> str:
+    lines = [f"Ответы моделей ({len(results)}/{len(models)}, дедлайн {deadline_s:g} с):"]
+    for m in models:
+        lines.append(f"\n• {m['label']}: {results.get(m['key'], '⏳ ждём…')}")
+    return "\n".join(lines)[:4096]
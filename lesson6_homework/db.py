@@ -1,18 +1,135 @@
+import atexit
 import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 
 DB_PATH = os.getenv("DB_PATH", "bot.db")
+# Сколько соединений держит пул. TeleBot по умолчанию работает в 2 потоках,
+# запас нужен для фоновых задач и скриптов.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH, timeout=5.0)
+
+def _open_connection(path: str | None = None) -> sqlite3.Connection:
+    """Открывает новое соединение и выставляет PRAGMA (дорого - только для пула)."""
+    conn = sqlite3.connect(path or DB_PATH, timeout=5.0, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA journal_mode = WAL")
     conn.execute("PRAGMA busy_timeout = 5000")
     return conn
 
-def init_db():
-    schema = """
+
+class ConnectionPool:
+    """
+    Пул соединений SQLite.
+
+    Соединение открывается один раз: PRAGMA и кэш подготовленных выражений
+    (cached_statements) остаются "тёплыми" между вызовами. Поток держит
+    не больше одного соединения: повторный вход в connection() из того же
+    потока отдаёт уже выданное соединение, транзакцию закрывает внешний блок.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: list[sqlite3.Connection] = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _acquire(self) -> sqlite3.Connection:
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return _open_connection(self.path)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle.append(conn)
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            with conn:  # commit при успехе, rollback при исключении
+                yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул для текущего DB_PATH (при смене пути - например, в тестах - пересоздаётся)."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+def _connect():
+    return get_pool().connection()
+
+
+# Исходная схема: таблицы и справочники models/characters.
+# Идемпотентна - БД, созданные до появления миграций, проходят её без изменений.
+BASE_SCHEMA = """
     CREATE TABLE IF NOT EXISTS notes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -89,30 +206,509 @@ CREATE TABLE IF NOT EXISTS user_character (
 
 
     
-    """
+"""
+
+
+# Полнотекстовый индекс по заметкам (external content: текст хранится только в notes,
+# триггеры держат индекс в синхронизации с INSERT/UPDATE/DELETE).
+# user_id - индексируемая колонка: поиск ограничивается пользователем внутри MATCH
+# ("user_id:42 AND text:..."), FTS5 пересекает короткий список заметок пользователя
+# со списком слова, а не обходит совпадения всех пользователей с фильтрацией после JOIN.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    text,
+    user_id,
+    content='notes',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(rowid, text, user_id) VALUES (new.id, new.text, new.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF text ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id);
+    INSERT INTO notes_fts(rowid, text, user_id) VALUES (new.id, new.text, new.user_id);
+END;
+"""
+
+# Маркеры подсветки совпадений в snippet; в разметку их превращает бот
+SNIPPET_OPEN = "\x02"
+SNIPPET_CLOSE = "\x03"
+
+# Есть ли notes_fts в БД (по DB_PATH); заполняется init_db или при первом поиске
+_fts_state: dict[str, bool] = {}
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    """Собран ли SQLite с модулем FTS5."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _migrate_fts(conn: sqlite3.Connection) -> None:
+    # без FTS5 миграция ничего не создаёт, find_notes работает через LIKE
+    if fts5_available(conn):
+        _run_script(conn, FTS_SCHEMA)
+        # заметки, созданные до появления индекса
+        conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def _fts_ready(conn: sqlite3.Connection) -> bool:
+    ready = _fts_state.get(DB_PATH)
+    if ready is None:
+        ready = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'").fetchone() is not None
+        _fts_state[DB_PATH] = ready
+    return ready
+
+
+# Счётчики для /stats: итоги по пользователю и дневные корзины действий за последнюю неделю.
+# Обновляются триггерами в той же транзакции, что и запись в notes/stats.
+COUNTERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id       INTEGER PRIMARY KEY,
+    total_notes   INTEGER NOT NULL DEFAULT 0,
+    total_chars   INTEGER NOT NULL DEFAULT 0,
+    total_created INTEGER NOT NULL DEFAULT 0,
+    total_edited  INTEGER NOT NULL DEFAULT 0,
+    total_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    user_id INTEGER NOT NULL,
+    day     TEXT NOT NULL,
+    action  TEXT NOT NULL,
+    count   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, action)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS user_counters_notes_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO user_counters(user_id, total_notes, total_chars) VALUES (new.user_id, 1, length(new.text))
+    ON CONFLICT(user_id) DO UPDATE SET
+        total_notes = total_notes + 1,
+        total_chars = total_chars + length(new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_counters_notes_au AFTER UPDATE OF text ON notes BEGIN
+    UPDATE user_counters
+    SET total_chars = total_chars + length(new.text) - length(old.text)
+    WHERE user_id = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_counters_notes_ad AFTER DELETE ON notes BEGIN
+    UPDATE user_counters
+    SET total_notes = total_notes - 1,
+        total_chars = total_chars - length(old.text)
+    WHERE user_id = old.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_counters_stats_ai AFTER INSERT ON stats BEGIN
+    INSERT INTO user_counters(user_id, total_created, total_edited, total_deleted)
+    VALUES (new.user_id, new.action = 'create', new.action = 'edit', new.action = 'delete')
+    ON CONFLICT(user_id) DO UPDATE SET
+        total_created = total_created + (new.action = 'create'),
+        total_edited  = total_edited  + (new.action = 'edit'),
+        total_deleted = total_deleted + (new.action = 'delete');
+
+    INSERT INTO user_activity_daily(user_id, day, action, count)
+    VALUES (new.user_id, date(new.created_at), new.action, 1)
+    ON CONFLICT(user_id, day, action) DO UPDATE SET count = count + 1;
+
+    -- корзины старше недели больше не нужны
+    DELETE FROM user_activity_daily WHERE user_id = new.user_id AND day < date('now', '-8 days');
+END;
+"""
+
+# action из stats -> суффикс ключа в get_combined_stats
+_ACTION_SUFFIX = {"create": "created", "edit": "edited", "delete": "deleted"}
+
+
+def _migrate_counters(conn: sqlite3.Connection) -> None:
+    _run_script(conn, COUNTERS_SCHEMA)
+    _rebuild_counters(conn)
+
+
+def _rebuild_counters(conn: sqlite3.Connection, user_id: int | None = None) -> int:
+    params = {"uid": user_id}
+    conn.execute("DELETE FROM user_counters WHERE :uid IS NULL OR user_id = :uid", params)
+    cur = conn.execute(
+        """INSERT INTO user_counters(user_id, total_notes, total_chars, total_created, total_edited, total_deleted)
+        SELECT u.user_id,
+            COALESCE(n.cnt, 0), COALESCE(n.chars, 0),
+            COALESCE(s.created, 0), COALESCE(s.edited, 0), COALESCE(s.deleted, 0)
+        FROM (SELECT user_id FROM notes UNION SELECT user_id FROM stats) u
+        LEFT JOIN (
+            SELECT user_id, COUNT(id) AS cnt, SUM(LENGTH(text)) AS chars
+            FROM notes GROUP BY user_id
+        ) n ON n.user_id = u.user_id
+        LEFT JOIN (
+            SELECT user_id,
+                SUM(action = 'create') AS created,
+                SUM(action = 'edit') AS edited,
+                SUM(action = 'delete') AS deleted
+            FROM stats GROUP BY user_id
+        ) s ON s.user_id = u.user_id
+        WHERE :uid IS NULL OR u.user_id = :uid""",
+        params
+    )
+    rebuilt = cur.rowcount
+
+    conn.execute("DELETE FROM user_activity_daily WHERE :uid IS NULL OR user_id = :uid", params)
+    conn.execute(
+        """INSERT INTO user_activity_daily(user_id, day, action, count)
+        SELECT user_id, date(created_at), action, COUNT(id)
+        FROM stats
+        WHERE created_at >= date('now', '-8 days')
+        AND (:uid IS NULL OR user_id = :uid)
+        GROUP BY user_id, date(created_at), action""",
+        params
+    )
+    return rebuilt
+
+
+def rebuild_user_counters(user_id: int | None = None) -> int:
+    """Пересчитывает user_counters и дневные корзины из notes/stats. Возвращает число пользователей."""
     with _connect() as conn:
-        conn.executescript(schema)
+        conn.execute("BEGIN IMMEDIATE")
+        return _rebuild_counters(conn, user_id)
 
 
-def list_models() -> list[dict]:
+# Индексы под запросы по заметкам пользователя: (user_id, id) даёт COUNT для лимита,
+# проверку владельца и порядок ORDER BY id без сортировки; по stats - агрегаты по action.
+INDEXES_SCHEMA = """
+CREATE INDEX IF NOT EXISTS ix_notes_user_id ON notes(user_id, id);
+CREATE INDEX IF NOT EXISTS ix_stats_user_action ON stats(user_id, action, created_at);
+"""
+
+# Версия справочников models/characters: любой INSERT/UPDATE/DELETE увеличивает её
+# триггером, так кэши нескольких процессов бота узнают об изменениях.
+CATALOG_VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO meta(key, value) VALUES ('catalog_version', 0);
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_models_ai AFTER INSERT ON models BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_version_models_au AFTER UPDATE ON models BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_version_models_ad AFTER DELETE ON models BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_version_characters_ai AFTER INSERT ON characters BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_version_characters_au AFTER UPDATE ON characters BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_version_characters_ad AFTER DELETE ON characters BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+END;
+"""
+
+# Кэш ответов LLM: key - хэш (модель, сообщения, параметры), время - unix-секунды
+LLM_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key        TEXT PRIMARY KEY,
+    model      TEXT NOT NULL,
+    response   TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS ix_llm_cache_expires ON llm_cache(expires_at);
+"""
+
+# Телеметрия вызовов моделей: последние MODEL_STATS_WINDOW вызовов каждой модели.
+# tokens - число сгенерированных токенов (оценка), ms - полное время вызова.
+# meta.auto_model = 1 - /ask выбирает самую быструю исправную модель вместо активной
+TELEMETRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS model_calls (
+    id     INTEGER PRIMARY KEY,
+    model  TEXT NOT NULL,
+    ts     INTEGER NOT NULL,
+    ms     INTEGER NOT NULL,
+    ok     INTEGER NOT NULL,
+    tokens INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS ix_model_calls_model ON model_calls(model, id);
+
+INSERT OR IGNORE INTO meta(key, value) VALUES ('auto_model', 0);
+"""
+
+# Миграции схемы: версия = позиция в списке, текущая хранится в PRAGMA user_version.
+# Шаг - SQL-скрипт или функция, принимающая соединение. Только добавлять в конец!
+MIGRATIONS = [
+    BASE_SCHEMA,
+    _migrate_fts,
+    _migrate_counters,
+    INDEXES_SCHEMA,
+    CATALOG_VERSION_SCHEMA,
+    LLM_CACHE_SCHEMA,
+    TELEMETRY_SCHEMA,
+]
+
+
+def _run_script(conn: sqlite3.Connection, script: str) -> None:
+    # executescript делает COMMIT перед запуском, поэтому внутри транзакции
+    # миграции выполняем скрипт по одному выражению
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        conn.execute(statement)
+
+
+def schema_version() -> int:
     with _connect() as conn:
-        rows = conn.execute("SELECT id,key,label,active FROM models ORDER BY id").fetchall()
-        return [{"id":r["id"], "key":r["key"], "label":r["label"], "active":bool(r["active"])} for r in rows]
+        return conn.execute("PRAGMA user_version").fetchone()[0]
 
 
-def get_model_by_id(model_id: int) -> dict | None:
-    """Получает данные модели по ее числовому ID."""
+def migrate() -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает число применённых."""
+    applied = 0
     with _connect() as conn:
-        row = conn.execute(
-            "SELECT id, key, label FROM models WHERE id = ?",
-            (model_id,)
-        ).fetchone()
+        for version, step in enumerate(MIGRATIONS, start=1):
+            # BEGIN IMMEDIATE сериализует миграции между процессами:
+            # второй процесс дождётся блокировки и увидит уже новую версию
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                _run_script(conn, step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+            applied += 1
+    _fts_state.pop(DB_PATH, None)
+    return applied
 
-        if row:
-            return {"id": row["id"], "key": row["key"], "label": row["label"]}
+
+def init_db():
+    # обычный старт - одно чтение user_version
+    if schema_version() < len(MIGRATIONS):
+        migrate()
+
+
+NOTES_LIMIT = 50
+
+# Group commit: все изменения заметок/stats идут через один поток-писатель,
+# который собирает очередь за DB_WRITER_WINDOW_MS и коммитит её одной транзакцией.
+# DB_GROUP_COMMIT=0 - писать сразу из вызывающего потока, как раньше.
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "1") != "0"
+DB_WRITER_WINDOW_MS = float(os.getenv("DB_WRITER_WINDOW_MS", "2"))
+DB_WRITER_MAX_BATCH = int(os.getenv("DB_WRITER_MAX_BATCH", "64"))
+
+
+class GroupCommitWriter:
+    """
+    Один поток-писатель с очередью заявок.
+
+    Заявка - функция op(conn, *args); её результат (id заметки, bool) возвращается
+    вызывающему через Future только после COMMIT всей пачки. Каждая заявка
+    выполняется в своём SAVEPOINT: исключение откатывает только её.
+    Заявки выполняются по очереди, поэтому проверка лимита заметок внутри op
+    видит результаты предыдущих заявок той же пачки.
+    """
+
+    def __init__(self, window_ms: float = DB_WRITER_WINDOW_MS, max_batch: int = DB_WRITER_MAX_BATCH):
+        self.window_s = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.ops = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, op, *args) -> Future:
+        fut: Future = Future()
+        if threading.current_thread() is self._thread:
+            # заявка из другой заявки - выполняем сразу в текущей транзакции
+            with _connect() as conn:
+                fut.set_result(op(conn, *args))
+            return fut
+
+        self._ensure_started()
+        self._queue.put((op, args, fut))
+        return fut
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list) -> None:
+        outcomes = []
+        try:
+            with _connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for op, args, fut in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        result = op(conn, *args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        outcomes.append((fut, None, e))
+                    else:
+                        outcomes.append((fut, result, None))
+                    conn.execute("RELEASE op")
+        except Exception as e:
+            # не удалось закоммитить пачку - ошибка у всех
+            for _, _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        self.batches += 1
+        self.ops += len(batch)
+        for fut, result, error in outcomes:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+
+_writer = GroupCommitWriter()
+
+
+def _write(op, *args):
+    if not DB_GROUP_COMMIT:
+        with _connect() as conn:
+            return op(conn, *args)
+    return _writer.submit(op, *args).result()
+
+
+# Как часто (сек.) сверять версию справочников с БД. Между проверками
+# кэш отвечает без обращения к SQLite; свои изменения сбрасывают кэш сразу,
+# изменения других процессов (второй бот, webhook, скрипты) видны не позже чем через интервал.
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "1.0"))
+
+
+@dataclass(frozen=True)
+class _CatalogSnapshot:
+    path: str
+    version: int
+    models: list = field(default_factory=list)
+    characters: list = field(default_factory=list)
+    models_by_id: dict = field(default_factory=dict)
+    characters_by_id: dict = field(default_factory=dict)
+    auto_model: bool = False
+
+
+class CatalogCache:
+    """Кэш справочников models и characters с инвалидацией по meta.catalog_version."""
+
+    def __init__(self, check_interval: float = CATALOG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._snapshot: _CatalogSnapshot | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> _CatalogSnapshot:
+        snap = self._snapshot
+        if snap is not None and snap.path == DB_PATH and time.monotonic() - self._checked_at < self.check_interval:
+            self.hits += 1
+            return snap
+
+        with _connect() as conn, self._lock:
+            # версию читаем до данных: при гонке с записью кэш будет
+            # помечен старой версией и перечитается на следующей проверке
+            version = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()[0]
+            snap = self._snapshot
+            if snap is not None and snap.path == DB_PATH and snap.version == version:
+                self.hits += 1
+            else:
+                self.misses += 1
+                models = [
+                    {"id": r["id"], "key": r["key"], "label": r["label"], "active": bool(r["active"])}
+                    for r in conn.execute("SELECT id,key,label,active FROM models ORDER BY id")
+                ]
+                characters = [
+                    {"id": r["id"], "name": r["name"], "prompt": r["prompt"]}
+                    for r in conn.execute("SELECT id,name,prompt FROM characters ORDER BY id")
+                ]
+                auto = conn.execute("SELECT value FROM meta WHERE key = 'auto_model'").fetchone()
+                snap = _CatalogSnapshot(
+                    path=DB_PATH,
+                    version=version,
+                    models=models,
+                    characters=characters,
+                    models_by_id={m["id"]: m for m in models},
+                    characters_by_id={c["id"]: c for c in characters},
+                    auto_model=bool(auto and auto[0]),
+                )
+                self._snapshot = snap
+            self._checked_at = time.monotonic()
+        return snap
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {"hits": self.hits, "misses": self.misses, "version": snap.version if snap else None}
+
+
+_catalog = CatalogCache()
+
+
+def catalog_cache_stats() -> dict:
+    return _catalog.stats()
+
+
+def list_models() -> list[dict]:
+    return [dict(m) for m in _catalog.get().models]
+
+
+def get_model_by_id(model_id: int) -> dict | None:
+    """Получает данные модели по ее числовому ID."""
+    m = _catalog.get().models_by_id.get(model_id)
+    if m:
+        return {"id": m["id"], "key": m["key"], "label": m["label"]}
     return None
 
 def get_active_model() -> dict:
+    for m in _catalog.get().models:
+        if m["active"]:
+            return {"id":m["id"], "key":m["key"], "label":m["label"], "active":True}
+
     with _connect() as conn:
         row = conn.execute("SELECT id,key,label FROM models WHERE active=1").fetchone()
         if row:
@@ -121,7 +717,8 @@ def get_active_model() -> dict:
         if not row:
             raise RuntimeError("В реестре моделей нет записей")
         conn.execute("UPDATE models SET active=CASE WHEN id=? THEN 1 ELSE 0 END", (row["id"],))
-        return {"id":row["id"], "key":row["key"], "label":row["label"], "active":True}
+    _catalog.invalidate()
+    return {"id":row["id"], "key":row["key"], "label":row["label"], "active":True}
 
 
 def set_active_model(model_id: int) -> dict:
@@ -137,37 +734,138 @@ def set_active_model(model_id: int) -> dict:
         conn.execute("UPDATE models SET active = 0 WHERE active = 1")
 
         conn.execute("UPDATE models SET active = 1 WHERE id = ?", (model_id,))
+        # явный выбор модели выключает auto
+        conn.execute("UPDATE meta SET value = 0 WHERE key = 'auto_model'")
 
         conn.commit()
+        _catalog.invalidate()
 
         return get_active_model()
 
 
 
 
-def add_note(user_id: int, text: str) -> int:
+def set_auto_model(enabled: bool = True) -> None:
+    """Включает/выключает псевдомодель auto (активная модель при этом не меняется)."""
     with _connect() as conn:
-        cur_count = conn.execute(
-            "SELECT COUNT(id) FROM notes WHERE user_id = ?",
-            (user_id,)
-        )
-        count = cur_count.fetchone()[0]
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'auto_model'", (int(enabled),))
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'catalog_version'")
+    _catalog.invalidate()
 
-        if count >= 50:
-            return 0
 
-        cur = conn.execute(
-            "INSERT INTO notes(user_id, text) VALUES (?, ?)",
-            (user_id, text)
-        )
-        note_id = cur.lastrowid
+def is_auto_model() -> bool:
+    return _catalog.get().auto_model
+
+
+def _add_note_op(conn: sqlite3.Connection, user_id: int, text: str) -> int:
+    cur_count = conn.execute(
+        "SELECT COUNT(id) FROM notes WHERE user_id = ?",
+        (user_id,)
+    )
+    count = cur_count.fetchone()[0]
+
+    if count >= NOTES_LIMIT:
+        return 0
+
+    cur = conn.execute(
+        "INSERT INTO notes(user_id, text) VALUES (?, ?)",
+        (user_id, text)
+    )
+    note_id = cur.lastrowid
+
+    conn.execute(
+        "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'create', ?)",
+        (user_id, note_id)
+    )
+    return note_id
+
+
+def add_note(user_id: int, text: str) -> int:
+    return _write(_add_note_op, user_id, text)
+
+
+IMPORT_BATCH_SIZE = 100
+# Длиннее сообщения Telegram заметку не импортируем: её нельзя было бы ни показать, ни отредактировать
+NOTE_MAX_LENGTH = 4096
+
+
+class ImportInterrupted(Exception):
+    """Чтение импорта оборвалось ошибкой error; reports - пачки, записанные до неё."""
+
+    def __init__(self, reports: list[dict], error: Exception):
+        super().__init__(str(error))
+        self.reports = reports
+        self.error = error
+
+
+def _import_batch_op(conn: sqlite3.Connection, user_id: int, items: list[tuple[str, str | None]]) -> dict:
+    # лимит проверяем один раз на пачку
+    count = conn.execute("SELECT COUNT(id) FROM notes WHERE user_id = ?", (user_id,)).fetchone()[0]
+    accepted = items[:max(NOTES_LIMIT - count, 0)]
 
+    if accepted:
+        # AUTOINCREMENT: новые id больше любого существующего, по ним и пишем stats
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notes WHERE user_id = ?", (user_id,)).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO notes(user_id, text, created_at) VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+            [(user_id, text, created_at) for text, created_at in accepted]
+        )
         conn.execute(
-            "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'create', ?)",
-            (user_id, note_id)
+            """INSERT INTO stats(user_id, action, note_id)
+            SELECT user_id, 'create', id FROM notes WHERE user_id = ? AND id > ? ORDER BY id""",
+            (user_id, last_id)
         )
+    return {"imported": len(accepted), "skipped_limit": len(items) - len(accepted)}
 
-    return note_id
+
+def import_notes(user_id: int, notes, batch_size: int = IMPORT_BATCH_SIZE) -> list[dict]:
+    """
+    Массовый импорт: notes - итерируемое строк или dict с "text" (и "created_at").
+    Пишет пачками по batch_size (executemany + stats в одной транзакции).
+    Возвращает отчёт по каждой пачке: imported, skipped_empty, skipped_long, skipped_limit.
+    Если notes бросает исключение (битый файл), прочитанное до него записывается,
+    а наружу уходит ImportInterrupted с отчётом по уже записанным пачкам.
+    """
+    reports = []
+    batch: list[tuple[str, str | None]] = []
+    skipped_empty = skipped_long = 0
+
+    def flush():
+        report = _write(_import_batch_op, user_id, batch) if batch else {"imported": 0, "skipped_limit": 0}
+        report["batch"] = len(reports) + 1
+        report["skipped_empty"] = skipped_empty
+        report["skipped_long"] = skipped_long
+        reports.append(report)
+
+    notes = iter(notes)
+    while True:
+        try:
+            note = next(notes, None)
+        except Exception as e:
+            if batch or skipped_empty or skipped_long:
+                flush()
+            raise ImportInterrupted(reports, e) from e
+        if note is None:
+            break
+
+        if isinstance(note, str):
+            text, created_at = note, None
+        else:
+            text, created_at = note.get("text") or "", note.get("created_at")
+        text = text.strip()
+        if not text:
+            skipped_empty += 1
+        elif len(text) > NOTE_MAX_LENGTH:
+            skipped_long += 1
+        else:
+            batch.append((text, created_at))
+        if len(batch) + skipped_empty + skipped_long >= batch_size:
+            flush()
+            batch, skipped_empty, skipped_long = [], 0, 0
+
+    if batch or skipped_empty or skipped_long:
+        flush()
+    return reports
 
 
 def list_notes(user_id: int, limit: int = 10):
@@ -180,44 +878,151 @@ def list_notes(user_id: int, limit: int = 10):
             LIMIT ?""",
             (user_id, limit)
         )
-    return cur.fetchall()
+        return cur.fetchall()
 
 
-def update_note(user_id: int, note_id: int, text: str) -> bool:
+def list_notes_page(user_id: int, before_id: int | None = None, limit: int = 10,
+                    after_id: int | None = None) -> dict:
+    """
+    Страница заметок от новых к старым (keyset-пагинация по id, без OFFSET).
+    before_id - страница более старых заметок, after_id - более новых.
+    Если за курсором заметок не осталось (их удалили), отдаётся крайняя
+    непустая страница в ту же сторону - кнопки навигации не пропадают.
+    Возвращает {"notes": [...], "has_older": bool, "has_newer": bool}.
+    """
+    newer_than = """SELECT id, text, created_at
+                FROM notes
+                WHERE user_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?"""
+    older_than = """SELECT id, text, created_at
+                FROM notes
+                WHERE user_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?"""
     with _connect() as conn:
-        cur = conn.execute(
-            """UPDATE notes
-            SET text = ?
-            WHERE user_id = ? AND id = ?""",
-            (text, user_id, note_id)
+        if after_id is not None:
+            rows = conn.execute(newer_than, (user_id, after_id, limit)).fetchall()[::-1]
+            if not rows:
+                # новее курсора ничего нет - первая страница
+                rows = conn.execute(older_than, (user_id, 2 ** 63 - 1, limit)).fetchall()
+        else:
+            rows = conn.execute(older_than, (user_id, before_id if before_id is not None else 2 ** 63 - 1,
+                                             limit)).fetchall()
+            if not rows and before_id is not None:
+                # старее курсора ничего нет - последняя страница
+                rows = conn.execute(newer_than, (user_id, 0, limit)).fetchall()[::-1]
+
+        if rows:
+            oldest, newest = rows[-1]["id"], rows[0]["id"]
+        else:
+            oldest = newest = None
+
+        has_older = oldest is not None and conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM notes WHERE user_id = ? AND id < ?)", (user_id, oldest)
+        ).fetchone()[0] == 1
+        has_newer = newest is not None and conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM notes WHERE user_id = ? AND id > ?)", (user_id, newest)
+        ).fetchone()[0] == 1
+
+    return {"notes": rows, "has_older": has_older, "has_newer": has_newer}
+
+
+def get_note(user_id: int, note_id: int):
+    """Одна заметка пользователя или None, если её нет или она чужая."""
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT id, text, created_at FROM notes WHERE user_id = ? AND id = ?",
+            (user_id, note_id)
+        ).fetchone()
+
+
+def _update_note_op(conn: sqlite3.Connection, user_id: int, note_id: int, text: str) -> bool:
+    cur = conn.execute(
+        """UPDATE notes
+        SET text = ?
+        WHERE user_id = ? AND id = ?""",
+        (text, user_id, note_id)
+    )
+    if cur.rowcount > 0:
+        conn.execute(
+            "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'edit', ?)",
+            (user_id, note_id)
         )
-        if cur.rowcount > 0:
-            conn.execute(
-                "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'edit', ?)",
-                (user_id, note_id)
-            )
-            return True
+        return True
     return False
 
 
-def delete_note(user_id: int, note_id: int) -> bool:
-    with _connect() as conn:
-        cur_check = conn.execute("SELECT id FROM notes WHERE user_id = ? AND id = ?", (user_id, note_id))
-        if cur_check.fetchone():
-            conn.execute(
-                "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'delete', ?)",
-                (user_id, note_id)
-            )
-            cur_del = conn.execute(
-                "DELETE FROM notes WHERE user_id = ? AND id = ?",
-                (user_id, note_id)
-            )
-            return cur_del.rowcount > 0
+def update_note(user_id: int, note_id: int, text: str) -> bool:
+    return _write(_update_note_op, user_id, note_id, text)
+
+
+def _delete_note_op(conn: sqlite3.Connection, user_id: int, note_id: int) -> bool:
+    cur_check = conn.execute("SELECT id FROM notes WHERE user_id = ? AND id = ?", (user_id, note_id))
+    if cur_check.fetchone():
+        conn.execute(
+            "INSERT INTO stats(user_id, action, note_id) VALUES (?, 'delete', ?)",
+            (user_id, note_id)
+        )
+        cur_del = conn.execute(
+            "DELETE FROM notes WHERE user_id = ? AND id = ?",
+            (user_id, note_id)
+        )
+        return cur_del.rowcount > 0
     return False
 
 
+def delete_note(user_id: int, note_id: int) -> bool:
+    return _write(_delete_note_op, user_id, note_id)
+
+
+def _fts_query(query_text: str) -> str:
+    # Каждое слово - префиксный поиск ("слово"*) по колонке text, слова объединяются через AND.
+    # Кавычки и операторы FTS5 из пользовательского ввода отбрасываются.
+    words = re.findall(r"\w+", query_text)
+    if not words:
+        return ""
+    return "text: (" + " ".join(f'"{word}"*' for word in words) + ")"
+
+
+def _like_snippet(text: str, query_text: str, width: int = 60) -> str:
+    pos = text.lower().find(query_text.lower())
+    if pos < 0:
+        return text[:width * 2]
+    start = max(pos - width, 0)
+    end = min(pos + len(query_text) + width, len(text))
+    return (
+        ("…" if start > 0 else "")
+        + text[start:pos]
+        + SNIPPET_OPEN + text[pos:pos + len(query_text)] + SNIPPET_CLOSE
+        + text[pos + len(query_text):end]
+        + ("…" if end < len(text) else "")
+    )
+
+
 def find_notes(user_id: int, query_text: str, limit: int = 10):
+    """
+    Поиск по заметкам пользователя: FTS5 с сортировкой по BM25 и snippet,
+    совпадения в snippet обрамлены SNIPPET_OPEN/SNIPPET_CLOSE.
+    Пользователь задаётся внутри MATCH; глобальными остаются IDF для bm25 и
+    раскрытие префикса - они читают список документов слова целиком (см. bench_fts.py).
+    Если FTS5 недоступен (или в запросе нет слов) - поиск подстроки через LIKE.
+    """
+    match = _fts_query(query_text)
     with _connect() as conn:
+        if match and _fts_ready(conn):
+            cur = conn.execute(
+                """SELECT n.id, n.text,
+                    snippet(notes_fts, 0, ?, ?, '…', 12) AS snippet
+                FROM notes_fts
+                JOIN notes n ON n.id = notes_fts.rowid
+                WHERE notes_fts MATCH ?
+                ORDER BY bm25(notes_fts, 1.0, 0.0)
+                LIMIT ?""",
+                (SNIPPET_OPEN, SNIPPET_CLOSE, f'user_id: "{int(user_id)}" AND {match}', limit)
+            )
+            return cur.fetchall()
+
         cur = conn.execute(
             """SELECT id, text
             FROM notes
@@ -227,7 +1032,10 @@ def find_notes(user_id: int, query_text: str, limit: int = 10):
             LIMIT ?""",
             (user_id, query_text, limit)
         )
-    return cur.fetchall()
+        return [
+            {"id": r["id"], "text": r["text"], "snippet": _like_snippet(r["text"], query_text)}
+            for r in cur.fetchall()
+        ]
 
 
 def list_all_notes(user_id: int):
@@ -240,7 +1048,26 @@ def list_all_notes(user_id: int):
             ORDER BY id ASC""",
             (user_id,)
         )
-    return cur.fetchall()
+        return cur.fetchall()
+
+
+def iter_notes(user_id: int, chunk_size: int = 100):
+    """Все заметки пользователя по возрастанию id, порциями: соединение не держится между yield."""
+    last_id = 0
+    while True:
+        with _connect() as conn:
+            rows = conn.execute(
+                """SELECT id, text, created_at
+                FROM notes
+                WHERE user_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?""",
+                (user_id, last_id, chunk_size)
+            ).fetchall()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]["id"]
 
 
 def get_combined_stats(user_id: int):
@@ -256,50 +1083,186 @@ def get_combined_stats(user_id: int):
         'weekly_deleted': 0,
     }
     with _connect() as conn:
-        cur_notes = conn.execute(
-            "SELECT COUNT(id) as count, SUM(LENGTH(text)) as chars FROM notes WHERE user_id = ?",
+        row = conn.execute(
+            """SELECT total_notes, total_chars, total_created, total_edited, total_deleted
+            FROM user_counters
+            WHERE user_id = ?""",
             (user_id,)
-        )
-        notes_row = cur_notes.fetchone()
-        if notes_row and notes_row['count'] > 0:
-            stats['total_notes'] = notes_row['count']
-            stats['total_chars'] = notes_row['chars']
-
-        cur_log = conn.execute(
-            """SELECT
-                action,
-                COUNT(id) as total_count,
-                SUM(CASE WHEN created_at >= datetime('now', '-7 days') THEN 1 ELSE 0 END) as weekly_count
-            FROM
-                stats
-            WHERE
-                user_id = ?
-            GROUP BY
-                action""",
+        ).fetchone()
+        if row:
+            stats.update(dict(row))
+
+        cur_week = conn.execute(
+            """SELECT action, SUM(count) AS weekly_count
+            FROM user_activity_daily
+            WHERE user_id = ?
+            AND day > date('now', '-7 days')
+            GROUP BY action""",
             (user_id,)
         )
-        for row in cur_log.fetchall():
-            action = row['action']
+        for row in cur_week.fetchall():
+            suffix = _ACTION_SUFFIX.get(row['action'])
+            if suffix:
+                stats[f"weekly_{suffix}"] = row['weekly_count']
+
+    return stats
+
+
+def llm_cache_get(key: str) -> str | None:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT response FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, int(time.time()))
+        ).fetchone()
+    return row["response"] if row else None
+
+
+def _llm_cache_put_op(conn: sqlite3.Connection, key: str, model: str, response: str, ttl_s: int) -> None:
+    now = int(time.time())
+    conn.execute(
+        """INSERT OR REPLACE INTO llm_cache(key, model, response, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?)""",
+        (key, model, response, now, now + ttl_s)
+    )
+
+
+def llm_cache_put(key: str, model: str, response: str, ttl_s: int) -> None:
+    _write(_llm_cache_put_op, key, model, response, ttl_s)
+
+
+def _llm_cache_evict_op(conn: sqlite3.Connection, max_rows: int) -> int:
+    removed = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (int(time.time()),)).rowcount
+    # TTL у всех записей одинаковый, поэтому порядок expires_at - это порядок вставки
+    removed += conn.execute(
+        """DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY expires_at
+            LIMIT MAX((SELECT COUNT(*) FROM llm_cache) - ?, 0)
+        )""",
+        (max_rows,)
+    ).rowcount
+    return removed
+
+
+def llm_cache_evict(max_rows: int) -> int:
+    """Удаляет просроченные ответы и самые старые сверх max_rows. Возвращает число удалённых."""
+    return _write(_llm_cache_evict_op, max_rows)
+
+
+MODEL_STATS_WINDOW = int(os.getenv("MODEL_STATS_WINDOW", "200"))
+
+
+def _record_model_call_op(conn: sqlite3.Connection, model: str, ms: int, ok: bool, tokens: int | None,
+                          window: int) -> None:
+    conn.execute(
+        "INSERT INTO model_calls(model, ts, ms, ok, tokens) VALUES (?, ?, ?, ?, ?)",
+        (model, int(time.time()), ms, int(ok), tokens)
+    )
+    # окно скользящее: всё старше последних window вызовов модели удаляем
+    conn.execute(
+        """DELETE FROM model_calls WHERE model = ? AND id <= (
+            SELECT id FROM model_calls WHERE model = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+        )""",
+        (model, model, window)
+    )
+
+
+def record_model_call(model: str, ms: int, ok: bool, tokens: int | None = None) -> None:
+    _write(_record_model_call_op, model, ms, ok, tokens, MODEL_STATS_WINDOW)
+
 
-            stats[f"total_{action}"] = row['total_count']
-            stats[f"weekly_{action}"] = row['weekly_count']
+def _percentile(sorted_values: list[int], q: float) -> int | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
 
+
+def model_stats() -> dict[str, dict]:
+    """
+    По каждой модели из model_calls: число вызовов и ошибок, доля ошибок,
+    p50/p90/p99 времени успешных вызовов (мс) и токенов в секунду.
+    """
+    calls: dict[str, list] = {}
+    with _connect() as conn:
+        for r in conn.execute("SELECT model, ms, ok, tokens FROM model_calls ORDER BY model"):
+            calls.setdefault(r["model"], []).append((r["ms"], r["ok"], r["tokens"]))
+
+    stats = {}
+    for model, rows in calls.items():
+        ok_ms = sorted(ms for ms, ok, _ in rows if ok)
+        with_tokens = [(ms, tokens) for ms, ok, tokens in rows if ok and tokens]
+        gen_s = sum(ms for ms, _ in with_tokens) / 1000
+        stats[model] = {
+            "calls": len(rows),
+            "errors": len(rows) - len(ok_ms),
+            "error_rate": (len(rows) - len(ok_ms)) / len(rows),
+            "p50": _percentile(ok_ms, 0.5),
+            "p90": _percentile(ok_ms, 0.9),
+            "p99": _percentile(ok_ms, 0.99),
+            "tokens_per_s": sum(t for _, t in with_tokens) / gen_s if gen_s else None,
+        }
     return stats
 
 
 def list_characters() -> list[dict]:
-    with _connect() as conn:
-        rows = conn.execute("SELECT id,name FROM characters ORDER BY id").fetchall()
-        return [{"id":r["id"], "name":r["name"]} for r in rows]
+    return [{"id":c["id"], "name":c["name"]} for c in _catalog.get().characters]
 
 
 def get_character_by_id(character_id: int) -> dict | None:
-    with _connect() as conn:
-        row = conn.execute(
-            "SELECT id,name,prompt FROM characters WHERE id=?",
-            (character_id,)
-        ).fetchone()
-        return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]} if row else None
+    c = _catalog.get().characters_by_id.get(character_id)
+    return dict(c) if c else None
+
+
+# Сколько пользователей держать в LRU выбора персонажа. Запись - это id пользователя
+# и id персонажа (~100 байт), сам персонаж общий и берётся из кэша справочников.
+USER_CHARACTER_CACHE_SIZE = int(os.getenv("USER_CHARACTER_CACHE_SIZE", "100000"))
+# Сколько секунд запись живёт в LRU. set_user_character обновляет кэш своего процесса сразу,
+# выбор, сделанный в другом процессе с тем же файлом БД, виден не позже чем через TTL.
+USER_CHARACTER_CACHE_TTL = float(os.getenv("USER_CHARACTER_CACHE_TTL", "30"))
+
+
+class UserCharacterCache:
+    """LRU telegram_user_id -> character_id (None - у пользователя нет выбора, нужен персонаж по-умолчанию)."""
+
+    def __init__(self, capacity: int = USER_CHARACTER_CACHE_SIZE, ttl: float = USER_CHARACTER_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[tuple[str, int], tuple[int | None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> tuple[bool, int | None]:
+        key = (DB_PATH, user_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, user_id: int, character_id: int | None) -> None:
+        if self.capacity <= 0:
+            return
+        key = (DB_PATH, user_id)
+        with self._lock:
+            self._data[key] = (character_id, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "capacity": self.capacity}
+
+
+_user_characters = UserCharacterCache()
+
+
+def user_character_cache_stats() -> dict:
+    return _user_characters.stats()
 
 
 def set_user_character(user_id: int, character_id: int) -> dict:
@@ -315,33 +1278,40 @@ ON CONFLICT(telegram_user_id) DO UPDATE SET character_id=excluded.character_id
             """,
             (user_id, character_id)
         )
+    _user_characters.put(user_id, character_id)
     return character
 
 
 def get_user_character(user_id: int) -> dict:
-    with _connect() as conn:
-        row = conn.execute(
-            """
-SELECT p.id, p.name, p.prompt
-FROM user_character up
-JOIN characters p ON p.id = up.character_id
-WHERE up.telegram_user_id = ?
-            """,
-            (user_id,)
-        ).fetchone()
-        if row:
-            return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
+    found, character_id = _user_characters.get(user_id)
+    if not found:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT character_id FROM user_character WHERE telegram_user_id = ?",
+                (user_id,)
+            ).fetchone()
+        character_id = row["character_id"] if row else None
+        _user_characters.put(user_id, character_id)
+
+    catalog = _catalog.get()
+    character = catalog.characters_by_id.get(character_id) if character_id is not None else None
+    if character is None:
         # по-умолчанию - id=1, иначе первая запись
-        row = conn.execute("SELECT id,name,prompt FROM characters WHERE id=1").fetchone()
-        if row:
-            return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
-        row = conn.execute("SELECT id,name,prompt FROM characters ORDER BY id LIMIT 1").fetchone()
-        if not row:
-            raise RuntimeError("Таблица characters пуста")
-        return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
+        character = catalog.characters_by_id.get(1) or (catalog.characters[0] if catalog.characters else None)
+    if character is None:
+        raise RuntimeError("Таблица characters пуста")
+    return dict(character)
 
 
 def get_character_prompt_for_user(user_id: int) -> str:
     return get_user_character(user_id)["prompt"]
 
 
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["rebuild_counters"]:
+        init_db()
+        print(f"Счётчики пересчитаны для {rebuild_user_counters()} пользователей")
+    else:
+        print("Использование: python db.py rebuild_counters")
@@ -0,0 +1,650 @@
+"""
+Слой между обработчиками бота и openrouter.
+
+Кэш ответов: LRU в памяти процесса перед таблицей llm_cache в SQLite.
+Ключ - канонический хэш (модель, сообщения, temperature, max_tokens).
+
+Fallback: если у запрошенной модели разомкнут circuit breaker (или она упала
+до первого токена), ответ берётся у следующей здоровой модели из db.list_models().
+
+Hedging (LLM_HEDGE=1): если основная модель не ответила (не дала первый токен)
+за свой p90 задержки, тот же запрос уходит второй модели; кто ответил первым -
+тот и победил, поток проигравшего закрывается.
+
+Телеметрия: каждый вызов модели (время, успех, оценка числа токенов) пишется
+в model_calls; по ней /model_stats и выбор самой быстрой модели для auto.
+
+aask - то же для asyncio (main_async.py): кэш, fallback и телеметрия, HTTP через
+openrouter_async, обращения к SQLite - через run_blocking (пул потоков).
+Hedging и single-flight есть только в синхронном ask.
+
+Single-flight: одинаковые запросы (тот же ключ кэша), пришедшие, пока первый
+ещё выполняется, не идут к провайдеру, а ждут его результат (и куски потока).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List
+
+import db
+from openrouter import OpenRouterError, RateLimitExceeded, StreamHandle, chat_once, chat_stream, get_breaker, \
+    is_model_failure
+from openrouter_async import achat_once, achat_stream
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL_S = int(os.getenv("LLM_CACHE_TTL_S", str(24 * 3600)))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024"))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "10000"))
+# Раз в сколько записей в кэш чистить таблицу от просроченных и лишних строк
+LLM_CACHE_EVICT_EVERY = 100
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+# Вторая модель для hedging; пусто - следующая исправная из таблицы models
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "")
+# Порог hedging - этот квантиль задержки основной модели, но не меньше LLM_HEDGE_MIN_MS;
+# пока замеров меньше LLM_HEDGE_MIN_SAMPLES - LLM_HEDGE_DEFAULT_MS
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))
+LLM_HEDGE_MIN_MS = int(os.getenv("LLM_HEDGE_MIN_MS", "1000"))
+LLM_HEDGE_DEFAULT_MS = int(os.getenv("LLM_HEDGE_DEFAULT_MS", "8000"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+
+LLM_TELEMETRY = os.getenv("LLM_TELEMETRY", "1") != "0"
+# Грубая оценка: символов на токен (точное число токенов провайдер в потоке не сообщает)
+CHARS_PER_TOKEN = 4
+# auto: модель участвует в выборе, если у неё не меньше AUTO_MIN_CALLS вызовов
+# и доля ошибок не выше AUTO_MAX_ERROR_RATE; статистика перечитывается раз в AUTO_STATS_TTL_S сек.
+AUTO_MIN_CALLS = int(os.getenv("AUTO_MIN_CALLS", "5"))
+AUTO_MAX_ERROR_RATE = float(os.getenv("AUTO_MAX_ERROR_RATE", "0.3"))
+AUTO_STATS_TTL_S = float(os.getenv("AUTO_STATS_TTL_S", "10"))
+
+
+@dataclass
+class Answer:
+    text: str
+    ms: int
+    model: str
+    ttft_ms: int | None = None
+    cached: bool = False
+    # ответила hedge-модель: запрошенная была медленной, а не недоступной
+    hedged: bool = False
+
+
+def request_key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    canonical = json.dumps(
+        {
+            "model": model,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "temperature": round(float(temperature), 4),
+            "max_tokens": int(max_tokens),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Двухуровневый кэш ответов: LRU в памяти -> llm_cache в SQLite (общий для процессов)."""
+
+    def __init__(self, capacity: int = LLM_CACHE_MEMORY_SIZE, ttl_s: int = LLM_CACHE_TTL_S,
+                 max_rows: int = LLM_CACHE_MAX_ROWS):
+        self.capacity = capacity
+        self.ttl_s = ttl_s
+        self.max_rows = max_rows
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._data: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        mkey = (db.DB_PATH, key)
+        with self._lock:
+            entry = self._data.get(mkey)
+            if entry is not None:
+                text, expires_at = entry
+                if expires_at > time.time():
+                    self._data.move_to_end(mkey)
+                    self.memory_hits += 1
+                    return text
+                del self._data[mkey]
+
+        text = db.llm_cache_get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self._remember(mkey, text)
+        return text
+
+    def put(self, key: str, model: str, text: str) -> None:
+        self._remember((db.DB_PATH, key), text)
+        db.llm_cache_put(key, model, text, self.ttl_s)
+        self._puts += 1
+        if self._puts % LLM_CACHE_EVICT_EVERY == 0:
+            db.llm_cache_evict(self.max_rows)
+
+    def _remember(self, mkey: tuple[str, str], text: str) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._data[mkey] = (text, time.time() + self.ttl_s)
+            self._data.move_to_end(mkey)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "size": len(self._data),
+        }
+
+
+cache = ResponseCache()
+
+
+class LatencyTracker:
+    """Последние LATENCY_WINDOW задержек (мс) по каждой модели."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ms: int) -> None:
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(ms)
+
+    def quantile(self, model: str, q: float) -> int | None:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+latency = LatencyTracker()
+# requests - запросы с hedging, hedged - сколько раз запущена вторая модель,
+# hedge_wins / primary_wins - чей ответ пришёл первым после запуска второй
+hedge_metrics: Counter[str] = Counter()
+_hedge_lock = threading.Lock()
+
+
+def _hedge_inc(key: str) -> None:
+    with _hedge_lock:
+        hedge_metrics[key] += 1
+
+
+def hedge_stats() -> dict:
+    with _hedge_lock:
+        stats = dict(hedge_metrics)
+    requests, hedged = stats.get("requests", 0), stats.get("hedged", 0)
+    return {
+        "requests": requests,
+        "hedged": hedged,
+        "hedge_wins": stats.get("hedge_wins", 0),
+        "primary_wins": stats.get("primary_wins", 0),
+        "hedge_rate": hedged / requests if requests else 0.0,
+    }
+
+
+def hedge_threshold_ms(model: str) -> int:
+    observed = latency.quantile(model, LLM_HEDGE_QUANTILE)
+    if observed is None:
+        return LLM_HEDGE_DEFAULT_MS
+    return max(observed, LLM_HEDGE_MIN_MS)
+
+
+def record_call(model: str, ms: int, error: BaseException | None = None, text: str = "") -> None:
+    """Вызов модели в телеметрию (ошибки не по вине модели не пишутся)."""
+    if not LLM_TELEMETRY or (error is not None and not is_model_failure(error)):
+        return
+    tokens = max(1, round(len(text) / CHARS_PER_TOKEN)) if error is None and text else None
+    try:
+        db.record_model_call(model, ms, error is None, tokens)
+    except Exception as e:
+        # телеметрия не должна ломать ответ
+        print(f"Не удалось записать телеметрию {model}: {e}")
+
+
+_stats_cache: tuple[float, str, dict] | None = None
+_stats_lock = threading.Lock()
+
+
+def recent_model_stats() -> dict[str, dict]:
+    """db.model_stats(), перечитываемая не чаще раза в AUTO_STATS_TTL_S."""
+    global _stats_cache
+    with _stats_lock:
+        cached = _stats_cache
+        if cached is not None and cached[1] == db.DB_PATH and time.monotonic() < cached[0]:
+            return cached[2]
+        stats = db.model_stats()
+        _stats_cache = (time.monotonic() + AUTO_STATS_TTL_S, db.DB_PATH, stats)
+        return stats
+
+
+def fastest_model(default: str) -> str:
+    """
+    Для auto: исправная модель (breaker закрыт, ошибок не больше AUTO_MAX_ERROR_RATE)
+    с наименьшим p50. Пока ни у одной нет AUTO_MIN_CALLS замеров - default.
+    """
+    stats = recent_model_stats()
+    best: tuple[int, str] | None = None
+    for m in db.list_models():
+        s = stats.get(m["key"])
+        if (not s or s["calls"] - s["errors"] < AUTO_MIN_CALLS or s["error_rate"] > AUTO_MAX_ERROR_RATE
+                or get_breaker(m["key"]).state != "closed"):
+            continue
+        if best is None or s["p50"] < best[0]:
+            best = (s["p50"], m["key"])
+    return best[1] if best else default
+
+
+def _pick_hedge_model(model: str) -> str | None:
+    candidates = [LLM_HEDGE_MODEL] if LLM_HEDGE_MODEL else [m["key"] for m in db.list_models()]
+    for key in candidates:
+        if key and key != model and get_breaker(key).state == "closed":
+            return key
+    return None
+
+
+def ask(messages: List[Dict], *,
+        model: str,
+        temperature: float = 0.2,
+        max_tokens: int = 400,
+        on_delta: Callable[[str], None] | None = None,
+        fallback: bool = False,
+        hedge: bool = False) -> Answer:
+    """
+    Ответ модели с учётом кэша. С on_delta ответ запрашивается потоком и
+    on_delta вызывается на каждый кусок текста (при попадании в кэш - не вызывается).
+
+    С fallback=True модели с разомкнутым breaker или исчерпанным лимитом запросов
+    пропускаются, а при сбое модели до первого куска текста запрос уходит следующей;
+    Answer.model - кто ответил.
+    С hedge=True (и LLM_HEDGE=1) медленной модели страхуется второй моделью.
+    """
+    hedge = hedge and LLM_HEDGE_ENABLED
+    if not fallback:
+        return _ask_one(messages, model=model, temperature=temperature, max_tokens=max_tokens, on_delta=on_delta,
+                        hedge=hedge)
+
+    emitted = False
+
+    def tracked(delta: str) -> None:
+        nonlocal emitted
+        emitted = True
+        on_delta(delta)
+
+    last_error: Exception | None = None
+    for candidate in _fallback_chain(model):
+        try:
+            return _ask_one(messages, model=candidate, temperature=temperature, max_tokens=max_tokens,
+                            on_delta=tracked if on_delta else None, check_breaker=True, hedge=hedge)
+        except _BreakerOpen:
+            continue
+        except RateLimitExceeded as e:
+            # кончился лимит этой модели - у следующей он свой; общий лимит и лимит ключа - для всех
+            if e.scope != "model":
+                raise
+            last_error = e
+            continue
+        except Exception as e:
+            if emitted or not is_model_failure(e):
+                raise
+            last_error = e
+    if last_error is not None:
+        raise last_error
+    raise OpenRouterError(503, "Все модели временно недоступны. Попробуйте позже.")
+
+
+class _BreakerOpen(Exception):
+    pass
+
+
+def _fallback_chain(model: str) -> List[str]:
+    """Запрошенная модель, за ней остальные в порядке таблицы models."""
+    return [model] + [m["key"] for m in db.list_models() if m["key"] != model]
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.parts: list[str] = []
+        self.done = False
+        self.answer: Answer | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Один вызов на ключ: первый поток (ведущий) выполняет fn, остальные с тем же
+    ключом ждут его и получают тот же Answer или то же исключение. Куски потока
+    ведущего пересылаются в on_delta ожидающих.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[Callable[[str], None] | None], Answer],
+           on_delta: Callable[[str], None] | None = None) -> Answer:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if leader:
+            return self._lead(key, flight, fn, on_delta)
+        return self._follow(flight, on_delta)
+
+    def _lead(self, key: str, flight: _Flight, fn, on_delta) -> Answer:
+        def relay(delta: str) -> None:
+            with flight.cond:
+                flight.parts.append(delta)
+                flight.cond.notify_all()
+            if on_delta is not None:
+                on_delta(delta)
+
+        try:
+            flight.answer = fn(relay)
+            return flight.answer
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    @staticmethod
+    def _follow(flight: _Flight, on_delta) -> Answer:
+        seen = 0
+        while True:
+            with flight.cond:
+                flight.cond.wait_for(lambda: flight.done or len(flight.parts) > seen)
+                fresh = flight.parts[seen:]
+                done = flight.done
+            seen += len(fresh)
+            if on_delta is not None:
+                for delta in fresh:
+                    on_delta(delta)
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return flight.answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"upstream_calls": self.leaders, "saved_calls": self.shared, "in_flight": len(self._flights)}
+
+
+singleflight = SingleFlight()
+
+
+def _ask_one(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+             on_delta: Callable[[str], None] | None, check_breaker: bool = False,
+             hedge: bool = False) -> Answer:
+    key = request_key(model, messages, temperature, max_tokens)
+    if LLM_CACHE_ENABLED:
+        text = cache.get(key)
+        if text is not None:
+            return Answer(text=text, ms=0, model=model, cached=True)
+
+    def upstream(relay: Callable[[str], None]) -> Answer:
+        if check_breaker and not get_breaker(model).allow():
+            raise _BreakerOpen(model)
+        stream_to = relay if on_delta is not None else None
+        hedge_model = _pick_hedge_model(model) if hedge else None
+        if hedge_model:
+            answer = _hedged_call(messages, model=model, hedge_model=hedge_model, temperature=temperature,
+                                  max_tokens=max_tokens, on_delta=stream_to)
+        else:
+            answer = _call(messages, model=model, temperature=temperature, max_tokens=max_tokens, on_delta=stream_to)
+            latency.record(model, answer.ttft_ms if answer.ttft_ms is not None else answer.ms)
+
+        # в кэш - до того, как ожидающие разойдутся: следующий такой же запрос попадёт уже в кэш
+        if LLM_CACHE_ENABLED and answer.text.strip():
+            put_key = key if answer.model == model else request_key(answer.model, messages, temperature, max_tokens)
+            cache.put(put_key, answer.model, answer.text)
+        return answer
+
+    # в ключ полёта - всё, что меняет результат: с проверкой breaker ведущий может бросить
+    # _BreakerOpen, с hedging - вернуть ответ другой модели; модель уже входит в key
+    return singleflight.do(f"{key}:breaker={int(check_breaker)}:hedge={int(hedge)}", upstream, on_delta)
+
+
+def _call(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+          on_delta: Callable[[str], None] | None) -> Answer:
+    t0 = time.perf_counter()
+    try:
+        answer = _call_upstream(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                on_delta=on_delta)
+    except Exception as e:
+        record_call(model, int((time.perf_counter() - t0) * 1000), e)
+        raise
+    record_call(model, answer.ms, text=answer.text)
+    return answer
+
+
+def _call_upstream(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                   on_delta: Callable[[str], None] | None) -> Answer:
+    if on_delta is None:
+        text, ms = chat_once(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        return Answer(text=text or "", ms=ms, model=model)
+
+    parts: list[str] = []
+    ttft_ms = None
+    t0 = time.perf_counter()
+    for delta in chat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens):
+        if ttft_ms is None:
+            ttft_ms = int((time.perf_counter() - t0) * 1000)
+        parts.append(delta)
+        on_delta(delta)
+    ms = int((time.perf_counter() - t0) * 1000)
+    return Answer(text="".join(parts), ms=ms, model=model, ttft_ms=ttft_ms if ttft_ms is not None else ms)
+
+
+def _hedged_call(messages: List[Dict], *, model: str, hedge_model: str, temperature: float, max_tokens: int,
+                 on_delta: Callable[[str], None] | None) -> Answer:
+    """
+    Запускает model; если за hedge_threshold_ms(model) нет ни ответа, ни первого
+    токена - параллельно hedge_model. Победитель - кто первым дал текст.
+    Соединение проигравшего потока закрывается сразу (StreamHandle), даже если
+    он ещё ждёт первый токен; обычный запрос прервать нельзя, его результат
+    просто отбрасывается. on_delta вызывается в потоке вызывающего.
+    """
+    _hedge_inc("requests")
+    events: queue.Queue = queue.Queue()
+    cancelled = {model: threading.Event(), hedge_model: threading.Event()}
+    handles = {model: StreamHandle(), hedge_model: StreamHandle()}
+    started: Dict[str, float] = {}
+
+    def attempt(m: str) -> None:
+        def elapsed_ms() -> int:
+            return int((time.perf_counter() - started[m]) * 1000)
+
+        try:
+            if on_delta is None:
+                text, _ = chat_once(messages, model=m, temperature=temperature, max_tokens=max_tokens)
+                record_call(m, elapsed_ms(), text=text or "")
+                events.put((m, "done", text or ""))
+                return
+            stream = chat_stream(messages, model=m, temperature=temperature, max_tokens=max_tokens,
+                                 handle=handles[m])
+            received: list[str] = []
+            try:
+                for delta in stream:
+                    if cancelled[m].is_set():
+                        return
+                    received.append(delta)
+                    events.put((m, "delta", delta))
+            finally:
+                stream.close()
+            if cancelled[m].is_set():
+                return
+            record_call(m, elapsed_ms(), text="".join(received))
+            events.put((m, "done", None))
+        except Exception as e:
+            if cancelled[m].is_set():
+                return
+            record_call(m, elapsed_ms(), e)
+            events.put((m, "error", e))
+
+    def start(m: str) -> None:
+        started[m] = time.perf_counter()
+        threading.Thread(target=attempt, args=(m,), name=f"hedge-{m}", daemon=True).start()
+
+    t0 = time.perf_counter()
+    hedge_at = t0 + hedge_threshold_ms(model) / 1000
+    start(model)
+
+    winner = None
+    errors: Dict[str, Exception] = {}
+    parts: list[str] = []
+    ttft_ms = None
+    while True:
+        wait = hedge_at - time.perf_counter() if winner is None and hedge_model not in started else None
+        try:
+            m, kind, payload = events.get(timeout=max(wait, 0) if wait is not None else None)
+        except queue.Empty:
+            _hedge_inc("hedged")
+            start(hedge_model)
+            continue
+
+        if kind == "error":
+            if m == winner:
+                raise payload
+            errors[m] = payload
+            if winner is None and len(errors) == len(started):
+                raise errors[model] if model in errors else payload
+            continue
+        if m != winner and winner is not None:
+            continue
+
+        now = time.perf_counter()
+        if winner is None:
+            winner = m
+            latency.record(m, int((now - started[m]) * 1000))
+            for other, started_at in started.items():
+                if other != m:
+                    cancelled[other].set()
+                    handles[other].close()
+                    # время до отмены - оценка задержки проигравшего снизу
+                    latency.record(other, int((now - started_at) * 1000))
+            if hedge_model in started:
+                _hedge_inc("hedge_wins" if m == hedge_model else "primary_wins")
+            ttft_ms = int((now - t0) * 1000)
+
+        if kind == "delta":
+            parts.append(payload)
+            on_delta(payload)
+            continue
+        text = payload if payload is not None else "".join(parts)
+        ms = int((now - t0) * 1000)
+        return Answer(text=text, ms=ms, model=winner, ttft_ms=ttft_ms if on_delta is not None else None,
+                      hedged=winner != model)
+
+
+async def aask(messages: List[Dict], *,
+               model: str,
+               temperature: float = 0.2,
+               max_tokens: int = 400,
+               on_delta: Callable[[str], Awaitable[None]] | None = None,
+               fallback: bool = False,
+               run_blocking: Callable[..., Awaitable] = asyncio.to_thread) -> Answer:
+    """
+    Асинхронный ask: on_delta - корутина на каждый кусок текста, run_blocking(fn, *args) -
+    как выполнять синхронные вызовы (кэш и телеметрия в SQLite), по умолчанию asyncio.to_thread.
+    """
+    chain = await run_blocking(_fallback_chain, model) if fallback else [model]
+    emitted = False
+
+    async def tracked(delta: str) -> None:
+        nonlocal emitted
+        emitted = True
+        await on_delta(delta)
+
+    last_error: Exception | None = None
+    for candidate in chain:
+        try:
+            return await _aask_one(messages, model=candidate, temperature=temperature, max_tokens=max_tokens,
+                                   on_delta=tracked if on_delta else None, check_breaker=fallback,
+                                   run_blocking=run_blocking)
+        except _BreakerOpen:
+            continue
+        except RateLimitExceeded as e:
+            if not fallback or e.scope != "model":
+                raise
+            last_error = e
+        except Exception as e:
+            if not fallback or emitted or not is_model_failure(e):
+                raise
+            last_error = e
+    if last_error is not None:
+        raise last_error
+    raise OpenRouterError(503, "Все модели временно недоступны. Попробуйте позже.")
+
+
+async def _aask_one(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                    on_delta: Callable[[str], Awaitable[None]] | None, check_breaker: bool,
+                    run_blocking: Callable[..., Awaitable]) -> Answer:
+    key = request_key(model, messages, temperature, max_tokens)
+    if LLM_CACHE_ENABLED:
+        text = await run_blocking(cache.get, key)
+        if text is not None:
+            return Answer(text=text, ms=0, model=model, cached=True)
+
+    if check_breaker and not get_breaker(model).allow():
+        raise _BreakerOpen(model)
+    t0 = time.perf_counter()
+    try:
+        answer = await _acall(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                              on_delta=on_delta)
+    except Exception as e:
+        await run_blocking(record_call, model, int((time.perf_counter() - t0) * 1000), e)
+        raise
+    latency.record(model, answer.ttft_ms if answer.ttft_ms is not None else answer.ms)
+    await run_blocking(record_call, model, answer.ms, None, answer.text)
+
+    if LLM_CACHE_ENABLED and answer.text.strip():
+        await run_blocking(cache.put, key, model, answer.text)
+    return answer
+
+
+async def _acall(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                 on_delta: Callable[[str], Awaitable[None]] | None) -> Answer:
+    if on_delta is None:
+        text, ms = await achat_once(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        return Answer(text=text or "", ms=ms, model=model)
+
+    parts: list[str] = []
+    ttft_ms = None
+    t0 = time.perf_counter()
+    async for delta in achat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens):
+        if ttft_ms is None:
+            ttft_ms = int((time.perf_counter() - t0) * 1000)
+        parts.append(delta)
+        await on_delta(delta)
+    ms = int((time.perf_counter() - t0) * 1000)
+    return Answer(text="".join(parts), ms=ms, model=model, ttft_ms=ttft_ms if ttft_ms is not None else ms)
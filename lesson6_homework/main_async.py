@@ -0,0 +1,562 @@
+"""
+Тот же бот, что main_db.py, на AsyncTeleBot.
+
+Все обработчики - корутины: обращения к SQLite уходят в отдельный пул потоков
+(run_db), вопросы к моделям - через llm.aask поверх aiohttp, поэтому медленная
+модель не занимает поток и не задерживает /note_list и другие быстрые команды.
+Тексты ответов и разметка - общие с main_db (bot_common), поведение команд то же.
+
+Запуск:
+    python main_async.py
+"""
+import asyncio
+import io
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from telebot import types, util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+import db
+import llm
+import notes_io
+import openrouter
+import openrouter_async
+from bot_common import TOKEN, HELP_TEXT, NOTES_PAGE_SIZE, IMPORT_MAX_FILE_SIZE, STREAM_EDIT_INTERVAL_S, \
+    ASK_ALL_DEADLINE_S, ASK_ALL_TEXT_BUDGET, create_main_keyboard, _is_admin, _render_notes_page, _render_snippet, \
+    _render_import_report, _render_stats, _render_models, _render_characters, _render_limits, _render_model_stats, \
+    _render_ask_all, _ask_all_result, _parse_ask_all, _model_footer, _answer_timing, _build_messages, \
+    _build_messages_for_character, _routed_model_key
+from openrouter import OpenRouterError, get_breaker
+
+# Потоков для SQLite: запросы короткие, пул нужен, чтобы не блокировать event loop
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+bot = AsyncTeleBot(TOKEN)
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Синхронный вызов db (или кода, который в неё ходит) в пуле _db_executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(fn, *args, **kwargs))
+
+
+# AsyncTeleBot не умеет register_next_step_handler: следующий ответ в чате
+# перехватываем сами. Обработчик регистрируется первым, как и шаги в TeleBot.
+_next_steps: dict[int, tuple] = {}
+
+
+def _expect_reply(message: types.Message, handler, **kwargs) -> None:
+    _next_steps[message.chat.id] = (handler, kwargs)
+
+
+@bot.message_handler(func=lambda m: m.chat.id in _next_steps, content_types=util.content_type_media)
+async def on_next_step(message: types.Message) -> None:
+    handler, kwargs = _next_steps.pop(message.chat.id)
+    await handler(message, **kwargs)
+
+
+@bot.message_handler(commands=['start'])
+async def start(message):
+    await bot.reply_to(message, "Привет! Я бот для заметок. Используй /help для списка команд.", reply_markup=create_main_keyboard())
+
+
+@bot.message_handler(commands=['help'])
+async def help_cmd(message):
+    await bot.reply_to(message, HELP_TEXT)
+
+
+@bot.message_handler(commands=['note_list'])
+async def note_list(message):
+    page = await run_db(db.list_notes_page, message.from_user.id, limit=NOTES_PAGE_SIZE)
+
+    text, kb = _render_notes_page(page)
+    await bot.reply_to(message, text, reply_markup=kb)
+
+
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("notes:"))
+async def on_notes_page(call: types.CallbackQuery) -> None:
+    try:
+        _, direction, cursor = call.data.split(":")
+        cursor = int(cursor)
+    except ValueError:
+        await bot.answer_callback_query(call.id)
+        return
+
+    user_id = call.from_user.id
+    if direction == "older":
+        page = await run_db(db.list_notes_page, user_id, before_id=cursor, limit=NOTES_PAGE_SIZE)
+    else:
+        page = await run_db(db.list_notes_page, user_id, after_id=cursor, limit=NOTES_PAGE_SIZE)
+
+    text, kb = _render_notes_page(page)
+    try:
+        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                    reply_markup=kb)
+    except ApiTelegramException as e:
+        print(f"Не удалось обновить список заметок: {e}")
+    await bot.answer_callback_query(call.id)
+
+
+@bot.message_handler(commands=['note_add'])
+async def note_add_start(message):
+    await bot.reply_to(message, "Введите текст для новой заметки:")
+    _expect_reply(message, on_note_add_text)
+
+
+async def on_note_add_text(message):
+    text = message.text.strip()
+    if not text:
+        await bot.reply_to(message, "Текст не может быть пустым. Попробуйте еще раз: /note_add")
+        return
+
+    note_id = await run_db(db.add_note, message.from_user.id, text)
+
+    if note_id > 0:
+        await bot.reply_to(message, f"✅ Заметка #{note_id} добавлена!")
+    else:
+        await bot.reply_to(message, f"❌ Достигнут лимит заметок ({50} шт.). Удалите старые, чтобы добавить новые.")
+
+
+@bot.message_handler(commands=['note_find'])
+async def note_find_start(message):
+    await bot.reply_to(message, "Введите текст для поиска:")
+    _expect_reply(message, on_note_find_query)
+
+
+async def on_note_find_query(message):
+    query_text = message.text.strip()
+    if not query_text:
+        await bot.reply_to(message, "Поисковый запрос не может быть пустым. Попробуйте еще раз: /note_find")
+        return
+
+    found_notes = await run_db(db.find_notes, message.from_user.id, query_text)
+
+    if not found_notes:
+        await bot.reply_to(message, f"Ничего не найдено по запросу «{query_text}».")
+        return
+
+    response = "🔍 Результаты поиска:\n" + "\n".join([f"{note['id']}: {_render_snippet(note['snippet'])}" for note in found_notes])
+    await bot.reply_to(message, response, parse_mode='HTML')
+
+
+@bot.message_handler(commands=['note_del'])
+async def note_del_start(message):
+    await bot.reply_to(message, "Введите ID заметки, которую хотите удалить:")
+    _expect_reply(message, on_note_del_id)
+
+
+async def on_note_del_id(message):
+    try:
+        note_id = int(message.text.strip())
+    except ValueError:
+        await bot.reply_to(message, "ID должен быть числом. Попробуйте еще раз: /note_del")
+        return
+
+    success = await run_db(db.delete_note, message.from_user.id, note_id)
+
+    if success:
+        await bot.reply_to(message, f"🗑️ Заметка #{note_id} удалена.")
+    else:
+        await bot.reply_to(message, f"❌ Заметка #{note_id} не найдена или у вас нет прав для её удаления.")
+
+
+@bot.message_handler(commands=['note_edit'])
+async def note_edit_start(message):
+    await bot.reply_to(message, "Введите ID заметки для редактирования:")
+    _expect_reply(message, on_note_edit_id)
+
+
+async def on_note_edit_id(message):
+    try:
+        note_id = int(message.text.strip())
+    except ValueError:
+        await bot.reply_to(message, "ID должен быть числом. Попробуйте еще раз: /note_edit")
+        return
+
+    if await run_db(db.get_note, message.from_user.id, note_id) is None:
+        await bot.reply_to(message, f"❌ Заметка #{note_id} не найдена. Попробуйте еще раз: /note_edit")
+        return
+
+    await bot.reply_to(message, f"Теперь введите новый текст для заметки #{note_id}:")
+    _expect_reply(message, on_note_edit_text, note_id=note_id)
+
+
+async def on_note_edit_text(message, note_id: int):
+    new_text = message.text.strip()
+    if not new_text:
+        await bot.reply_to(message, "Текст не может быть пустым. Редактирование отменено. Попробуйте еще раз: /note_edit")
+        return
+
+    success = await run_db(db.update_note, message.from_user.id, note_id, new_text)
+
+    if success:
+        await bot.reply_to(message, f"✍️ Заметка #{note_id} успешно изменена.")
+    else:
+        await bot.reply_to(message, f"❌ Произошла ошибка при изменении заметки #{note_id}.")
+
+
+@bot.message_handler(commands=['note_export'])
+async def note_export_detailed(message):
+    fmt, compression = "md", None
+    for arg in message.text.split()[1:]:
+        arg = arg.lower().lstrip(".")
+        if arg in notes_io.FORMATS:
+            fmt = arg
+        elif arg in notes_io.COMPRESSIONS:
+            compression = arg
+        else:
+            await bot.reply_to(message, "Использование: /note_export [md|jsonl|csv] [gz|zip]")
+            return
+
+    user_id = message.from_user.id
+    username = message.from_user.username or f"user_{user_id}"
+
+    stats = await run_db(db.get_combined_stats, user_id)
+    if not stats['total_notes']:
+        await bot.reply_to(message, "У вас нет заметок для экспорта.")
+        return
+
+    now = datetime.now()
+    file_name = f"export_{username}_{now.strftime('%Y%m%d')}.{fmt}"
+
+    def build():
+        # генератор читает заметки из БД - весь экспорт собираем в пуле потоков
+        chunks = notes_io.iter_export(fmt, username, stats, db.iter_notes(user_id), now)
+        return notes_io.build_export(chunks, file_name, compression)
+
+    try:
+        buf, file_name = await run_db(build)
+        with buf:
+            await bot.send_document(
+                message.chat.id,
+                buf,
+                visible_file_name=file_name,
+                caption=f"Ваш подробный экспорт готов.\nФайл содержит {stats['total_notes']} заметок и полную статистику."
+            )
+    except Exception as e:
+        print(f"Ошибка при экспорте заметок для user_id {user_id}: {e}")
+        await bot.reply_to(message, "Произошла ошибка при создании файла экспорта.")
+
+
+@bot.message_handler(commands=['note_import'])
+async def note_import_start(message):
+    await bot.reply_to(message, "Пришлите файл экспорта (.md, .jsonl или .csv, можно в .gz/.zip):")
+    _expect_reply(message, on_note_import_file)
+
+
+async def on_note_import_file(message):
+    doc = message.document
+    if doc is None:
+        await bot.reply_to(message, "Нужен файл. Попробуйте еще раз: /note_import")
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_FILE_SIZE:
+        await bot.reply_to(message, "Файл слишком большой (больше 5 МБ).")
+        return
+
+    try:
+        fmt, compression = notes_io.detect_format(doc.file_name or "")
+    except ValueError:
+        await bot.reply_to(message, "Поддерживаются файлы .md, .jsonl и .csv (можно .gz/.zip). Попробуйте еще раз: /note_import")
+        return
+
+    user_id = message.from_user.id
+
+    def import_file(data: bytes) -> list[dict]:
+        with notes_io.open_text(io.BytesIO(data), compression) as lines:
+            return db.import_notes(user_id, notes_io.iter_import(fmt, lines))
+
+    try:
+        file_info = await bot.get_file(doc.file_id)
+        data = await bot.download_file(file_info.file_path)
+        reports = await run_db(import_file, data)
+    except db.ImportInterrupted as e:
+        print(f"Импорт заметок для user_id {user_id} прерван: {e.error!r}")
+        await bot.reply_to(message, _render_import_report(e.reports, e.error))
+        return
+    except Exception as e:
+        print(f"Ошибка при импорте заметок для user_id {user_id}: {e}")
+        await bot.reply_to(message, "Не удалось прочитать файл импорта.")
+        return
+
+    await bot.reply_to(message, _render_import_report(reports))
+
+
+@bot.message_handler(commands=['stats'])
+async def note_stats(message):
+    stats = await run_db(db.get_combined_stats, message.from_user.id)
+    await bot.reply_to(message, _render_stats(stats), parse_mode='Markdown')
+
+
+@bot.message_handler(commands=["models"])
+async def cmd_models(message: types.Message) -> None:
+    items = await run_db(db.list_models)
+    if not items:
+        await bot.reply_to(message, "Список моделей пуст.")
+        return
+    await bot.reply_to(message, _render_models(items, await run_db(db.is_auto_model)))
+
+
+@bot.message_handler(commands=["limits"], func=_is_admin)
+async def cmd_limits(message: types.Message) -> None:
+    await bot.reply_to(message, _render_limits(openrouter.rate_limiter.snapshot()))
+
+
+@bot.message_handler(commands=["model"])
+async def cmd_model(message: types.Message) -> None:
+    arg = message.text.replace("/model", "", 1).strip()
+
+    if not arg:
+        active = await run_db(db.get_active_model)
+        if await run_db(db.is_auto_model):
+            text = f"Модель: auto, сейчас отвечает {await run_db(llm.fastest_model, active['key'])}"
+        else:
+            text = f"Текущая активная модель: {active['label']} [{active['key']}]"
+        await bot.reply_to(message, text=text + "\n(сменить: /model <ID>, /model auto или /models)")
+        return
+
+    if arg.lower() == "auto":
+        await run_db(db.set_auto_model, True)
+        await bot.reply_to(message, text="Включена модель auto: на /ask отвечает самая быстрая исправная модель (см. /model_stats).")
+        return
+
+    if not arg.isdigit():
+        await bot.reply_to(message, text="Использование: /model <ID из /models> или /model auto")
+        return
+
+    try:
+        active = await run_db(db.set_active_model, int(arg))
+        await bot.reply_to(message, text=f"Активная модель переключена: {active['label']} [{active['key']}]")
+    except ValueError:
+        await bot.reply_to(message, text="Неизвестный ID модели. Сначала /models.")
+
+
+@bot.message_handler(commands=["ask"])
+async def cmd_ask(message: types.Message) -> None:
+    q = message.text.replace("/ask", "", 1).strip()
+    if not q:
+        await bot.reply_to(message, text="Использование: /ask <вопрос>")
+        return
+
+    msgs = await run_db(_build_messages, message.from_user.id, q[:600])
+    model_key = await run_db(_routed_model_key)
+
+    await _reply_streaming(message, msgs, model_key, _model_footer(model_key), fallback=True)
+
+
+@bot.message_handler(commands=["model_stats"])
+async def cmd_model_stats(message: types.Message) -> None:
+    models = await run_db(db.list_models)
+    await bot.reply_to(message, _render_model_stats(models, await run_db(db.model_stats)))
+
+
+async def _reply_streaming(message: types.Message, msgs: list[dict], model_key: str, footer, *,
+                           fallback: bool = False) -> None:
+    """Как main_db._reply_streaming: заглушка, правки по мере генерации, подпись с моделью и временем."""
+    placeholder = await bot.reply_to(message, text="…")
+    parts: list[str] = []
+    last_edit = time.perf_counter()
+
+    async def on_delta(delta: str) -> None:
+        nonlocal last_edit
+        parts.append(delta)
+        now = time.perf_counter()
+        if now - last_edit >= STREAM_EDIT_INTERVAL_S:
+            last_edit = now
+            await _edit_reply(placeholder, "".join(parts).strip()[:4000] + " ▌")
+
+    try:
+        answer = await llm.aask(msgs, model=model_key, temperature=0.2, max_tokens=400, on_delta=on_delta,
+                                fallback=fallback, run_blocking=run_db)
+        out = answer.text.strip()[:4000]
+        await _edit_reply(placeholder, f"{out}\n\n({_answer_timing(answer)}; {footer(answer)})")
+    except OpenRouterError as e:
+        await _edit_reply(placeholder, f"Ошибка: {e}")
+    except Exception:
+        await _edit_reply(placeholder, "Непредвиденная ошибка.")
+
+
+async def _edit_reply(reply: types.Message, text: str) -> None:
+    try:
+        await bot.edit_message_text(text, chat_id=reply.chat.id, message_id=reply.message_id)
+    except ApiTelegramException as e:
+        print(f"Не удалось обновить ответ: {e}")
+
+
+@bot.message_handler(commands=["characters"])
+async def cmd_characters(message: types.Message) -> None:
+    items = await run_db(db.list_characters)
+    if not items:
+        await bot.reply_to(message, text="Каталог персонажей пуст.")
+        return
+
+    try:
+        current = (await run_db(db.get_user_character, message.from_user.id))["id"]
+    except Exception:
+        current = None
+    await bot.reply_to(message, _render_characters(items, current))
+
+
+@bot.message_handler(commands=["character"])
+async def cmd_character(message: types.Message) -> None:
+    user_id = message.from_user.id
+    arg = message.text.replace("/character", "", 1).strip()
+    if not arg:
+        p = await run_db(db.get_user_character, user_id)
+        await bot.reply_to(message, f"Текущий персонаж: {p['name']}\n(сменить: /characters, затем /character <ID>)")
+        return
+    if not arg.isdigit():
+        await bot.reply_to(message, text="Использование: /character <ID из /characters>")
+        return
+
+    try:
+        p = await run_db(db.set_user_character, user_id, int(arg))
+        await bot.reply_to(message, text=f"Персонаж установлен: {p['name']}")
+    except ValueError:
+        await bot.reply_to(message, text="Неизвестный ID персонажа. Сначала /characters.")
+
+
+@bot.message_handler(commands=["whoami"])
+async def cmd_whoami(message: types.Message) -> None:
+    character = await run_db(db.get_user_character, message.from_user.id)
+    model = await run_db(db.get_active_model)
+    await bot.reply_to(message, text=f"Модель: {model['label']} [{model['key']}]\nПерсонаж: {character['name']}")
+
+
+@bot.message_handler(commands=["ask_random"])
+async def cmd_ask_random(message: types.Message) -> None:
+    q = message.text.replace("/ask_random", "", 1).strip()
+    if not q:
+        await bot.reply_to(message, text="Использование: /ask_random <вопрос>")
+        return
+    q = q[:600]
+
+    items = await run_db(db.list_characters)
+    if not items:
+        await bot.reply_to(message, text="Каталог персонажей пуст.")
+        return
+    chosen = random.choice(items)
+    character = await run_db(db.get_character_by_id, chosen["id"])
+
+    msgs = _build_messages_for_character(character, q)
+    model_key = await run_db(_routed_model_key)
+
+    await _reply_streaming(message, msgs, model_key, _model_footer(model_key, f"; как: {character['name']}"),
+                           fallback=True)
+
+
+@bot.message_handler(commands=["ask_model"])
+async def cmd_ask_model(message: types.Message) -> None:
+    parts = message.text.split(maxsplit=2)
+
+    if len(parts) < 3:
+        await bot.reply_to(message, text="Использование: /ask_model <ID модели> <вопрос>")
+        return
+
+    model_id_str, q = parts[1], parts[2].strip()
+
+    if not model_id_str.isdigit():
+        await bot.reply_to(message, text="ID модели должен быть числом. Посмотрите ID в /models.")
+        return
+
+    model_id = int(model_id_str)
+    target_model = await run_db(db.get_model_by_id, model_id)
+    if not target_model:
+        await bot.reply_to(message, text=f"Модель с ID {model_id} не найдена. Используйте /models для просмотра списка.")
+        return
+
+    msgs = await run_db(_build_messages, message.from_user.id, q[:600])
+    model_label = target_model["label"]
+
+    await _reply_streaming(message, msgs, target_model["key"], lambda answer: f"модель: {model_label}")
+
+
+@bot.message_handler(commands=["ask_all"])
+async def cmd_ask_all(message: types.Message) -> None:
+    ids, q = _parse_ask_all(message.text)
+    if ids is not None:
+        models = []
+        for model_id in ids:
+            model = await run_db(db.get_model_by_id, model_id)
+            if not model:
+                await bot.reply_to(message, text=f"Модель с ID {model_id} не найдена. Используйте /models для просмотра списка.")
+                return
+            models.append(model)
+    else:
+        models = await run_db(db.list_models)
+
+    if not q:
+        await bot.reply_to(message, text="Использование: /ask_all [ID,ID,...] <вопрос>")
+        return
+    if not models:
+        await bot.reply_to(message, text="Список моделей пуст.")
+        return
+
+    await _fan_out(message, await run_db(_build_messages, message.from_user.id, q[:600]), models)
+
+
+async def _fan_out(message: types.Message, msgs: list[dict], models: list[dict],
+                   deadline_s: float = ASK_ALL_DEADLINE_S) -> None:
+    """Как main_db._fan_out, но на задачах asyncio: после дедлайна незавершённые запросы отменяются."""
+    results: dict[str, str] = {}
+    for m in models:
+        if get_breaker(m["key"]).state == "open":
+            results[m["key"]] = "⛔ недоступна"
+    batch = [m for m in models if m["key"] not in results]
+
+    placeholder = await bot.reply_to(message, text=_render_ask_all(models, results, deadline_s))
+    budget = max(ASK_ALL_TEXT_BUDGET // len(models), 200)
+    t0 = time.perf_counter()
+
+    async def ask(m: dict) -> tuple[str, tuple[str, int] | Exception]:
+        try:
+            return m["key"], await openrouter_async.achat_once(msgs, model=m["key"], max_tokens=400,
+                                                               timeout_s=deadline_s, wait_s=deadline_s)
+        except Exception as e:
+            return m["key"], e
+
+    tasks = [asyncio.create_task(ask(m)) for m in batch]
+    last_edit = time.perf_counter()
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=deadline_s):
+            key, result = await next_done
+            if isinstance(result, Exception):
+                await run_db(llm.record_call, key, int((time.perf_counter() - t0) * 1000), result)
+            else:
+                await run_db(llm.record_call, key, result[1], None, result[0] or "")
+            results[key] = _ask_all_result(result, budget)
+            now = time.perf_counter()
+            if now - last_edit >= STREAM_EDIT_INTERVAL_S:
+                last_edit = now
+                await _edit_reply(placeholder, _render_ask_all(models, results, deadline_s))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for m in batch:
+        results.setdefault(m["key"], f"⏱ не уложилась в {deadline_s:g} с")
+    await _edit_reply(placeholder, _render_ask_all(models, results, deadline_s))
+
+
+async def main() -> None:
+    try:
+        await bot.infinity_polling(skip_pending=True)
+    finally:
+        await openrouter_async.aclose_client()
+        await bot.close_session()
+        _db_executor.shutdown()
+
+
+if __name__ == "__main__":
+    db.init_db()
+    print("Бот запускается (asyncio)...")
+    asyncio.run(main())
@@ -1,67 +1,154 @@
+import io
 import os
+import queue
 import random
+import sys
+import threading
+import time
 from datetime import datetime
+from functools import wraps
+from typing import Callable
 
-from dotenv import load_dotenv
 import telebot
 from telebot import types
-from db import init_db, add_note, list_notes, update_note, delete_note, find_notes, list_all_notes, \
+from db import init_db, add_note, update_note, delete_note, find_notes, \
     get_combined_stats, list_models, get_active_model, set_active_model, get_user_character, list_characters, \
-    set_user_character, get_character_by_id, get_model_by_id
-from openrouter import chat_once, OpenRouterError
-
-load_dotenv()
-TOKEN = os.getenv("TOKEN")
-if not TOKEN:
-    raise RuntimeError("В .env файле нет TOKEN")
+    set_user_character, get_character_by_id, get_model_by_id, list_notes_page, get_note, \
+    iter_notes, import_notes, ImportInterrupted, set_auto_model, is_auto_model, model_stats
+import notes_io
+import llm
+import openrouter
+from openrouter import OpenRouterError, get_breaker
+from bot_common import TOKEN, HELP_TEXT, NOTES_PAGE_SIZE, IMPORT_MAX_FILE_SIZE, STREAM_EDIT_INTERVAL_S, \
+    ASK_ALL_DEADLINE_S, ASK_ALL_TEXT_BUDGET, create_main_keyboard, _is_admin, _render_notes_page, _render_snippet, \
+    _render_import_report, _render_stats, _render_models, _render_characters, _render_limits, _render_model_stats, \
+    _render_ask_all, _ask_all_result, _parse_ask_all, _model_footer, _answer_timing, _build_messages, \
+    _build_messages_for_character, _routed_model_key
+
+# Отдельная полоса для вопросов к моделям: свои потоки и ограниченная очередь
+LLM_LANE_WORKERS = int(os.getenv("LLM_LANE_WORKERS", "4"))
+LLM_LANE_QUEUE = int(os.getenv("LLM_LANE_QUEUE", "8"))
 
 bot = telebot.TeleBot(TOKEN)
 
 init_db()
-def create_main_keyboard():
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row("/start", "/help", "/note_add", "/note_list", "/note_find", "/note_edit", "/note_del", "/note_export", "/stats", "/ask_model")
-    return kb
+
+
+class Lane:
+    """
+    Пул из workers потоков с очередью не больше max_queue задач.
+    Медленные обработчики уходят сюда, а потоки TeleBot остаются для быстрых команд.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._tasks: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0  # приняты и ещё не завершены
+        self._stats = {"accepted": 0, "queued": 0, "rejected": 0}
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> int:
+        """
+        Ставит fn(*args, **kwargs) в полосу. Возвращает 0, если свободный поток есть,
+        иначе место в очереди (1 - следующий). Очередь полна - queue.Full.
+        """
+        with self._lock:
+            waiting = max(self._pending - self.workers, 0)
+            if self._pending >= self.workers and waiting >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise queue.Full
+            self._pending += 1
+            self._stats["accepted"] += 1
+            position = waiting + 1 if self._pending > self.workers else 0
+            if position:
+                self._stats["queued"] += 1
+        self._tasks.put((fn, args, kwargs))
+        return position
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": min(self._pending, self.workers),
+                "waiting": max(self._pending - self.workers, 0),
+                "max_queue": self.max_queue,
+                "stats": dict(self._stats),
+            }
+
+    def _work(self) -> None:
+        while True:
+            fn, args, kwargs = self._tasks.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"Ошибка в полосе {self.name}: {e!r}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+
+llm_lane = Lane("llm", LLM_LANE_WORKERS, LLM_LANE_QUEUE)
+
+
+def _in_llm_lane(handler: Callable[[types.Message], None]) -> Callable[[types.Message], None]:
+    """Обработчик выполняется в llm_lane; поток TeleBot сразу свободен."""
+    @wraps(handler)
+    def wrapper(message: types.Message) -> None:
+        try:
+            position = llm_lane.submit(handler, message)
+        except queue.Full:
+            bot.reply_to(message, text="Сейчас слишком много вопросов к моделям. Попробуйте через минуту.")
+            return
+        if position:
+            bot.reply_to(message, text=f"Модели заняты, вы №{position} в очереди. Ответ придёт сюда же.")
+    return wrapper
+
 
 @bot.message_handler(commands=['start'])
 def start(message):
     bot.reply_to(message, "Привет! Я бот для заметок. Используй /help для списка команд.", reply_markup=create_main_keyboard())
 
+
 @bot.message_handler(commands=['help'])
 def help_cmd(message):
-    help_text = """
-Доступные команды:
-/note_add <текст> - Добавить заметку
-/note_list - Показать все заметки
-/note_find <запрос> - Найти заметку
-/note_edit <id> <новый текст> - Изменить заметку
-/note_del <id> - Удалить заметку
-/note_export - Экспорт в файл
-/stats - Cтатистика
-/models - Список моделей
-/model <id> - Изменить модель/показать текущую
-/ask <текст> - Спросить модель
-/ask_model <ID> <Текст> - Спросить модель с конкретным ID
-"""
-    bot.reply_to(message, help_text)
-
+    bot.reply_to(message, HELP_TEXT)
 
 
 @bot.message_handler(commands=['note_list'])
 def note_list(message):
     user_id = message.from_user.id
-    user_notes = list_notes(user_id)
+    page = list_notes_page(user_id, limit=NOTES_PAGE_SIZE)
 
-    if not user_notes:
-        bot.reply_to(message, "Заметок пока нет.")
-        return
-
-    response = "Ваши заметки:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in user_notes])
-    bot.reply_to(message, response)
+    text, kb = _render_notes_page(page)
+    bot.reply_to(message, text, reply_markup=kb)
 
 
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("notes:"))
+def on_notes_page(call: types.CallbackQuery) -> None:
+    try:
+        _, direction, cursor = call.data.split(":")
+        cursor = int(cursor)
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        return
 
+    user_id = call.from_user.id
+    if direction == "older":
+        page = list_notes_page(user_id, before_id=cursor, limit=NOTES_PAGE_SIZE)
+    else:
+        page = list_notes_page(user_id, after_id=cursor, limit=NOTES_PAGE_SIZE)
 
+    text, kb = _render_notes_page(page)
+    try:
+        bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+    except telebot.apihelper.ApiTelegramException as e:
+        # повторное нажатие на ту же кнопку: "message is not modified"
+        print(f"Не удалось обновить список заметок: {e}")
+    bot.answer_callback_query(call.id)
 
 
 @bot.message_handler(commands=['note_add'])
@@ -101,8 +188,9 @@ def on_note_find_query(message):
         bot.reply_to(message, f"Ничего не найдено по запросу «{query_text}».")
         return
 
-    response = "🔍 Результаты поиска:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in found_notes])
-    bot.reply_to(message, response)
+    response = "🔍 Результаты поиска:\n" + "\n".join([f"{note['id']}: {_render_snippet(note['snippet'])}" for note in found_notes])
+    bot.reply_to(message, response, parse_mode='HTML')
+
 
 @bot.message_handler(commands=['note_del'])
 def note_del_start(message):
@@ -136,8 +224,7 @@ def on_note_edit_id(message):
         bot.reply_to(message, "ID должен быть числом. Попробуйте еще раз: /note_edit")
         return
 
-    user_notes = list_all_notes(message.from_user.id)
-    if not any(note['id'] == note_id for note in user_notes):
+    if get_note(message.from_user.id, note_id) is None:
         bot.reply_to(message, f"❌ Заметка #{note_id} не найдена. Попробуйте еще раз: /note_edit")
         return
 
@@ -161,100 +248,88 @@ def on_note_edit_text(message, note_id: int):
 
 @bot.message_handler(commands=['note_export'])
 def note_export_detailed(message):
+    # /note_export [md|jsonl|csv] [gz|zip]
+    fmt, compression = "md", None
+    for arg in message.text.split()[1:]:
+        arg = arg.lower().lstrip(".")
+        if arg in notes_io.FORMATS:
+            fmt = arg
+        elif arg in notes_io.COMPRESSIONS:
+            compression = arg
+        else:
+            bot.reply_to(message, "Использование: /note_export [md|jsonl|csv] [gz|zip]")
+            return
+
     user_id = message.from_user.id
     username = message.from_user.username or f"user_{user_id}"
 
     stats = get_combined_stats(user_id)
-    all_notes = list_all_notes(user_id)
-
-    if not all_notes:
+    if not stats['total_notes']:
         bot.reply_to(message, "У вас нет заметок для экспорта.")
         return
 
-    today_str = datetime.now().strftime('%Y-%m-%d %H:%M')
-    content = f"# Экспорт заметок для пользователя @{username}\n"
-    content += f"Дата экспорта: {today_str}\n\n"
+    now = datetime.now()
+    chunks = notes_io.iter_export(fmt, username, stats, iter_notes(user_id), now)
+    file_name = f"export_{username}_{now.strftime('%Y%m%d')}.{fmt}"
 
-    content += "## 📊 Сводная статистика\n\n"
-    content += f"* **Занято слотов:** {stats['total_notes']} / {50}\n"
-    content += f"* **Суммарный объем:** {stats['total_chars']:,} символов\n\n"
+    try:
+        buf, file_name = notes_io.build_export(chunks, file_name, compression)
+        with buf:
+            bot.send_document(
+                message.chat.id,
+                buf,
+                visible_file_name=file_name,
+                caption=f"Ваш подробный экспорт готов.\nФайл содержит {stats['total_notes']} заметок и полную статистику."
+            )
 
-    content += "### История действий (за всё время)\n"
-    content += f"* ✅ Создано: **{stats['total_created']}**\n"
-    content += f"* ✍️ Изменено: **{stats['total_edited']}**\n"
-    content += f"* ❌ Удалено: **{stats['total_deleted']}**\n\n"
+    except Exception as e:
+        print(f"Ошибка при экспорте заметок для user_id {user_id}: {e}")
+        bot.reply_to(message, "Произошла ошибка при создании файла экспорта.")
 
-    content += "### Активность за последнюю неделю\n"
-    content += f"* ✅ Создано: **{stats['weekly_created']}**\n"
-    content += f"* ✍️ Изменено: **{stats['weekly_edited']}**\n"
-    content += f"* ❌ Удалено: **{stats['weekly_deleted']}**\n\n"
 
-    content += "---\n\n"
-    content += f"## 📝 Ваши заметки ({len(all_notes)} шт.)\n\n"
+@bot.message_handler(commands=['note_import'])
+def note_import_start(message):
+    bot.reply_to(message, "Пришлите файл экспорта (.md, .jsonl или .csv, можно в .gz/.zip):")
+    bot.register_next_step_handler(message, on_note_import_file)
 
-    for note in all_notes:
-        content += f"### Заметка #{note['id']}\n"
-        content += f"* **Дата создания:** {note['created_at']}\n\n"
-        note_text_quoted = "> " + note['text'].replace('\n', '\n> ')
-        content += f"{note_text_quoted}\n\n"
-        content += "---\n\n"
+def on_note_import_file(message):
+    doc = message.document
+    if doc is None:
+        bot.reply_to(message, "Нужен файл. Попробуйте еще раз: /note_import")
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_FILE_SIZE:
+        bot.reply_to(message, "Файл слишком большой (больше 5 МБ).")
+        return
 
-    file_path = f"export_{username}_{datetime.now().strftime('%Y%m%d')}.md"
+    try:
+        fmt, compression = notes_io.detect_format(doc.file_name or "")
+    except ValueError:
+        bot.reply_to(message, "Поддерживаются файлы .md, .jsonl и .csv (можно .gz/.zip). Попробуйте еще раз: /note_import")
+        return
 
+    user_id = message.from_user.id
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        data = bot.download_file(bot.get_file(doc.file_id).file_path)
+        with notes_io.open_text(io.BytesIO(data), compression) as lines:
+            reports = import_notes(user_id, notes_io.iter_import(fmt, lines))
+    except ImportInterrupted as e:
+        print(f"Импорт заметок для user_id {user_id} прерван: {e.error!r}")
+        bot.reply_to(message, _render_import_report(e.reports, e.error))
+        return
+    except Exception as e:
+        print(f"Ошибка при импорте заметок для user_id {user_id}: {e}")
+        bot.reply_to(message, "Не удалось прочитать файл импорта.")
+        return
 
-        with open(file_path, 'rb') as f:
-            bot.send_document(
-                message.chat.id,
-                f,
-                caption=f"Ваш подробный экспорт готов.\nФайл содержит {len(all_notes)} заметок и полную статистику."
-            )
+    bot.reply_to(message, _render_import_report(reports))
 
-    except Exception as e:
-        print(f"Ошибка при экспорте заметок для user_id {user_id}: {e}")
-        bot.reply_to(message, "Произошла ошибка при создании файла экспорта.")
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 @bot.message_handler(commands=['stats'])
 def note_stats(message):
     user_id = message.from_user.id
     stats = get_combined_stats(user_id)
 
-    total_notes = stats['total_notes']
-
-    BAR_CHAR_FILLED = '█'
-    BAR_CHAR_EMPTY = '░'
-    BAR_LENGTH = 20
-
-    filled_count = int((total_notes / 50) * BAR_LENGTH)
-    empty_count = BAR_LENGTH - filled_count
-
-    histogram = f"{BAR_CHAR_FILLED * filled_count}{BAR_CHAR_EMPTY * empty_count}"
-
-    response_text = (
-        f"📊 **Ваша статистика**\n\n"
-        f"**Занято места для заметок:**\n"
-        f"`{histogram}`\n"
-        f"Использовано **{total_notes}** из **{50}** слотов.\n"
-        f"📝 **Суммарный объем:** `{stats['total_chars']:,}` символов\n"
-        f"────────────────────\n"
-        f"**История действий (всего):**\n"
-        f"✅ Создано: **{stats['total_created']}**\n"
-        f"✍️ Изменено: **{stats['total_edited']}**\n"
-        f"❌ Удалено: **{stats['total_deleted']}**\n"
-        f"────────────────────\n"
-        f"**Активность за неделю:**\n"
-        f"✅ Создано: **{stats['weekly_created']}**\n"
-        f"✍️ Изменено: **{stats['weekly_edited']}**\n"
-        f"❌ Удалено: **{stats['weekly_deleted']}**"
-    )
-
-    bot.reply_to(message, response_text, parse_mode='Markdown')
-
+    bot.reply_to(message, _render_stats(stats), parse_mode='Markdown')
 
 
 @bot.message_handler(commands=["models"])
@@ -263,12 +338,23 @@ def cmd_models(message: types.Message) -> None:
     if not items:
         bot.reply_to(message, "Список моделей пуст.")
         return
-    lines = ["Доступные модели:"]
-    for m in items:
-        star = "★" if m["active"] else " "
-        lines.append(f"{star} {m['id']}. {m['label']}  [{m['key']}]")
-    lines.append("\nАктивировать: /model <ID>")
-    bot.reply_to(message, "\n".join(lines))
+    bot.reply_to(message, _render_models(items, is_auto_model()))
+
+
+@bot.message_handler(commands=["limits"], func=_is_admin)
+def cmd_limits(message: types.Message) -> None:
+    text = _render_limits(openrouter.rate_limiter.snapshot()) + "\n\n" + _render_lane(llm_lane.snapshot())
+    bot.reply_to(message, text)
+
+
+def _render_lane(snap: dict) -> str:
+    stats = snap["stats"]
+    return (
+        f"Вопросы к моделям: выполняется {snap['running']} из {snap['workers']}, "
+        f"в очереди {snap['waiting']} из {snap['max_queue']}\n"
+        f"принято: {stats['accepted']} (ждали в очереди: {stats['queued']}), отказано: {stats['rejected']}"
+    )
+
 
 @bot.message_handler(commands=["model"])
 def cmd_model(message: types.Message) -> None:
@@ -276,11 +362,20 @@ def cmd_model(message: types.Message) -> None:
 
     if not arg:
         active = get_active_model()
-        bot.reply_to(message, text=f"Текущая активная модель: {active['label']} [{active['key']}]\n(сменить: /model <ID> или /models)")
+        if is_auto_model():
+            text = f"Модель: auto, сейчас отвечает {llm.fastest_model(active['key'])}"
+        else:
+            text = f"Текущая активная модель: {active['label']} [{active['key']}]"
+        bot.reply_to(message, text=text + "\n(сменить: /model <ID>, /model auto или /models)")
+        return
+
+    if arg.lower() == "auto":
+        set_auto_model(True)
+        bot.reply_to(message, text="Включена модель auto: на /ask отвечает самая быстрая исправная модель (см. /model_stats).")
         return
 
     if not arg.isdigit():
-        bot.reply_to(message, text="Использование: /model <ID из /models>")
+        bot.reply_to(message, text="Использование: /model <ID из /models> или /model auto")
         return
 
     try:
@@ -291,6 +386,7 @@ def cmd_model(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["ask"])
+@_in_llm_lane
 def cmd_ask(message: types.Message) -> None:
     q = message.text.replace("/ask", "", 1).strip()
     if not q:
@@ -298,51 +394,53 @@ def cmd_ask(message: types.Message) -> None:
         return
 
     msgs = _build_messages(message.from_user.id, q[:600])
-    model_key = get_active_model()["key"]
+    model_key = _routed_model_key()
+
+    _reply_streaming(message, msgs, model_key, _model_footer(model_key), fallback=True, hedge=True)
+
+
+@bot.message_handler(commands=["model_stats"])
+def cmd_model_stats(message: types.Message) -> None:
+    bot.reply_to(message, _render_model_stats(list_models(), model_stats()))
+
+
+def _reply_streaming(message: types.Message, msgs: list[dict], model_key: str,
+                     footer: Callable[[llm.Answer], str], *, fallback: bool = False,
+                     hedge: bool = False) -> None:
+    """
+    Отвечает заглушкой и дописывает в неё ответ модели по мере генерации.
+    В подписи - общее время и время до первого токена (или пометка о кэше)
+    и то, что вернёт footer(answer).
+    """
+    placeholder = bot.reply_to(message, text="…")
+    parts: list[str] = []
+    last_edit = time.perf_counter()
+
+    def on_delta(delta: str) -> None:
+        nonlocal last_edit
+        parts.append(delta)
+        now = time.perf_counter()
+        if now - last_edit >= STREAM_EDIT_INTERVAL_S:
+            _edit_reply(placeholder, "".join(parts).strip()[:4000] + " ▌")
+            last_edit = now
 
     try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]  # не переполняем сообщение Telegram
-        bot.reply_to(message, text=f"{out}\n\n({ms} мс; модель: {model_key})")
+        answer = llm.ask(msgs, model=model_key, temperature=0.2, max_tokens=400, on_delta=on_delta,
+                         fallback=fallback, hedge=hedge)
+        out = answer.text.strip()[:4000]  # не переполняем сообщение Telegram
+        _edit_reply(placeholder, f"{out}\n\n({_answer_timing(answer)}; {footer(answer)})")
     except OpenRouterError as e:
-        bot.reply_to(message, text=f"Ошибка: {e}")
+        _edit_reply(placeholder, f"Ошибка: {e}")
     except Exception:
-        bot.reply_to(message, text="Непредвиденная ошибка.")
-
-
-def _build_messages(user_id: int, user_text: str) -> list[dict]:
-    p = get_user_character(user_id)
-    system = (
-        f"Ты отвечаешь строго в образе персонажа: {p['name']}.\n"
-        f"{p['prompt']}\n\n"
-        "Правила:\n"
-        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости - переформулируй.\n"
-        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
-        "3) Не раскрывай, что ты 'играешь роль'.\n"
-        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
-        "5) Если стиль персонажа выражен слабо - переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
-    )
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user_text},
-    ]
-
-def _build_messages_for_character(character: dict, user_text: str) -> list[dict]:
-    system = (
-        f"Ты отвечаешь строго в образе персонажа: {character['name']}.\n"
-        f"{character['prompt']}\n"
-        "Правила:\n"
-        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости – переформулируй.\n"
-        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
-        "3) Не раскрывай, что ты 'играешь роль'.\n"
-        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
-        "5) Если стиль персонажа выражен слабо – переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
-    )
+        _edit_reply(placeholder, "Непредвиденная ошибка.")
+
 
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user_text},
-    ]
+def _edit_reply(reply: types.Message, text: str) -> None:
+    try:
+        bot.edit_message_text(text, chat_id=reply.chat.id, message_id=reply.message_id)
+    except telebot.apihelper.ApiTelegramException as e:
+        # "message is not modified" или лимит на редактирование - пропускаем кадр
+        print(f"Не удалось обновить ответ: {e}")
 
 
 @bot.message_handler(commands=["characters"])
@@ -358,12 +456,7 @@ def cmd_characters(message: types.Message) -> None:
     except Exception:
         current = None
 
-    lines = ["Доступные персонажи:"]
-    for p in items:
-        star = "★" if current is not None and p["id"] == current else ""
-        lines.append(f"{star}{p['id']}. {p['name']}")
-    lines.append("\nВыбор: /character <ID>")
-    bot.reply_to(message, "\n".join(lines))
+    bot.reply_to(message, _render_characters(items, current))
 
 
 @bot.message_handler(commands=["character"])
@@ -392,8 +485,8 @@ def cmd_whoami(message: types.Message) -> None:
     bot.reply_to(message, text=f"Модель: {model['label']} [{model['key']}]\nПерсонаж: {character['name']}")
 
 
-
 @bot.message_handler(commands=["ask_random"])
+@_in_llm_lane
 def cmd_ask_random(message: types.Message) -> None:
     q = message.text.replace("/ask_random","", 1).strip()
     if not q:
@@ -409,19 +502,14 @@ def cmd_ask_random(message: types.Message) -> None:
     character = get_character_by_id(chosen["id"]) # получаем prompt
 
     msgs = _build_messages_for_character(character, q)
-    model_key = get_active_model()["key"]
+    model_key = _routed_model_key()
 
-    try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]
-        bot.reply_to(message, text=f"{out}\n\n{ms} мс; модель: {model_key}; как: {character['name']}")
-    except OpenRouterError as e:
-        bot.reply_to(message, text=f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, text="Непредвиденная ошибка.")
+    _reply_streaming(message, msgs, model_key, _model_footer(model_key, f"; как: {character['name']}"),
+                     fallback=True)
 
 
 @bot.message_handler(commands=["ask_model"])
+@_in_llm_lane
 def cmd_ask_model(message: types.Message) -> None:
     parts = message.text.split(maxsplit=2)
 
@@ -446,16 +534,91 @@ def cmd_ask_model(message: types.Message) -> None:
     model_key = target_model["key"]
     model_label = target_model["label"]
 
+    # модель выбрана явно - без подмены
+    _reply_streaming(message, msgs, model_key, lambda answer: f"модель: {model_label}")
+
+
+# Сколько моделей /ask_all спрашивает одновременно (потоки сверх llm_lane)
+ASK_ALL_MAX_CONCURRENCY = int(os.getenv("ASK_ALL_MAX_CONCURRENCY", "4"))
+
+
+@bot.message_handler(commands=["ask_all"])
+@_in_llm_lane
+def cmd_ask_all(message: types.Message) -> None:
+    ids, q = _parse_ask_all(message.text)
+    if ids is not None:
+        models = []
+        for model_id in ids:
+            model = get_model_by_id(model_id)
+            if not model:
+                bot.reply_to(message, text=f"Модель с ID {model_id} не найдена. Используйте /models для просмотра списка.")
+                return
+            models.append(model)
+    else:
+        models = list_models()
+
+    if not q:
+        bot.reply_to(message, text="Использование: /ask_all [ID,ID,...] <вопрос>")
+        return
+    if not models:
+        bot.reply_to(message, text="Список моделей пуст.")
+        return
+
+    _fan_out(message, _build_messages(message.from_user.id, q[:600]), models)
+
+
+def _fan_out(message: types.Message, msgs: list[dict], models: list[dict],
+             deadline_s: float = ASK_ALL_DEADLINE_S) -> None:
+    """
+    Параллельно спрашивает models (openrouter.chat_many) и правит одно сообщение
+    по мере прихода ответов. В deadline_s укладываются и очередь лимитера, и сами
+    запросы; после него ещё не начатые запросы отменяются.
+    """
+    results: dict[str, str] = {}
+    # модели с разомкнутым breaker не спрашиваем
+    for m in models:
+        if get_breaker(m["key"]).state == "open":
+            results[m["key"]] = "⛔ недоступна"
+    batch = [m for m in models if m["key"] not in results]
+
+    placeholder = bot.reply_to(message, text=_render_ask_all(models, results, deadline_s))
+    t0 = time.perf_counter()
+    deadline = time.monotonic() + deadline_s
+    requests = (
+        {"messages": msgs, "model": m["key"], "max_tokens": 400, "timeout_s": deadline_s}
+        for m in batch
+    )
+    concurrency = max(min(len(batch), ASK_ALL_MAX_CONCURRENCY), 1)
+
+    last_edit = time.perf_counter()
+    budget = max(ASK_ALL_TEXT_BUDGET // len(models), 200)
+    answers = openrouter.chat_many(requests, max_concurrency=concurrency, deadline=deadline)
     try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]
-        bot.reply_to(message, text=f"{out}\n\n({ms} мс; модель: {model_label})")
-    except OpenRouterError as e:
-        bot.reply_to(message, text=f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, text="Непредвиденная ошибка.")
+        for index, result in answers:
+            key = batch[index]["key"]
+            if isinstance(result, Exception):
+                llm.record_call(key, int((time.perf_counter() - t0) * 1000), result)
+            else:
+                llm.record_call(key, result[1], text=result[0] or "")
+            results[key] = _ask_all_result(result, budget)
+            now = time.perf_counter()
+            if now - last_edit >= STREAM_EDIT_INTERVAL_S:
+                _edit_reply(placeholder, _render_ask_all(models, results, deadline_s))
+                last_edit = now
+    finally:
+        answers.close()
+
+    for m in batch:
+        results.setdefault(m["key"], f"⏱ не уложилась в {deadline_s:g} с")
+    _edit_reply(placeholder, _render_ask_all(models, results, deadline_s))
 
 
 if __name__ == "__main__":
-    print("Бот запускается...")
-    bot.infinity_polling(skip_pending=True)
\ No newline at end of file
+    if "--webhook" in sys.argv[1:]:
+        import webhook
+
+        print("Бот запускается (webhook)...")
+        webhook.run_webhook(bot)
+    else:
+        print("Бот запускается...")
+        bot.infinity_polling(skip_pending=True)
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+Экспорт и импорт заметок.
+
+Форматы отдаются генераторами строк, которые пишутся прямо в буфер
+(SpooledTemporaryFile: в памяти, на диск - только для больших экспортов)
+и при необходимости сжимаются gzip/zip на лету. Файлов в рабочей папке нет.
+Импорт читает те же форматы потоково и отдаёт заметки для db.import_notes.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import re
+import tempfile
+import zipfile
+from datetime import datetime
+from typing import IO, Iterable, Iterator, TextIO
+
+from db import NOTES_LIMIT
+
+# Буфер экспорта держим в памяти до этого размера, дальше - временный файл
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Распакованный файл импорта читаем не дальше этого размера (защита от gz/zip-бомб)
+IMPORT_MAX_TEXT_SIZE = 10 * 1024 * 1024
+
+FORMATS = ("md", "jsonl", "csv")
+COMPRESSIONS = ("gz", "zip")
+
+
+def iter_markdown(username: str, stats: dict, notes: Iterable, exported_at: datetime) -> Iterator[str]:
+    yield f"# Экспорт заметок для пользователя @{username}\n"
+    yield f"Дата экспорта: {exported_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+
+    yield "## 📊 Сводная статистика\n\n"
+    yield f"* **Занято слотов:** {stats['total_notes']} / {NOTES_LIMIT}\n"
+    yield f"* **Суммарный объем:** {stats['total_chars']:,} символов\n\n"
+
+    yield "### История действий (за всё время)\n"
+    yield f"* ✅ Создано: **{stats['total_created']}**\n"
+    yield f"* ✍️ Изменено: **{stats['total_edited']}**\n"
+    yield f"* ❌ Удалено: **{stats['total_deleted']}**\n\n"
+
+    yield "### Активность за последнюю неделю\n"
+    yield f"* ✅ Создано: **{stats['weekly_created']}**\n"
+    yield f"* ✍️ Изменено: **{stats['weekly_edited']}**\n"
+    yield f"* ❌ Удалено: **{stats['weekly_deleted']}**\n\n"
+
+    yield "---\n\n"
+    yield f"## 📝 Ваши заметки ({stats['total_notes']} шт.)\n\n"
+
+    for note in notes:
+        note_text_quoted = "> " + note['text'].replace('\n', '\n> ')
+        yield (
+            f"### Заметка #{note['id']}\n"
+            f"* **Дата создания:** {note['created_at']}\n\n"
+            f"{note_text_quoted}\n\n"
+            "---\n\n"
+        )
+
+
+def iter_jsonl(notes: Iterable) -> Iterator[str]:
+    for note in notes:
+        yield json.dumps(
+            {"id": note["id"], "text": note["text"], "created_at": note["created_at"]},
+            ensure_ascii=False
+        ) + "\n"
+
+
+def iter_csv(notes: Iterable) -> Iterator[str]:
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(("id", "text", "created_at"))
+    yield line.getvalue()
+    for note in notes:
+        line.seek(0)
+        line.truncate()
+        writer.writerow((note["id"], note["text"], note["created_at"]))
+        yield line.getvalue()
+
+
+def iter_export(fmt: str, username: str, stats: dict, notes: Iterable, exported_at: datetime) -> Iterator[str]:
+    if fmt == "md":
+        return iter_markdown(username, stats, notes, exported_at)
+    if fmt == "jsonl":
+        return iter_jsonl(notes)
+    if fmt == "csv":
+        return iter_csv(notes)
+    raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+
+def build_export(chunks: Iterable[str], file_name: str, compression: str | None = None) -> tuple[IO[bytes], str]:
+    """
+    Пишет chunks в буфер (с gzip/zip при необходимости).
+    Возвращает буфер, перемотанный в начало, и итоговое имя файла.
+    """
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        if compression == "gz":
+            with gzip.GzipFile(filename=file_name, mode="wb", fileobj=buf) as gz:
+                _write_text(gz, chunks)
+            file_name += ".gz"
+        elif compression == "zip":
+            with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                with zf.open(file_name, "w") as member:
+                    _write_text(member, chunks)
+            file_name += ".zip"
+        elif compression is None:
+            _write_text(buf, chunks)
+        else:
+            raise ValueError(f"Неизвестное сжатие: {compression}")
+    except Exception:
+        buf.close()
+        raise
+
+    buf.seek(0)
+    return buf, file_name
+
+
+def _write_text(dst: IO[bytes], chunks: Iterable[str]) -> None:
+    for chunk in chunks:
+        dst.write(chunk.encode("utf-8"))
+
+
+# ---------- импорт ----------
+
+class ImportFileError(ValueError):
+    """Ошибка в содержимом файла импорта; line - номер строки, если известен."""
+
+    def __init__(self, message: str, line: int | None = None):
+        super().__init__(message)
+        self.line = line
+
+
+class _LimitedReader(io.RawIOBase):
+    """Отдаёт не больше limit байт из raw; на следующем байте - ImportFileError."""
+
+    def __init__(self, raw: IO[bytes], limit: int):
+        self._raw = raw
+        self._left = limit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._raw.read(min(len(b), self._left + 1))
+        if len(data) > self._left:
+            raise ImportFileError(f"после распаковки файл больше {IMPORT_MAX_TEXT_SIZE // (1024 * 1024)} МБ")
+        self._left -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+_MD_NOTE_HEADER = re.compile(r"^### Заметка #\d+\s*$")
+_MD_CREATED_AT = "* **Дата создания:** "
+
+
+def detect_format(file_name: str) -> tuple[str, str | None]:
+    """(формат, сжатие) по имени файла: notes.jsonl.gz -> ("jsonl", "gz")."""
+    name = file_name.lower()
+    compression = None
+    for ext in COMPRESSIONS:
+        if name.endswith("." + ext):
+            compression = ext
+            name = name[:-len(ext) - 1]
+    for fmt in FORMATS:
+        if name.endswith("." + fmt):
+            return fmt, compression
+    raise ValueError(f"Неизвестный формат файла: {file_name}")
+
+
+def open_text(raw: IO[bytes], compression: str | None = None, max_size: int = IMPORT_MAX_TEXT_SIZE) -> TextIO:
+    """
+    Текстовый поток поверх загруженного файла (распаковка на лету).
+    Больше max_size байт распакованного текста не читается.
+    """
+    if compression == "gz":
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif compression == "zip":
+        zf = zipfile.ZipFile(raw)
+        members = [m for m in zf.infolist() if not m.is_dir()]
+        if not members:
+            raise ImportFileError("пустой zip-архив")
+        raw = zf.open(members[0])
+    return io.TextIOWrapper(io.BufferedReader(_LimitedReader(raw, max_size)), encoding="utf-8-sig", newline="")
+
+
+def parse_markdown(lines: Iterable[str]) -> Iterator[dict]:
+    """Заметки из Markdown-экспорта: блоки "### Заметка #N" с цитатой "> ..."."""
+    note = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if _MD_NOTE_HEADER.match(line):
+            if note is not None:
+                yield _md_note(note)
+            note = {"created_at": None, "lines": []}
+        elif note is None:
+            continue
+        elif line.startswith(_MD_CREATED_AT):
+            note["created_at"] = line[len(_MD_CREATED_AT):].strip() or None
+        elif line.startswith("> ") or line == ">":
+            note["lines"].append(line[2:])
+        elif line == "---":
+            yield _md_note(note)
+            note = None
+    if note is not None:
+        yield _md_note(note)
+
+
+def _md_note(note: dict) -> dict:
+    return {"text": "\n".join(note["lines"]), "created_at": note["created_at"]}
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ImportFileError("строка не в формате JSON", line_no) from None
+        if not isinstance(item, dict):
+            raise ImportFileError('ожидался объект {"text": ...}', line_no)
+        text, created_at = item.get("text"), item.get("created_at")
+        if not isinstance(text, (str, type(None))) or not isinstance(created_at, (str, type(None))):
+            raise ImportFileError("text и created_at должны быть строками", line_no)
+        yield {"text": text or "", "created_at": created_at}
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[dict]:
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            yield {"text": row.get("text") or "", "created_at": row.get("created_at") or None}
+    except csv.Error as e:
+        # line_num - уже разобранные строки, ошибка в следующей
+        raise ImportFileError(f"ошибка CSV: {e}", reader.line_num + 1) from None
+
+
+def iter_import(fmt: str, lines: Iterable[str]) -> Iterator[dict]:
+    if fmt == "md":
+        return parse_markdown(lines)
+    if fmt == "jsonl":
+        return parse_jsonl(lines)
+    if fmt == "csv":
+        return parse_csv(lines)
+    raise ValueError(f"Неизвестный формат импорта: {fmt}")
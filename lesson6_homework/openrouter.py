@@ -1,13 +1,43 @@
 from __future__ import annotations
-import os, time, requests
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
+import json, os, random, threading, time, requests
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
 OPENROUTER_API = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Таймаут установки соединения (сек.); timeout_s в chat_once - таймаут чтения ответа
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+# Сколько keep-alive соединений к openrouter.ai держать открытыми
+OPENROUTER_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "16"))
+# Повторы при временных сбоях: всего попыток, базовая и максимальная пауза (сек.)
+OPENROUTER_RETRY_ATTEMPTS = int(os.getenv("OPENROUTER_RETRY_ATTEMPTS", "3"))
+OPENROUTER_RETRY_BASE_S = float(os.getenv("OPENROUTER_RETRY_BASE_S", "0.5"))
+OPENROUTER_RETRY_MAX_S = float(os.getenv("OPENROUTER_RETRY_MAX_S", "8"))
+# Circuit breaker по модели: окно последних вызовов, минимум вызовов для решения,
+# доля неудач для размыкания, "медленный" вызов (мс) считается неудачей, пауза до пробы (сек.)
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_MS = int(os.getenv("BREAKER_SLOW_MS", "20000"))
+BREAKER_OPEN_S = float(os.getenv("BREAKER_OPEN_S", "60"))
+# Клиентский лимит запросов (token bucket): запросов в минуту и размер всплеска
+# для всех запросов вместе, для каждой модели и для каждого API-ключа; 0 - без лимита
+RATE_LIMIT_GLOBAL_RPM = float(os.getenv("RATE_LIMIT_GLOBAL_RPM", "120"))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", "10"))
+RATE_LIMIT_MODEL_RPM = float(os.getenv("RATE_LIMIT_MODEL_RPM", "20"))
+RATE_LIMIT_MODEL_BURST = int(os.getenv("RATE_LIMIT_MODEL_BURST", "5"))
+RATE_LIMIT_KEY_RPM = float(os.getenv("RATE_LIMIT_KEY_RPM", "60"))
+RATE_LIMIT_KEY_BURST = int(os.getenv("RATE_LIMIT_KEY_BURST", "10"))
+# Сколько по умолчанию ждать свободного места (сек.; 0 - сразу отказ) и сколько вызовов может ждать одновременно
+RATE_LIMIT_WAIT_S = float(os.getenv("RATE_LIMIT_WAIT_S", "10"))
+RATE_LIMIT_MAX_WAITERS = int(os.getenv("RATE_LIMIT_MAX_WAITERS", "32"))
 
 @dataclass
 class OpenRouterError(Exception):
@@ -16,6 +46,12 @@ class OpenRouterError(Exception):
     def __str__(self) -> str:
         return f"[{self.status}] {self.msg}"
 
+
+@dataclass
+class RateLimitExceeded(OpenRouterError):
+    """Запрос не отправлен: упёрлись в собственный лимит (scope: global, model или key)."""
+    scope: str = "global"
+
 def _friendly(status: int) -> str:
     return {
         400: "Неверный формат запроса.",
@@ -29,19 +65,439 @@ def _friendly(status: int) -> str:
         504: "Сервер модели не отвечает (Gateway Timeout). Попробуйте позднее.",
     }.get(status, "Сервис недоступен. Повторите попытку позже.")
 
+class OpenRouterClient:
+    """
+    HTTP-клиент OpenRouter поверх одной requests.Session: TCP/TLS-соединения
+    переиспользуются между вопросами (keep-alive), заголовки авторизации заданы один раз.
+    Session потокобезопасна для запросов, пул соединений ограничен pool_size.
+    """
+
+    def __init__(self, api_key: str, *,
+                 url: str = OPENROUTER_API,
+                 pool_size: int = OPENROUTER_POOL_SIZE,
+                 connect_timeout: float = OPENROUTER_CONNECT_TIMEOUT):
+        self.api_key = api_key
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+    def post(self, payload: Dict, timeout_s: float, **kwargs) -> requests.Response:
+        timeout = (min(self.connect_timeout, timeout_s), timeout_s)
+        return self.session.post(self.url, json=payload, timeout=timeout, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: OpenRouterClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenRouterClient:
+    """Общий клиент модуля; пересоздаётся, если сменились ключ или URL."""
+    global _client
+    client = _client
+    if client is None or client.api_key != OPENROUTER_API_KEY or client.url != OPENROUTER_API:
+        with _client_lock:
+            client = _client
+            if client is None or client.api_key != OPENROUTER_API_KEY or client.url != OPENROUTER_API:
+                if client is not None:
+                    client.close()
+                client = _client = OpenRouterClient(OPENROUTER_API_KEY, url=OPENROUTER_API)
+    return client
+
+
+# Статусы, при которых запрос не был выполнен и его безопасно повторить
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# Счётчики клиента: requests - HTTP-попытки, retries - повторы,
+# retry_exhausted - временный сбой так и вернулся вызывающему (попытки или дедлайн кончились)
+metrics: Counter = Counter()
+_metrics_lock = threading.Lock()
+
+
+def _inc(name: str, n: int = 1) -> None:
+    with _metrics_lock:
+        metrics[name] += n
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Повторы с decorrelated jitter: пауза = min(max_delay_s, random(base_delay_s, предыдущая * 3)).
+    Retry-After от сервера - нижняя граница паузы. Все попытки укладываются в общий
+    дедлайн (deadline_s, по умолчанию - timeout_s вызова): если пауза в него не влезает, сдаёмся.
+    """
+    max_attempts: int = OPENROUTER_RETRY_ATTEMPTS
+    base_delay_s: float = OPENROUTER_RETRY_BASE_S
+    max_delay_s: float = OPENROUTER_RETRY_MAX_S
+    deadline_s: float | None = None
+    sleep: Callable[[float], None] = field(default=time.sleep, repr=False)
+
+    def backoff(self, prev_delay: float) -> float:
+        upper = max(prev_delay, self.base_delay_s) * 3
+        return min(self.max_delay_s, random.uniform(self.base_delay_s, upper))
+
+
+retry_policy = RetryPolicy()
+
+
+def _retry_after(r: requests.Response) -> float | None:
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _post(payload: Dict, timeout_s: float, *, stream: bool = False) -> requests.Response:
+    """
+    POST с повторами по retry_policy. Повторяются только сбои, после которых запрос
+    точно не обработан: RETRY_STATUSES и ошибки соединения (но не таймаут чтения).
+    Возвращает последний ответ (в том числе неуспешный) или бросает последнее исключение.
+    """
+    policy = retry_policy
+    deadline = time.monotonic() + (policy.deadline_s if policy.deadline_s is not None else timeout_s)
+    delay = 0.0
+    attempt = 0
+    while True:
+        attempt += 1
+        _inc("requests")
+        remaining = max(deadline - time.monotonic(), 0.001)
+        try:
+            r = get_client().post(payload, remaining, stream=stream)
+        except requests.ConnectionError as e:
+            failure, retry_after = e, None
+        else:
+            if r.status_code not in RETRY_STATUSES:
+                return r
+            failure, retry_after = r, _retry_after(r)
+
+        if attempt >= policy.max_attempts:
+            break
+        delay = policy.backoff(delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            break
+        if isinstance(failure, requests.Response):
+            failure.close()
+        _inc("retries")
+        policy.sleep(delay)
+
+    _inc("retry_exhausted")
+    if isinstance(failure, Exception):
+        raise failure
+    return failure
+
+
+class CircuitBreaker:
+    """
+    Автомат closed -> open -> half_open для одной модели.
+
+    closed: вызовы идут, исходы копятся в окне; при доле неудач (ошибка или
+    дольше slow_ms) >= failure_rate среди >= min_calls вызовов - open.
+    open: allow() = False, пока не пройдёт open_s; затем half_open.
+    half_open: пропускается один пробный вызов; успех - closed, неудача - снова open.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, *, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, slow_ms: int = BREAKER_SLOW_MS,
+                 open_s: float = BREAKER_OPEN_S, clock: Callable[[], float] = time.monotonic):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_ms = slow_ms
+        self.open_s = open_s
+        self._clock = clock
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_s:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, ms: int) -> None:
+        ok = ok and ms < self.slow_ms
+        with self._lock:
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(ok)
+            if state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def cancel(self) -> None:
+        """Вызов не состоялся или ничего не сказал о модели - освобождаем пробу."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(self.open_s - (self._clock() - self._opened_at), 0) if state == self.OPEN else 0
+            return {
+                "state": state,
+                "calls": len(self._outcomes),
+                "failures": self._outcomes.count(False),
+                "retry_in_s": int(retry_in),
+            }
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    breaker = breakers.get(model)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = breakers.setdefault(model, CircuitBreaker())
+    return breaker
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """Ошибка говорит о здоровье модели (а не о нашем запросе, ключе или лимитах)."""
+    if isinstance(error, RateLimitExceeded):
+        return False
+    if isinstance(error, OpenRouterError):
+        return error.status >= 500 or error.status in (404, 408, 429)
+    return isinstance(error, requests.RequestException)
+
+
+def _observe(model: str, t0: float, error: BaseException | None) -> None:
+    if error is not None and not is_model_failure(error):
+        get_breaker(model).cancel()
+        return
+    get_breaker(model).record(error is None, int((time.perf_counter() - t0) * 1000))
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity; один запрос - один токен."""
+
+    def __init__(self, rate: float, capacity: int, now: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 - уже есть)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Token bucket перед запросами к OpenRouter: общий, на модель и на API-ключ.
+    Токен берётся сразу из всех трёх, поэтому запрос ждёт самый пустой из них.
+    Ждать можно не дольше wait_s и не больше чем max_waiters вызовам сразу,
+    иначе RateLimitExceeded без похода к провайдеру.
+    """
+    SCOPES = ("global", "model", "key")
+
+    def __init__(self, *, global_rpm: float = RATE_LIMIT_GLOBAL_RPM, global_burst: int = RATE_LIMIT_GLOBAL_BURST,
+                 model_rpm: float = RATE_LIMIT_MODEL_RPM, model_burst: int = RATE_LIMIT_MODEL_BURST,
+                 key_rpm: float = RATE_LIMIT_KEY_RPM, key_burst: int = RATE_LIMIT_KEY_BURST,
+                 max_waiters: int = RATE_LIMIT_MAX_WAITERS,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self._limits = {
+            "global": (global_rpm / 60, global_burst),
+            "model": (model_rpm / 60, model_burst),
+            "key": (key_rpm / 60, key_burst),
+        }
+        self.max_waiters = max_waiters
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._waiters = 0
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _bucket(self, scope: str, name: str, now: float) -> TokenBucket | None:
+        rate, burst = self._limits[scope]
+        if rate <= 0:
+            return None
+        bucket = self._buckets.get((scope, name))
+        if bucket is None:
+            bucket = self._buckets[(scope, name)] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _try_take(self, model: str, api_key: str) -> Tuple[float, str]:
+        """Под замком: берёт токены (0.0, "") или возвращает (пауза, самый пустой scope)."""
+        now = self._clock()
+        buckets = [
+            (scope, b) for scope, name in (("global", ""), ("model", model), ("key", api_key))
+            if (b := self._bucket(scope, name, now)) is not None
+        ]
+        delay, scope = 0.0, ""
+        for sc, b in buckets:
+            d = b.delay(now)
+            if d > delay:
+                delay, scope = d, sc
+        if delay == 0:
+            for _, b in buckets:
+                b.take()
+        return delay, scope
+
+    def try_acquire(self, model: str, api_key: str = "") -> Tuple[float, str]:
+        """Без ожидания (для asyncio): (0.0, "") - разрешение взято, иначе (через сколько сек. повторить, scope)."""
+        with self._lock:
+            delay, scope = self._try_take(model, api_key)
+            if delay == 0:
+                self.stats["granted"] += 1
+            return delay, scope
+
+    def reject(self, delay: float, scope: str) -> RateLimitExceeded:
+        with self._lock:
+            self.stats["rejected"] += 1
+        return RateLimitExceeded(429, f"Слишком много запросов, попробуйте через {int(delay) + 1} с.", scope)
+
+    def acquire(self, model: str, api_key: str = "", wait_s: float | None = None) -> float:
+        """Берёт разрешение на запрос; возвращает, сколько секунд пришлось ждать."""
+        wait_s = RATE_LIMIT_WAIT_S if wait_s is None else wait_s
+        t0 = self._clock()
+        with self._lock:
+            delay, scope = self._try_take(model, api_key)
+            if delay == 0:
+                self.stats["granted"] += 1
+                return 0.0
+            if delay > wait_s:
+                self.stats["rejected"] += 1
+                raise RateLimitExceeded(429, f"Слишком много запросов, попробуйте через {int(delay) + 1} с.", scope)
+            if self._waiters >= self.max_waiters:
+                self.stats["rejected_queue_full"] += 1
+                raise RateLimitExceeded(429, "Очередь запросов к моделям переполнена, попробуйте через минуту.", scope)
+            self._waiters += 1
+        try:
+            while True:
+                self._sleep(delay)
+                with self._lock:
+                    delay, scope = self._try_take(model, api_key)
+                    waited = self._clock() - t0
+                    if delay == 0:
+                        self.stats["granted"] += 1
+                        self.stats["waited"] += 1
+                        return waited
+                    if waited + delay > wait_s:
+                        self.stats["rejected"] += 1
+                        raise RateLimitExceeded(429, f"Слишком много запросов, попробуйте через {int(delay) + 1} с.",
+                                                scope)
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            buckets = []
+            for (scope, name), b in sorted(self._buckets.items()):
+                b.delay(now)
+                if scope == "key":
+                    name = "…" + name[-4:] if name else "(нет ключа)"
+                buckets.append({"scope": scope, "name": name, "tokens": round(b.tokens, 1),
+                                "capacity": b.capacity, "rpm": round(b.rate * 60, 1)})
+            return {"buckets": buckets, "waiters": self._waiters, "max_waiters": self.max_waiters,
+                    "stats": dict(self.stats)}
+
+
+rate_limiter = RateLimiter()
+
+
+def _acquire(model: str, wait_s: float | None) -> None:
+    try:
+        rate_limiter.acquire(model, OPENROUTER_API_KEY or "", wait_s)
+    except RateLimitExceeded:
+        # запрос к модели не состоялся - если это была проба breaker'а, освобождаем её
+        get_breaker(model).cancel()
+        raise
+
+
 def chat_once(messages: List[Dict], *,
               model: str,
               temperature: float = 0.2,
               max_tokens: int = 400,
-              timeout_s: int = 30) -> Tuple[str, int]:
+              timeout_s: int = 30,
+              wait_s: float | None = None,
+              deadline: float | None = None) -> Tuple[str, int]:
+    """
+    wait_s - сколько ждать очереди лимитера (None - RATE_LIMIT_WAIT_S, 0 - сразу отказ).
+    deadline - момент по time.monotonic(), к которому укладываются и ожидание лимитера, и сам запрос.
+    """
+    if deadline is not None:
+        left = deadline - time.monotonic()
+        wait_s = left if wait_s is None else min(wait_s, left)
+    _acquire(model, wait_s)
+    if deadline is not None:
+        timeout_s = min(timeout_s, deadline - time.monotonic())
+        if timeout_s <= 0:
+            get_breaker(model).cancel()
+            raise OpenRouterError(504, _friendly(504))
+    t0 = time.perf_counter()
+    try:
+        result = _chat_once(messages, model=model, temperature=temperature, max_tokens=max_tokens, timeout_s=timeout_s)
+    except Exception as e:
+        _observe(model, t0, e)
+        raise
+    _observe(model, t0, None)
+    return result
+
+
+def _chat_once(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+               timeout_s: float) -> Tuple[str, int]:
     if not OPENROUTER_API_KEY:
         raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
     payload = {
         "model": model,
         "messages": messages,
@@ -50,16 +506,196 @@ def chat_once(messages: List[Dict], *,
     }
 
     t0 = time.perf_counter()
-    r = requests.post(OPENROUTER_API, json=payload, headers=headers, timeout=timeout_s)
+    r = _post(payload, timeout_s)
     dt_ms = int((time.perf_counter() - t0) * 1000)
 
     if r.status_code // 100 != 2:
         raise OpenRouterError(r.status_code, _friendly(r.status_code))
 
     try:
-        data = r.json()
-        text = data["choices"][0]["message"]["content"]
+        text = _message_text(r.json())
+    except ValueError:
+        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+
+    return text, dt_ms
+
+
+def _message_text(data) -> str:
+    try:
+        return data["choices"][0]["message"]["content"]
     except Exception:
         raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
 
-    return text, dt_ms
\ No newline at end of file
+
+def chat_many(requests: Iterable[Dict], max_concurrency: int = 4,
+              deadline: float | None = None) -> Iterator[Tuple[int, Tuple[str, int] | Exception]]:
+    """
+    Пакет запросов: каждый элемент - kwargs для chat_once (messages, model, ...).
+    Выполняется не больше max_concurrency одновременно через общую сессию;
+    результаты отдаются по мере готовности: (индекс во входе, (text, ms) или исключение).
+    Ошибка одного запроса пакет не прерывает. Входные запросы читаются лениво,
+    поэтому подойдёт и генератор; если перестать читать результаты, невыполненные отменяются.
+    deadline (time.monotonic()) передаётся каждому chat_once; когда он наступает,
+    пакет заканчивается: ещё не начатые запросы отменяются, начатые укладываются в него сами.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency должен быть >= 1")
+    # больше одновременных запросов, чем соединений в пуле, - лишние соединения не переиспользуются
+    max_concurrency = min(max_concurrency, OPENROUTER_POOL_SIZE)
+
+    items = enumerate(requests)
+    pending: Dict[Future, int] = {}
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chat-many")
+
+    def submit_next() -> bool:
+        try:
+            index, kwargs = next(items)
+        except StopIteration:
+            return False
+        if deadline is not None:
+            kwargs = {**kwargs, "deadline": deadline}
+        pending[executor.submit(chat_once, **kwargs)] = index
+        return True
+
+    try:
+        while len(pending) < max_concurrency and submit_next():
+            pass
+        while pending:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                yield index, error if error is not None else future.result()
+                submit_next()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class StreamHandle:
+    """
+    Ручка для закрытия chat_stream из другого потока: close() обрывает соединение,
+    даже если читатель ждёт первый токен. Для breaker это отмена, а не сбой модели.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._response: requests.Response | None = None
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            r = self._response
+        if r is not None:
+            _abort(r)
+
+    def _attach(self, r: requests.Response) -> None:
+        with self._lock:
+            self._response = r
+            closed = self._closed
+        if closed:
+            _abort(r)
+
+
+def _abort(r: requests.Response) -> None:
+    # shutdown будит поток, заблокированный в recv (urllib3 >= 2.3); close сам этого не делает
+    try:
+        r.raw.shutdown()
+    except (AttributeError, ValueError, RuntimeError, OSError):
+        pass
+    r.close()
+
+
+def chat_stream(messages: List[Dict], *,
+                model: str,
+                temperature: float = 0.2,
+                max_tokens: int = 400,
+                timeout_s: int = 30,
+                wait_s: float | None = None,
+                handle: StreamHandle | None = None) -> Iterator[str]:
+    """
+    Потоковый ответ (stream: true, Server-Sent Events): отдаёт куски текста по мере генерации.
+    Ошибки - те же OpenRouterError, что и у chat_once, в том числе пришедшие посреди потока.
+    handle.close() из другого потока завершает поток без ошибки.
+    """
+    _acquire(model, wait_s)
+    t0 = time.perf_counter()
+    try:
+        yield from _chat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                timeout_s=timeout_s, handle=handle)
+    except GeneratorExit:
+        # потребитель сам прекратил чтение - о модели это ничего не говорит
+        get_breaker(model).cancel()
+        raise
+    except Exception as e:
+        if handle is None or not handle.closed:
+            _observe(model, t0, e)
+            raise
+    if handle is not None and handle.closed:
+        get_breaker(model).cancel()
+        return
+    _observe(model, t0, None)
+
+
+def _chat_stream(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                 timeout_s: float, handle: StreamHandle | None = None) -> Iterator[str]:
+    if not OPENROUTER_API_KEY:
+        raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+
+    with _post(payload, timeout_s, stream=True) as r:
+        if handle is not None:
+            handle._attach(r)
+        if r.status_code // 100 != 2:
+            raise OpenRouterError(r.status_code, _friendly(r.status_code))
+
+        r.encoding = "utf-8"
+        for line in r.iter_lines(decode_unicode=True):
+            delta = _sse_delta(line)
+            if delta is SSE_DONE:
+                return
+            if delta:
+                yield delta
+
+
+# Признак конца потока ("data: [DONE]")
+SSE_DONE = object()
+
+
+def _sse_delta(line: str):
+    """
+    Разбор одной строки SSE от OpenRouter: кусок текста, None (строку пропускаем)
+    или SSE_DONE. Ошибка, пришедшая в потоке, - OpenRouterError.
+    """
+    # пустые строки разделяют события, ":" - комментарии (keep-alive от OpenRouter)
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return SSE_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+
+    if "error" in chunk:
+        status = chunk["error"].get("code")
+        status = status if isinstance(status, int) else 500
+        raise OpenRouterError(status, _friendly(status))
+
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or None
@@ -0,0 +1,229 @@
+"""
+Асинхронный клиент OpenRouter на aiohttp: achat_once и achat_stream.
+
+Поведение то же, что у openrouter.chat_once / chat_stream: те же OpenRouterError
+и тексты _friendly, повторы по openrouter.retry_policy, лимитер запросов
+и circuit breaker модели. Соединения - из одного пула aiohttp.ClientSession
+на event loop. Отмена задачи (asyncio.CancelledError) закрывает HTTP-ответ
+и не считается сбоем модели.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Tuple
+
+import aiohttp
+
+import openrouter
+from openrouter import OpenRouterError, RETRY_STATUSES, _friendly, _inc, _message_text, _retry_after, _sse_delta
+
+
+class AsyncOpenRouterClient:
+    """
+    aiohttp.ClientSession с пулом на pool_size соединений (keep-alive) и заголовками
+    авторизации. Сессия привязана к event loop, в котором создан клиент.
+    """
+
+    def __init__(self, api_key: str, *,
+                 url: str = openrouter.OPENROUTER_API,
+                 pool_size: int = openrouter.OPENROUTER_POOL_SIZE,
+                 connect_timeout: float = openrouter.OPENROUTER_CONNECT_TIMEOUT):
+        self.api_key = api_key
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+
+    async def post(self, payload: Dict, timeout_s: float) -> aiohttp.ClientResponse:
+        timeout = aiohttp.ClientTimeout(sock_connect=min(self.connect_timeout, timeout_s), sock_read=timeout_s)
+        return await self.session.post(self.url, json=payload, timeout=timeout)
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+_client: AsyncOpenRouterClient | None = None
+
+
+def get_async_client() -> AsyncOpenRouterClient:
+    """Общий клиент текущего event loop; пересоздаётся при смене loop, ключа или URL."""
+    global _client
+    client = _client
+    loop = asyncio.get_running_loop()
+    if (client is None or client.loop is not loop or client.session.closed
+            or client.api_key != openrouter.OPENROUTER_API_KEY or client.url != openrouter.OPENROUTER_API):
+        if client is not None and client.loop is loop and not client.session.closed:
+            loop.create_task(client.close())
+        client = _client = AsyncOpenRouterClient(openrouter.OPENROUTER_API_KEY, url=openrouter.OPENROUTER_API)
+    return client
+
+
+async def aclose_client() -> None:
+    global _client
+    client, _client = _client, None
+    if client is not None and not client.session.closed:
+        await client.close()
+
+
+async def _aacquire(model: str, wait_s: float | None) -> None:
+    """Как openrouter._acquire, но ждёт через asyncio.sleep, не занимая поток."""
+    limiter = openrouter.rate_limiter
+    wait_s = openrouter.RATE_LIMIT_WAIT_S if wait_s is None else wait_s
+    t0 = time.monotonic()
+    while True:
+        delay, scope = limiter.try_acquire(model, openrouter.OPENROUTER_API_KEY or "")
+        if delay == 0:
+            return
+        if time.monotonic() - t0 + delay > wait_s:
+            openrouter.get_breaker(model).cancel()
+            raise limiter.reject(delay, scope)
+        await asyncio.sleep(delay)
+
+
+async def _apost(payload: Dict, timeout_s: float) -> aiohttp.ClientResponse:
+    """
+    POST с повторами, как openrouter._post. Сбой соединения и таймаут после
+    последней попытки - OpenRouterError 503 и 504 соответственно.
+    """
+    policy = openrouter.retry_policy
+    deadline = time.monotonic() + (policy.deadline_s if policy.deadline_s is not None else timeout_s)
+    delay = 0.0
+    attempt = 0
+    while True:
+        attempt += 1
+        _inc("requests")
+        remaining = max(deadline - time.monotonic(), 0.001)
+        try:
+            r = await get_async_client().post(payload, remaining)
+        except asyncio.TimeoutError:
+            # таймаут не повторяем: запрос мог быть принят
+            raise OpenRouterError(504, _friendly(504))
+        except aiohttp.ClientConnectionError:
+            failure, retry_after = None, None
+        else:
+            if r.status not in RETRY_STATUSES:
+                return r
+            failure, retry_after = r, _retry_after(r)
+
+        if attempt >= policy.max_attempts:
+            break
+        delay = policy.backoff(delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            break
+        if failure is not None:
+            failure.release()
+        _inc("retries")
+        await asyncio.sleep(delay)
+
+    _inc("retry_exhausted")
+    if failure is None:
+        raise OpenRouterError(503, _friendly(0))
+    return failure
+
+
+async def achat_once(messages: List[Dict], *,
+                     model: str,
+                     temperature: float = 0.2,
+                     max_tokens: int = 400,
+                     timeout_s: float = 30,
+                     wait_s: float | None = None) -> Tuple[str, int]:
+    await _aacquire(model, wait_s)
+    t0 = time.perf_counter()
+    try:
+        result = await _achat_once(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                   timeout_s=timeout_s)
+    except asyncio.CancelledError:
+        openrouter.get_breaker(model).cancel()
+        raise
+    except Exception as e:
+        openrouter._observe(model, t0, e)
+        raise
+    openrouter._observe(model, t0, None)
+    return result
+
+
+async def _achat_once(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                      timeout_s: float) -> Tuple[str, int]:
+    if not openrouter.OPENROUTER_API_KEY:
+        raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+    t0 = time.perf_counter()
+    async with await _apost(payload, timeout_s) as r:
+        if r.status // 100 != 2:
+            raise OpenRouterError(r.status, _friendly(r.status))
+        try:
+            data = await r.json(content_type=None)
+        except ValueError:
+            raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+        except asyncio.TimeoutError:
+            raise OpenRouterError(504, _friendly(504))
+    dt_ms = int((time.perf_counter() - t0) * 1000)
+    return _message_text(data), dt_ms
+
+
+async def achat_stream(messages: List[Dict], *,
+                       model: str,
+                       temperature: float = 0.2,
+                       max_tokens: int = 400,
+                       timeout_s: float = 30,
+                       wait_s: float | None = None) -> AsyncIterator[str]:
+    """
+    Потоковый ответ, как openrouter.chat_stream. Если перестать читать (aclose)
+    или отменить задачу, соединение закрывается.
+    """
+    await _aacquire(model, wait_s)
+    t0 = time.perf_counter()
+    try:
+        async for delta in _achat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                         timeout_s=timeout_s):
+            yield delta
+    except (GeneratorExit, asyncio.CancelledError):
+        openrouter.get_breaker(model).cancel()
+        raise
+    except Exception as e:
+        openrouter._observe(model, t0, e)
+        raise
+    openrouter._observe(model, t0, None)
+
+
+async def _achat_stream(messages: List[Dict], *, model: str, temperature: float, max_tokens: int,
+                        timeout_s: float) -> AsyncIterator[str]:
+    if not openrouter.OPENROUTER_API_KEY:
+        raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+
+    async with await _apost(payload, timeout_s) as r:
+        if r.status // 100 != 2:
+            raise OpenRouterError(r.status, _friendly(r.status))
+        try:
+            async for raw in r.content:
+                delta = _sse_delta(raw.decode("utf-8").rstrip("\r\n"))
+                if delta is openrouter.SSE_DONE:
+                    return
+                if delta:
+                    yield delta
+        except asyncio.TimeoutError:
+            raise OpenRouterError(504, _friendly(504))
@@ -32,4 +32,22 @@ def openrouter_module():
     """
     Импортируем openrouter_client.py
     """
-    return importlib.import_module("openrouter")
\ No newline at end of file
+    return importlib.import_module("openrouter")
+
+@pytest.fixture(autouse=True)
+def unlimited_rate_limiter(monkeypatch):
+    """
+    Клиентский лимитер OpenRouter в тестах не ограничивает (проверяется отдельно)
+    """
+    openrouter = importlib.import_module("openrouter")
+    monkeypatch.setattr(openrouter, "rate_limiter", openrouter.RateLimiter(global_rpm=0, model_rpm=0, key_rpm=0))
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    """
+    Повторы OpenRouter в тестах выключены, чтобы не спать на паузах между попытками.
+    Переменная окружения действует и после reload(openrouter); тесты повторов задают свою RetryPolicy.
+    """
+    openrouter = importlib.import_module("openrouter")
+    monkeypatch.setenv("OPENROUTER_RETRY_ATTEMPTS", "1")
+    monkeypatch.setattr(openrouter, "retry_policy", openrouter.RetryPolicy(max_attempts=1))
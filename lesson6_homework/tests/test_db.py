@@ -278,4 +278,405 @@ def test_update_note_no_stats_on_failure(db_module):
             (uid,)
         ).fetchone()[0]
 
-    assert cnt == 0, "При неудачном update не должно быть записи в stats"
\ No newline at end of file
+    assert cnt == 0, "При неудачном update не должно быть записи в stats"
+
+def test_pool_reuses_connection(db_module):
+    db = db_module
+
+    with db._connect() as conn1:
+        pass
+    with db._connect() as conn2:
+        pass
+
+    assert conn1 is conn2, "Соединение должно возвращаться в пул и переиспользоваться"
+
+
+def test_pool_reentrant_in_same_thread(db_module):
+    db = db_module
+
+    with db._connect() as outer:
+        with db._connect() as inner:
+            assert inner is outer, "Вложенный _connect() в том же потоке отдаёт то же соединение"
+
+
+def test_pool_separate_connections_per_thread(db_module):
+    import threading
+
+    db = db_module
+    seen = []
+    barrier = threading.Barrier(2)
+
+    def worker():
+        with db._connect() as conn:
+            seen.append(conn)
+            barrier.wait(timeout=5)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(seen) == 2 and seen[0] is not seen[1], "Параллельные потоки получают разные соединения"
+
+
+def test_find_notes_fts_ranks_and_highlights(db_module):
+    db = db_module
+    uid = 888020
+
+    db.add_note(uid, "Купить хлеб")
+    best = db.add_note(uid, "Молоко, молоко и ещё раз молоко")
+    other = db.add_note(uid, "Купить молоко и хлеб в магазине у дома после работы")
+    db.add_note(888021, "Молоко чужого пользователя")
+
+    found = db.find_notes(uid, "молоко")
+
+    assert [n["id"] for n in found] == [best, other], "Сортировка по BM25, только свои заметки"
+    assert db.SNIPPET_OPEN + "Молоко" + db.SNIPPET_CLOSE in found[0]["snippet"]
+
+
+def test_find_notes_fts_follows_update_and_delete(db_module):
+    db = db_module
+    uid = 888022
+
+    note_id = db.add_note(uid, "Старый текст")
+    db.update_note(uid, note_id, "Новый текст")
+
+    assert db.find_notes(uid, "старый") == []
+    assert [n["id"] for n in db.find_notes(uid, "новый")] == [note_id]
+
+    db.delete_note(uid, note_id)
+    assert db.find_notes(uid, "новый") == []
+
+
+def test_find_notes_fts_filters_user_inside_match(db_module):
+    db = db_module
+    uid = 888024
+
+    mine = db.add_note(uid, "Общее слово")
+    for other in range(888025, 888030):
+        db.add_note(other, "Общее слово")
+
+    assert [n["id"] for n in db.find_notes(uid, "общее")] == [mine]
+    assert db.find_notes(uid, "8880") == [], "Слова ищутся только в тексте, не в user_id"
+
+    with db._connect() as conn:
+        count = conn.execute(
+            "SELECT count(*) FROM notes_fts WHERE notes_fts MATCH ?", (f'user_id: "{uid}"',)
+        ).fetchone()[0]
+    assert count == 1, "user_id - индексируемая колонка FTS"
+
+
+def test_find_notes_like_fallback_without_fts(db_module, monkeypatch):
+    db = db_module
+    uid = 888023
+
+    note_id = db.add_note(uid, "Позвонить маме вечером")
+    monkeypatch.setitem(db._fts_state, db.DB_PATH, False)
+
+    found = db.find_notes(uid, "маме")
+
+    assert [n["id"] for n in found] == [note_id]
+    assert found[0]["snippet"] == f"Позвонить {db.SNIPPET_OPEN}маме{db.SNIPPET_CLOSE} вечером"
+
+
+def test_combined_stats_counters_follow_mutations(db_module):
+    db = db_module
+    uid = 888030
+
+    first = db.add_note(uid, "abc")
+    second = db.add_note(uid, "defgh")
+    db.update_note(uid, first, "a")
+    db.delete_note(uid, second)
+
+    stats = db.get_combined_stats(uid)
+
+    assert stats["total_notes"] == 1
+    assert stats["total_chars"] == 1
+    assert (stats["total_created"], stats["total_edited"], stats["total_deleted"]) == (2, 1, 1)
+    assert (stats["weekly_created"], stats["weekly_edited"], stats["weekly_deleted"]) == (2, 1, 1)
+
+
+def test_rebuild_user_counters_backfills_from_stats(db_module):
+    db = db_module
+    uid = 888031
+
+    note_id = db.add_note(uid, "Заметка")
+    db.update_note(uid, note_id, "Заметка 2")
+    with db._connect() as conn:
+        # старое действие (за пределами недели) и сброс счётчиков
+        conn.execute(
+            "INSERT INTO stats(user_id, action, note_id, created_at) VALUES (?, 'edit', ?, datetime('now', '-30 days'))",
+            (uid, note_id)
+        )
+        conn.execute("DELETE FROM user_counters")
+        conn.execute("DELETE FROM user_activity_daily")
+
+    assert db.get_combined_stats(uid)["total_notes"] == 0
+
+    assert db.rebuild_user_counters() == 1
+    stats = db.get_combined_stats(uid)
+
+    assert stats["total_notes"] == 1
+    assert stats["total_chars"] == len("Заметка 2")
+    assert stats["total_edited"] == 2, "Всё время - включая старую запись"
+    assert stats["weekly_edited"] == 1, "Неделя - только свежие корзины"
+
+
+def test_init_db_applies_migrations_once(db_module):
+    db = db_module
+
+    assert db.schema_version() == len(db.MIGRATIONS)
+    assert db.migrate() == 0, "Повторный запуск не должен применять миграции"
+
+
+def test_migrations_upgrade_legacy_db(tmp_path, monkeypatch):
+    import importlib
+    import sqlite3
+
+    db = importlib.import_module("db")
+    path = str(tmp_path / "legacy.db")
+    # БД в состоянии "до миграций": только исходная схема, user_version = 0
+    conn = sqlite3.connect(path)
+    conn.executescript(db.BASE_SCHEMA)
+    conn.execute("INSERT INTO notes(user_id, text) VALUES (1, 'старая заметка')")
+    conn.execute("INSERT INTO stats(user_id, action, note_id) VALUES (1, 'create', 1)")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.init_db()
+
+    assert db.schema_version() == len(db.MIGRATIONS)
+    assert db.get_combined_stats(1)["total_created"] == 1, "Счётчики должны заполниться из stats"
+    assert [n["id"] for n in db.find_notes(1, "старая")] == [1], "FTS-индекс должен заполниться"
+
+
+def test_notes_queries_use_user_index(db_module):
+    db = db_module
+
+    with db._connect() as conn:
+        plan_count = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(id) FROM notes WHERE user_id = ?", (1,)))
+        plan_list = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id, text, created_at FROM notes WHERE user_id = ? ORDER BY id DESC LIMIT 10", (1,)))
+
+    assert "COVERING INDEX ix_notes_user_id" in plan_count
+    assert "ix_notes_user_id" in plan_list and "TEMP B-TREE" not in plan_list
+
+
+def test_list_notes_page_keyset_navigation(db_module):
+    db = db_module
+    uid = 888040
+    ids = [db.add_note(uid, f"Заметка {i}") for i in range(7)]
+
+    first = db.list_notes_page(uid, limit=3)
+    assert [n["id"] for n in first["notes"]] == ids[:-4:-1]
+    assert first["has_older"] and not first["has_newer"]
+
+    second = db.list_notes_page(uid, before_id=first["notes"][-1]["id"], limit=3)
+    assert [n["id"] for n in second["notes"]] == ids[3:0:-1]
+    assert second["has_older"] and second["has_newer"]
+
+    last = db.list_notes_page(uid, before_id=second["notes"][-1]["id"], limit=3)
+    assert [n["id"] for n in last["notes"]] == [ids[0]]
+    assert not last["has_older"] and last["has_newer"]
+
+    back = db.list_notes_page(uid, after_id=last["notes"][0]["id"], limit=3)
+    assert back["notes"] == second["notes"], "Назад - та же страница, тоже от новых к старым"
+
+
+def test_list_notes_page_clamps_past_deleted_notes(db_module):
+    db = db_module
+    uid = 888045
+    ids = [db.add_note(uid, f"Заметка {i}") for i in range(5)]
+
+    # на последней странице была одна заметка ids[0], её удалили
+    db.delete_note(uid, ids[0])
+    last = db.list_notes_page(uid, before_id=ids[1], limit=2)
+    assert [n["id"] for n in last["notes"]] == [ids[2], ids[1]], "Вместо пустой - последняя непустая страница"
+    assert not last["has_older"] and last["has_newer"]
+
+    db.delete_note(uid, ids[4])
+    first = db.list_notes_page(uid, after_id=ids[3], limit=2)
+    assert [n["id"] for n in first["notes"]] == [ids[3], ids[2]]
+    assert first["has_older"] and not first["has_newer"]
+
+    for note_id in ids[1:4]:
+        db.delete_note(uid, note_id)
+    assert db.list_notes_page(uid, before_id=ids[1], limit=2) == {"notes": [], "has_older": False, "has_newer": False}
+
+
+def test_get_note_checks_owner(db_module):
+    db = db_module
+    note_id = db.add_note(888041, "Моя")
+
+    assert db.get_note(888041, note_id)["text"] == "Моя"
+    assert db.get_note(888042, note_id) is None
+
+
+def test_group_commit_keeps_limit_under_concurrency(db_module):
+    import threading
+
+    db = db_module
+    uid = 888050
+    results = []
+    lock = threading.Lock()
+
+    def worker(i):
+        note_id = db.add_note(uid, f"Заметка {i}")
+        with lock:
+            results.append(note_id)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(60)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    created = [r for r in results if r > 0]
+    assert len(created) == 50 and len(set(created)) == 50
+    assert results.count(0) == 10
+    assert db.get_combined_stats(uid)["total_notes"] == 50
+
+
+def test_group_commit_batches_and_isolates_failures(db_module, monkeypatch):
+    db = db_module
+    uid = 888051
+    writer = db.GroupCommitWriter(window_ms=100)
+
+    def failing_op(conn, user_id):
+        conn.execute("INSERT INTO notes(user_id, text) VALUES (?, 'откатится')", (user_id,))
+        raise ValueError("ошибка в заявке")
+
+    futures = [writer.submit(db._add_note_op, uid, f"Заметка {i}") for i in range(5)]
+    bad = writer.submit(failing_op, uid)
+
+    ids = [f.result(timeout=5) for f in futures]
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+
+    assert writer.batches == 1 and writer.ops == 6, "Все заявки должны уйти одной транзакцией"
+    assert sorted(n["id"] for n in db.list_all_notes(uid)) == sorted(ids)
+
+
+def test_catalog_cache_hits_and_version_invalidation(db_module, monkeypatch):
+    import sqlite3
+
+    db = db_module
+    monkeypatch.setattr(db._catalog, "check_interval", 60)
+    db._catalog.invalidate()
+
+    db.list_models()
+    before = db.catalog_cache_stats()
+    db.list_models()
+    db.get_model_by_id(1)
+    db.get_character_by_id(1)
+    after = db.catalog_cache_stats()
+    assert after["misses"] == before["misses"]
+    assert after["hits"] == before["hits"] + 3
+
+    # Другой процесс правит справочник напрямую в файле БД
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("UPDATE characters SET name = 'Переименован' WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+    assert db.get_character_by_id(1)["name"] != "Переименован", "В пределах интервала отвечает кэш"
+
+    monkeypatch.setattr(db._catalog, "check_interval", 0)
+    assert db.get_character_by_id(1)["name"] == "Переименован", "Новая версия в БД сбрасывает кэш"
+
+
+def test_set_active_model_invalidates_catalog_cache(db_module, monkeypatch):
+    db = db_module
+    monkeypatch.setattr(db._catalog, "check_interval", 60)
+
+    db.set_active_model(3)
+    assert db.get_active_model()["id"] == 3
+    assert [m["id"] for m in db.list_models() if m["active"]] == [3]
+
+
+def test_user_character_cache_write_through(db_module, monkeypatch):
+    db = db_module
+    cache = db.UserCharacterCache(capacity=10)
+    monkeypatch.setattr(db, "_user_characters", cache)
+    uid = 777010
+
+    default = db.get_user_character(uid)
+    db.get_user_character(uid)
+    assert (cache.misses, cache.hits) == (1, 1)
+
+    other = next(c for c in db.list_characters() if c["id"] != default["id"])
+    db.set_user_character(uid, other["id"])
+
+    assert db.get_user_character(uid)["id"] == other["id"]
+    assert cache.misses == 1, "После set_user_character чтение идёт из кэша"
+
+
+def test_user_character_cache_evicts_lru(db_module):
+    db = db_module
+    cache = db.UserCharacterCache(capacity=2)
+
+    cache.put(1, 10)
+    cache.put(2, 20)
+    cache.get(1)
+    cache.put(3, 30)
+
+    assert cache.get(2) == (False, None), "Вытесняется давно не использованный"
+    assert cache.get(1) == (True, 10)
+    assert cache.get(3) == (True, 30)
+
+
+def test_user_character_cache_expires_changes_from_other_process(db_module, monkeypatch):
+    import sqlite3
+
+    db = db_module
+    cache = db.UserCharacterCache(capacity=10, ttl=60)
+    monkeypatch.setattr(db, "_user_characters", cache)
+    uid = 777020
+    default = db.get_user_character(uid)
+    other = next(c for c in db.list_characters() if c["id"] != default["id"])
+
+    # Другой процесс меняет выбор напрямую в файле БД
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("INSERT INTO user_character(telegram_user_id, character_id) VALUES (?, ?)", (uid, other["id"]))
+    conn.commit()
+    conn.close()
+
+    assert db.get_user_character(uid)["id"] == default["id"], "В пределах TTL отвечает кэш"
+
+    cache.ttl = 0
+    cache.put(uid, default["id"])
+    assert db.get_user_character(uid)["id"] == other["id"], "Просроченная запись перечитывается из БД"
+
+
+def test_model_calls_window_and_stats(db_module, monkeypatch):
+    db = db_module
+    monkeypatch.setattr(db, "MODEL_STATS_WINDOW", 10)
+    for ms in range(100, 1300, 100):  # 12 вызовов, в окне остаются последние 10
+        db.record_model_call("m", ms, True, tokens=ms // 10)
+    db.record_model_call("m", 50, False)
+    db.record_model_call("other", 500, True)
+
+    with db._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM model_calls WHERE model = 'm'").fetchone()[0] == 10
+
+    stats = db.model_stats()
+    m = stats["m"]
+    assert (m["calls"], m["errors"]) == (10, 1)
+    assert m["error_rate"] == pytest.approx(0.1)
+    assert (m["p50"], m["p90"], m["p99"]) == (800, 1200, 1200)
+    assert m["tokens_per_s"] == pytest.approx(100)
+    assert stats["other"]["tokens_per_s"] is None
+
+
+def test_auto_model_flag(db_module):
+    db = db_module
+    assert db.is_auto_model() is False
+
+    db.set_auto_model(True)
+    assert db.is_auto_model() is True
+
+    db.set_active_model(db.list_models()[1]["id"])
+    assert db.is_auto_model() is False, "Явный выбор модели выключает auto"
@@ -0,0 +1,330 @@
+import importlib
+import threading
+import time
+
+import pytest
+
+MSGS = [{"role": "system", "content": "Ты - Йода."}, {"role": "user", "content": "Что такое API?"}]
+
+
+@pytest.fixture()
+def llm_module(db_module, monkeypatch):
+    llm = importlib.import_module("llm")
+    monkeypatch.setattr(llm, "cache", llm.ResponseCache())
+    monkeypatch.setattr(llm, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "singleflight", llm.SingleFlight())
+    return llm
+
+
+def test_request_key_is_canonical(llm_module):
+    llm = llm_module
+    reordered = [{"content": m["content"], "role": m["role"]} for m in MSGS]
+
+    assert llm.request_key("m", MSGS, 0.2, 400) == llm.request_key("m", reordered, 0.20000001, 400)
+    assert llm.request_key("m", MSGS, 0.2, 400) != llm.request_key("m", MSGS, 0.2, 401)
+    assert llm.request_key("m", MSGS, 0.2, 400) != llm.request_key("other", MSGS, 0.2, 400)
+
+
+def test_ask_caches_answers(llm_module, mocker):
+    llm = llm_module
+    chat = mocker.patch.object(llm, "chat_once", return_value=("Ответ", 120))
+
+    first = llm.ask(MSGS, model="m")
+    second = llm.ask(MSGS, model="m")
+
+    assert chat.call_count == 1
+    assert (first.text, first.cached) == ("Ответ", False)
+    assert (second.text, second.cached) == ("Ответ", True)
+    assert llm.cache.stats()["memory_hits"] == 1
+
+
+def test_cache_survives_process_memory_via_sqlite(llm_module, mocker):
+    llm = llm_module
+    mocker.patch.object(llm, "chat_once", return_value=("Ответ", 120))
+    llm.ask(MSGS, model="m")
+
+    # "новый процесс": пустой LRU, та же БД
+    llm.cache = llm.ResponseCache()
+    chat = mocker.patch.object(llm, "chat_once")
+
+    assert llm.ask(MSGS, model="m").cached
+    assert chat.call_count == 0
+    assert llm.cache.stats()["db_hits"] == 1
+
+
+def test_cache_ttl_and_size_eviction(llm_module, db_module, monkeypatch):
+    llm = llm_module
+    db = db_module
+
+    cache = llm.ResponseCache(ttl_s=60)
+    cache.put("k1", "m", "один")
+    with monkeypatch.context() as m:
+        m.setattr(time, "time", lambda real=time.time: real() + 120)
+        assert cache.get("k1") is None, "Просроченный ответ не отдаётся ни из памяти, ни из БД"
+
+    for i in range(5):
+        db.llm_cache_put(f"key{i}", "m", f"ответ {i}", 3600 + i)
+    assert db.llm_cache_evict(max_rows=2) == 4, "Просроченный k1 и три самых старых"
+    assert [db.llm_cache_get(f"key{i}") for i in range(5)] == [None, None, None, "ответ 3", "ответ 4"]
+
+
+@pytest.fixture()
+def fallback_llm(llm_module, mocker):
+    from openrouter import CircuitBreaker
+
+    llm = llm_module
+    breakers = {key: CircuitBreaker(min_calls=1, failure_rate=1) for key in ("a", "b", "c")}
+    mocker.patch.object(llm, "get_breaker", side_effect=breakers.__getitem__)
+    mocker.patch.object(llm.db, "list_models", return_value=[{"key": "c"}, {"key": "a"}, {"key": "b"}])
+    return llm, breakers
+
+
+def test_fallback_skips_open_breaker_and_failed_models(fallback_llm, mocker):
+    llm, breakers = fallback_llm
+    breakers["a"].record(False, 10)
+
+    def chat(messages, *, model, **kwargs):
+        if model == "c":
+            raise llm.OpenRouterError(503, "down")
+        return f"от {model}", 50
+
+    chat_once = mocker.patch.object(llm, "chat_once", side_effect=chat)
+
+    answer = llm.ask(MSGS, model="a", fallback=True)
+
+    assert [c.kwargs["model"] for c in chat_once.call_args_list] == ["c", "b"], "a пропущена, c упала"
+    assert (answer.text, answer.model) == ("от b", "b")
+    assert llm.ask(MSGS, model="a").model == "a", "Без fallback модель не подменяется"
+
+
+def test_fallback_does_not_hide_request_errors_or_partial_streams(fallback_llm, mocker):
+    llm, breakers = fallback_llm
+    mocker.patch.object(llm, "chat_once", side_effect=llm.OpenRouterError(401, "bad key"))
+    with pytest.raises(llm.OpenRouterError) as excinfo:
+        llm.ask(MSGS, model="a", fallback=True)
+    assert excinfo.value.status == 401
+
+    def broken_stream(messages, **kwargs):
+        yield "нач"
+        raise llm.OpenRouterError(502, "cut")
+
+    stream = mocker.patch.object(llm, "chat_stream", side_effect=broken_stream)
+    with pytest.raises(llm.OpenRouterError):
+        llm.ask(MSGS, model="a", on_delta=lambda d: None, fallback=True)
+    assert stream.call_count == 1, "После первых токенов на другую модель не переключаемся"
+
+
+def test_fallback_on_model_rate_limit(fallback_llm, mocker):
+    llm, _ = fallback_llm
+
+    def chat(messages, *, model, **kwargs):
+        if model == "a":
+            raise llm.RateLimitExceeded(429, "limit", "model")
+        return "ok", 1
+
+    mocker.patch.object(llm, "chat_once", side_effect=chat)
+    assert llm.ask(MSGS, model="a", fallback=True).model == "c"
+
+    mocker.patch.object(llm, "chat_once", side_effect=llm.RateLimitExceeded(429, "limit", "global"))
+    with pytest.raises(llm.RateLimitExceeded):
+        llm.ask(MSGS, model="b", fallback=True)
+
+
+def test_fallback_all_models_open(fallback_llm):
+    llm, breakers = fallback_llm
+    for breaker in breakers.values():
+        breaker.record(False, 10)
+
+    with pytest.raises(llm.OpenRouterError) as excinfo:
+        llm.ask(MSGS, model="a", fallback=True)
+    assert excinfo.value.status == 503
+
+
+@pytest.fixture()
+def hedging_llm(llm_module, monkeypatch):
+    llm = llm_module
+    monkeypatch.setattr(llm, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm, "LLM_HEDGE_MODEL", "fast")
+    monkeypatch.setattr(llm, "LLM_HEDGE_DEFAULT_MS", 50)
+    monkeypatch.setattr(llm, "latency", llm.LatencyTracker())
+    monkeypatch.setattr(llm, "hedge_metrics", llm.Counter())
+    return llm
+
+
+def test_hedge_threshold_follows_observed_p90(hedging_llm, monkeypatch):
+    llm = hedging_llm
+    monkeypatch.setattr(llm, "LLM_HEDGE_MIN_SAMPLES", 10)
+    monkeypatch.setattr(llm, "LLM_HEDGE_MIN_MS", 100)
+
+    assert llm.hedge_threshold_ms("m") == 50, "Мало замеров - порог по умолчанию"
+    for ms in range(100, 1100, 100):
+        llm.latency.record("m", ms)
+    assert llm.hedge_threshold_ms("m") == 1000
+    for _ in range(10):
+        llm.latency.record("quick", 5)
+    assert llm.hedge_threshold_ms("quick") == 100, "Не ниже LLM_HEDGE_MIN_MS"
+
+
+def test_hedged_stream_second_model_wins(hedging_llm, mocker):
+    llm = hedging_llm
+    closed = threading.Event()
+    record = mocker.spy(llm, "record_call")
+
+    def stream(messages, *, model, handle, **kwargs):
+        if model == "slow":
+            # первый токен не приходит: поток проигравшего закрывает только handle.close()
+            deadline = time.monotonic() + 5
+            while not handle.closed and time.monotonic() < deadline:
+                time.sleep(0.01)
+            if handle.closed:
+                closed.set()
+            return
+        yield f"{model}-1"
+        yield f"{model}-2"
+
+    mocker.patch.object(llm, "chat_stream", side_effect=stream)
+    deltas = []
+
+    answer = llm.ask(MSGS, model="slow", on_delta=deltas.append, hedge=True)
+
+    assert (answer.text, answer.model, answer.hedged) == ("fast-1fast-2", "fast", True)
+    assert deltas == ["fast-1", "fast-2"], "В ответ идут куски только победителя"
+    assert closed.wait(5), "Соединение проигравшего закрыто до его первого токена"
+    time.sleep(0.05)
+    assert [c.args[0] for c in record.call_args_list] == ["fast"], "Отменённый запрос не пишется в телеметрию"
+    assert llm.hedge_stats() == {"requests": 1, "hedged": 1, "hedge_wins": 1, "primary_wins": 0, "hedge_rate": 1.0}
+    assert llm.cache.get(llm.request_key("fast", MSGS, 0.2, 400)) == "fast-1fast-2"
+
+
+def test_hedge_not_started_for_fast_primary_and_errors_surface(hedging_llm, mocker):
+    llm = hedging_llm
+    llm.LLM_HEDGE_DEFAULT_MS = 5000
+    chat = mocker.patch.object(llm, "chat_once", return_value=("быстро", 10))
+
+    assert llm.ask(MSGS, model="m", hedge=True).model == "m"
+    assert [c.kwargs["model"] for c in chat.call_args_list] == ["m"]
+    assert llm.hedge_stats()["hedged"] == 0
+
+    chat.side_effect = llm.OpenRouterError(503, "down")
+    with pytest.raises(llm.OpenRouterError):
+        llm.ask(MSGS, model="other", hedge=True)
+
+
+def _ask_concurrently(llm, n, options):
+    results = [None] * n
+
+    def run(i):
+        try:
+            results[i] = llm.ask(MSGS, model="m", **options(i))
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def _wait_followers(llm, n):
+    deadline = time.time() + 5
+    while llm.singleflight.stats()["saved_calls"] < n and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_singleflight_coalesces_identical_streams(llm_module, mocker):
+    llm = llm_module
+    release = threading.Event()
+
+    def stream(messages, **kwargs):
+        yield "Один "
+        release.wait(5)
+        yield "ответ"
+
+    chat_stream = mocker.patch.object(llm, "chat_stream", side_effect=stream)
+    deltas = [[] for _ in range(4)]
+    threads, results = _ask_concurrently(llm, 4, lambda i: {"on_delta": deltas[i].append})
+    _wait_followers(llm, 3)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert chat_stream.call_count == 1
+    assert [r.text for r in results] == ["Один ответ"] * 4
+    assert deltas == [["Один ", "ответ"]] * 4, "Ожидающие тоже получают куски потока"
+    assert llm.singleflight.stats() == {"upstream_calls": 1, "saved_calls": 3, "in_flight": 0}
+
+
+def test_singleflight_fans_out_errors(llm_module, mocker):
+    llm = llm_module
+    release = threading.Event()
+
+    def failing(messages, **kwargs):
+        release.wait(5)
+        raise llm.OpenRouterError(502, "down")
+
+    chat_once = mocker.patch.object(llm, "chat_once", side_effect=failing)
+    threads, results = _ask_concurrently(llm, 3, lambda i: {})
+    _wait_followers(llm, 2)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert chat_once.call_count == 1
+    assert all(isinstance(r, llm.OpenRouterError) and r.status == 502 for r in results)
+
+    chat_once.side_effect = None
+    chat_once.return_value = ("Теперь ок", 5)
+    assert llm.ask(MSGS, model="m").text == "Теперь ок", "Ошибка не залипает за ключом"
+
+
+def test_singleflight_does_not_mix_call_options(llm_module, mocker):
+    llm = llm_module
+    release = threading.Event()
+
+    def slow(messages, *, model, **kwargs):
+        release.wait(5)
+        return f"Ответ {model}", 5
+
+    chat_once = mocker.patch.object(llm, "chat_once", side_effect=slow)
+    threads, results = _ask_concurrently(llm, 2, lambda i: {"fallback": i == 0})
+    deadline = time.time() + 5
+    while llm.singleflight.stats()["upstream_calls"] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert chat_once.call_count == 2, "/ask с fallback и /ask_model без него - разные полёты"
+    assert llm.singleflight.stats()["saved_calls"] == 0
+    assert all(r.text == "Ответ m" for r in results)
+
+
+def test_calls_feed_telemetry_and_auto_routing(llm_module, mocker, monkeypatch):
+    llm = llm_module
+    monkeypatch.setattr(llm, "_stats_cache", None)
+    monkeypatch.setattr(llm, "AUTO_MIN_CALLS", 2)
+    keys = [m["key"] for m in llm.db.list_models()]
+    slow, fast, flaky = keys[:3]
+
+    mocker.patch.object(llm, "chat_once", side_effect=lambda msgs, *, model, **kw: ("x" * 40, 0))
+    for i in range(2):
+        llm.ask([{"role": "user", "content": f"q{i}"}], model=slow)
+    mocker.patch.object(llm, "chat_once", side_effect=llm.OpenRouterError(503, "down"))
+    for i in range(2):
+        with pytest.raises(llm.OpenRouterError):
+            llm.ask([{"role": "user", "content": f"q{i}"}], model=flaky)
+
+    stats = llm.db.model_stats()
+    assert stats[slow]["calls"] == 2 and stats[slow]["errors"] == 0
+    assert stats[flaky]["error_rate"] == 1
+    with llm.db._connect() as conn:
+        assert conn.execute("SELECT tokens FROM model_calls WHERE model = ?", (slow,)).fetchone()[0] == 10
+
+    assert llm.fastest_model("default") == slow, "Модели без замеров и с ошибками не выбираются"
+
+    for _ in range(3):
+        llm.db.record_model_call(fast, 1, True, 5)
+        llm.db.record_model_call(slow, 10_000, True, 5)
+    assert llm.fastest_model("default") == slow, "Статистика кэшируется на AUTO_STATS_TTL_S"
+    monkeypatch.setattr(llm, "_stats_cache", None)
+    assert llm.fastest_model("default") == fast
@@ -0,0 +1,111 @@
+import asyncio
+import importlib
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from telebot import types
+
+
+@pytest.fixture()
+def async_main(db_module, mocker):
+    """main_async с подменёнными методами Bot API: ответы складываются в список."""
+    bot_main = importlib.import_module("main_async")
+    bot_main._next_steps.clear()
+    sent = []
+
+    async def reply_to(message, text, **kwargs):
+        sent.append(text)
+        return mocker.Mock(chat=mocker.Mock(id=message.chat.id), message_id=len(sent))
+
+    mocker.patch.object(bot_main.bot, "reply_to", side_effect=reply_to)
+    mocker.patch.object(bot_main.bot, "edit_message_text", new=mocker.AsyncMock())
+    bot_main.sent = sent
+    return bot_main
+
+
+def update(update_id: int, text: str, user_id: int = 42) -> types.Update:
+    return types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            if text.startswith("/") else [],
+        },
+    })
+
+
+def test_next_step_adds_note_and_lists_it(async_main, db_module):
+    async def scenario():
+        await async_main.bot.process_new_updates([update(1, "/note_add")])
+        await async_main.bot.process_new_updates([update(2, "купить молоко")])
+        await async_main.bot.process_new_updates([update(3, "/note_list")])
+
+    asyncio.run(scenario())
+
+    assert async_main.sent[0] == "Введите текст для новой заметки:"
+    assert async_main.sent[1].startswith("✅ Заметка #")
+    assert "купить молоко" in async_main.sent[2]
+    assert not async_main._next_steps, "Шаг снимается после ответа"
+    assert db_module.list_notes(42)[0]["text"] == "купить молоко"
+
+
+def test_reply_streaming_edits_placeholder(async_main, mocker):
+    mocker.patch.object(async_main, "STREAM_EDIT_INTERVAL_S", 0)
+    mocker.patch.object(async_main.llm, "LLM_CACHE_ENABLED", False)
+
+    async def achat_stream(messages, **kwargs):
+        for delta in ("Hello", ", ", "world"):
+            yield delta
+
+    mocker.patch.object(async_main.llm, "achat_stream", side_effect=achat_stream)
+
+    asyncio.run(async_main._reply_streaming(mocker.Mock(chat=mocker.Mock(id=1)), [{"role": "user", "content": "hi"}],
+                                            "m", async_main._model_footer("m")))
+
+    texts = [c.args[0] for c in async_main.bot.edit_message_text.call_args_list]
+    assert texts[0] == "Hello ▌"
+    assert texts[-1].startswith("Hello, world\n\n(") and texts[-1].endswith("модель: m)")
+
+
+def test_fan_out_cancels_requests_after_deadline(async_main, mocker):
+    mocker.patch.object(async_main, "STREAM_EDIT_INTERVAL_S", 0)
+    record = mocker.patch.object(async_main.llm, "record_call")
+    cancelled = []
+    models = [{"id": i, "key": f"fan-{k}", "label": k.upper()} for i, k in enumerate("ab", 1)]
+
+    async def achat_once(messages, *, model, **kwargs):
+        if model == "fan-a":
+            return "Ответ A", 120
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    mocker.patch.object(async_main.openrouter_async, "achat_once", side_effect=achat_once)
+
+    asyncio.run(async_main._fan_out(mocker.Mock(chat=mocker.Mock(id=1)), [{"role": "user", "content": "hi"}],
+                                    models, deadline_s=0.2))
+
+    final = async_main.bot.edit_message_text.call_args.args[0]
+    assert "• A: ✅ 120 мс\nОтвет A" in final
+    assert "• B: ⏱ не уложилась в 0.2 с" in final
+    assert cancelled == ["fan-b"], "Запрос после дедлайна отменён"
+    assert [c.args[0] for c in record.call_args_list] == ["fan-a"]
+
+
+
+def test_import_has_no_sync_bot_side_effects():
+    code = (
+        "import sys, threading, main_async\n"
+        "assert 'main_db' not in sys.modules, 'sync-бот не импортируется'\n"
+        "assert not [t for t in threading.enumerate() if t.name.startswith('llm-')], 'потоки Lane не запущены'\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parent.parent,
+                            env={**os.environ, "TOKEN": "123:abc"}, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
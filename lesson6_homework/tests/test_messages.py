@@ -1,3 +1,11 @@
+import importlib
+import queue
+import threading
+import time
+
+import pytest
+
+
 def test_build_messages_includes_character_and_rules(db_module, main_module, monkeypatch):
     db = db_module
     main = main_module
@@ -65,3 +73,178 @@ def test_build_messages_for_character_pure_function(main_module):
     assert question in msgs[1]["content"]
 
 
+
+
+def test_render_notes_page_buttons(main_module):
+    main = main_module
+    page = {
+        "notes": [{"id": 5, "text": "пять"}, {"id": 4, "text": "четыре"}],
+        "has_older": True,
+        "has_newer": False,
+    }
+
+    text, kb = main._render_notes_page(page)
+
+    assert "5: пять" in text and "4: четыре" in text
+    buttons = kb.keyboard[0]
+    assert [b.callback_data for b in buttons] == ["notes:older:4"]
+
+    empty_text, empty_kb = main._render_notes_page({"notes": [], "has_older": False, "has_newer": False})
+    assert empty_text == "Заметок пока нет." and empty_kb is None
+
+
+def test_reply_streaming_edits_placeholder(main_module, mocker):
+    main = main_module
+    placeholder = mocker.Mock(chat=mocker.Mock(id=1), message_id=10)
+    mocker.patch.object(main.bot, "reply_to", return_value=placeholder)
+    edit = mocker.patch.object(main.bot, "edit_message_text")
+    mocker.patch.object(main, "STREAM_EDIT_INTERVAL_S", 0)
+    mocker.patch.object(main.llm, "LLM_CACHE_ENABLED", False)
+    mocker.patch.object(main.llm, "chat_stream", return_value=iter(["Hello", ", ", "world"]))
+
+    main._reply_streaming(mocker.Mock(), [{"role": "user", "content": "hi"}], "m", main._model_footer("m"))
+
+    texts = [c.args[0] for c in edit.call_args_list]
+    assert texts[0] == "Hello ▌", "Промежуточные правки с курсором"
+    assert texts[-1].startswith("Hello, world\n\n(")
+    assert "первый токен:" in texts[-1] and texts[-1].endswith("модель: m)")
+
+
+def test_reply_streaming_marks_cache_hit(main_module, mocker):
+    main = main_module
+    placeholder = mocker.Mock(chat=mocker.Mock(id=1), message_id=10)
+    mocker.patch.object(main.bot, "reply_to", return_value=placeholder)
+    edit = mocker.patch.object(main.bot, "edit_message_text")
+    mocker.patch.object(main.llm, "ask", return_value=main.llm.Answer(text="Из памяти", ms=0, model="m", cached=True))
+
+    main._reply_streaming(mocker.Mock(), [{"role": "user", "content": "hi"}], "m", main._model_footer("m"))
+
+    assert edit.call_args.args[0] == "Из памяти\n\n(из кэша; модель: m)"
+
+
+def test_model_footer_and_breaker_badge(main_module, mocker):
+    main = main_module
+    footer = main._model_footer("a", "; как: Йода")
+
+    assert footer(main.llm.Answer(text="", ms=1, model="a")) == "модель: a; как: Йода"
+    assert footer(main.llm.Answer(text="", ms=1, model="b")) == "модель: b вместо недоступной a; как: Йода"
+    assert footer(main.llm.Answer(text="", ms=1, model="b", hedged=True)) == "модель: b, ответила быстрее a; как: Йода"
+
+    breaker = mocker.Mock()
+    breaker.snapshot.return_value = {"state": "open", "calls": 0, "failures": 0, "retry_in_s": 42}
+    bot_common = importlib.import_module("bot_common")
+    mocker.patch.object(bot_common, "get_breaker", return_value=breaker)
+    assert "недоступна" in bot_common._breaker_badge("a") and "42" in bot_common._breaker_badge("a")
+
+
+def test_render_limits(main_module):
+    text = main_module._render_limits({
+        "buckets": [{"scope": "model", "name": "m", "tokens": 2.5, "capacity": 5, "rpm": 20.0}],
+        "waiters": 1, "max_waiters": 32,
+        "stats": {"granted": 7, "waited": 2, "rejected": 1},
+    })
+    assert "ждут сейчас: 1 из 32" in text
+    assert "отказано: 1, очередь полна: 0" in text
+    assert "• model m: 2.5/5 (20.0/мин)" in text
+
+
+def test_render_import_report_with_error(main_module):
+    notes_io = importlib.import_module("notes_io")
+    reports = [{"batch": 1, "imported": 2, "skipped_limit": 0, "skipped_empty": 0, "skipped_long": 1}]
+
+    text = main_module._render_import_report(reports, notes_io.ImportFileError("строка не в формате JSON", 4))
+    assert text.startswith("📥 Импортировано заметок: 2\n✂️ Пропущено длиннее 4096 символов: 1")
+    assert "⛔ Импорт остановлен на строке 4: строка не в формате JSON." in text
+
+    text = main_module._render_import_report([], UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte"))
+    assert "⛔ Импорт остановлен: файл повреждён или не в UTF-8." in text
+
+
+def test_render_model_stats(main_module):
+    models = [{"id": 1, "key": "a", "label": "A"}, {"id": 2, "key": "b", "label": "B"}]
+    text = main_module._render_model_stats(models, {
+        "a": {"calls": 10, "errors": 1, "error_rate": 0.1, "p50": 800, "p90": 1200, "p99": 1300, "tokens_per_s": 42.4},
+    })
+    assert "• 1. A: p50 800 / p90 1200 / p99 1300 мс; ошибки 10% из 10; ≈42 ток/с" in text
+    assert "B" not in text
+
+    assert "Вызовов ещё не было." in main_module._render_model_stats(models, {})
+
+
+def test_fan_out_edits_as_answers_arrive_and_cuts_off_at_deadline(main_module, mocker):
+    main = main_module
+    placeholder = mocker.Mock(chat=mocker.Mock(id=1), message_id=10)
+    mocker.patch.object(main.bot, "reply_to", return_value=placeholder)
+    edit = mocker.patch.object(main.bot, "edit_message_text")
+    mocker.patch.object(main, "STREAM_EDIT_INTERVAL_S", 0)
+    record = mocker.patch.object(main.llm, "record_call")
+    models = [{"id": i, "key": f"fan-{k}", "label": k.upper()} for i, k in enumerate("abc", 1)]
+
+    closed = []
+
+    def chat_many(requests, max_concurrency, deadline):
+        batch = list(requests)
+        assert max_concurrency == 2, "Не больше ASK_ALL_MAX_CONCURRENCY одновременно"
+        assert {r["model"] for r in batch} == {"fan-a", "fan-b", "fan-c"}
+        assert 0 < deadline - time.monotonic() <= 0.3, "Запросы укладываются в общий дедлайн"
+        try:
+            yield 1, ("Ответ B", 120)
+            yield 0, main.OpenRouterError(503, "down")
+            # дальше дедлайн: настоящий chat_many заканчивается, C не дождались
+        finally:
+            closed.append(True)
+
+    mocker.patch.object(main, "ASK_ALL_MAX_CONCURRENCY", 2)
+    mocker.patch.object(main.openrouter, "chat_many", side_effect=chat_many)
+
+    main._fan_out(mocker.Mock(), [{"role": "user", "content": "hi"}], models, deadline_s=0.3)
+
+    texts = [c.args[0] for c in edit.call_args_list]
+    assert "• B: ✅ 120 мс\nОтвет B" in texts[0] and "• C: ⏳ ждём…" in texts[0]
+    final = texts[-1]
+    assert final.startswith("Ответы моделей (3/3, дедлайн 0.3 с):")
+    assert "• A: ❌ [503] down" in final
+    assert "• C: ⏱ не уложилась в 0.3 с" in final and "поздно" not in final
+    assert [c.args[0] for c in record.call_args_list] == ["fan-b", "fan-a"]
+    assert closed == [True], "Генератор chat_many закрыт"
+
+
+def test_lane_reports_queue_position_and_rejects_when_full(main_module):
+    main = main_module
+    lane = main.Lane("test", workers=1, max_queue=1)
+    release = threading.Event()
+    done = []
+
+    assert lane.submit(release.wait) == 0, "Свободный поток - без очереди"
+    assert lane.submit(done.append, "второй") == 1
+    with pytest.raises(queue.Full):
+        lane.submit(done.append, "лишний")
+    assert lane.snapshot()["stats"] == {"accepted": 2, "queued": 1, "rejected": 1}
+
+    release.set()
+    for _ in range(100):
+        if lane.snapshot()["running"] == 0:
+            break
+        time.sleep(0.01)
+    assert done == ["второй"]
+    assert lane.submit(done.append, "снова") == 0
+
+
+def test_llm_handlers_run_in_lane_and_reply_when_busy(main_module, mocker):
+    main = main_module
+    reply = mocker.patch.object(main.bot, "reply_to")
+    lane = mocker.patch.object(main, "llm_lane")
+    message = mocker.Mock(text="/ask привет")
+
+    lane.submit.return_value = 0
+    main.cmd_ask(message)
+    lane.submit.assert_called_once_with(main.cmd_ask.__wrapped__, message)
+    reply.assert_not_called()
+
+    lane.submit.return_value = 3
+    main.cmd_ask_model(message)
+    assert reply.call_args.kwargs["text"].startswith("Модели заняты, вы №3 в очереди")
+
+    lane.submit.side_effect = queue.Full
+    main.cmd_ask_random(message)
+    assert reply.call_args.kwargs["text"].startswith("Сейчас слишком много вопросов")
@@ -0,0 +1,150 @@
+import csv
+import gzip
+import io
+import json
+import zipfile
+from datetime import datetime
+
+import pytest
+
+NOTES = [
+    {"id": 1, "text": "Первая", "created_at": "2025-01-01 10:00:00"},
+    {"id": 2, "text": "Вторая\nв две строки, с \"кавычками\"", "created_at": "2025-01-02 11:00:00"},
+]
+
+STATS = {
+    "total_notes": 2, "total_chars": 40,
+    "total_created": 3, "total_edited": 1, "total_deleted": 1,
+    "weekly_created": 2, "weekly_edited": 0, "weekly_deleted": 1,
+}
+
+
+@pytest.fixture()
+def notes_io(db_module):
+    import importlib
+    return importlib.import_module("notes_io")
+
+
+def _read_all(buf) -> bytes:
+    with buf:
+        return buf.read()
+
+
+def test_markdown_export_layout(notes_io):
+    text = "".join(notes_io.iter_markdown("tester", STATS, NOTES, datetime(2025, 1, 3, 12, 30)))
+
+    assert text.startswith("# Экспорт заметок для пользователя @tester\nДата экспорта: 2025-01-03 12:30\n")
+    assert "* **Занято слотов:** 2 / 50" in text
+    assert "### Заметка #2\n* **Дата создания:** 2025-01-02 11:00:00\n\n> Вторая\n> в две строки" in text
+
+
+def test_jsonl_and_csv_exports_round_trip(notes_io):
+    buf, name = notes_io.build_export(notes_io.iter_jsonl(NOTES), "export.jsonl")
+    lines = _read_all(buf).decode("utf-8").splitlines()
+    assert name == "export.jsonl"
+    assert [json.loads(line) for line in lines] == NOTES
+
+    buf, _ = notes_io.build_export(notes_io.iter_csv(NOTES), "export.csv")
+    rows = list(csv.DictReader(io.StringIO(_read_all(buf).decode("utf-8"))))
+    assert [(int(r["id"]), r["text"]) for r in rows] == [(n["id"], n["text"]) for n in NOTES]
+
+
+def test_compressed_exports(notes_io):
+    buf, name = notes_io.build_export(notes_io.iter_jsonl(NOTES), "export.jsonl", "gz")
+    assert name == "export.jsonl.gz"
+    assert gzip.decompress(_read_all(buf)).decode("utf-8").count("\n") == 2
+
+    buf, name = notes_io.build_export(notes_io.iter_jsonl(NOTES), "export.jsonl", "zip")
+    assert name == "export.jsonl.zip"
+    with zipfile.ZipFile(io.BytesIO(_read_all(buf))) as zf:
+        assert zf.namelist() == ["export.jsonl"]
+        assert zf.read("export.jsonl").decode("utf-8").count("\n") == 2
+
+
+def test_iter_notes_streams_in_chunks(db_module):
+    db = db_module
+    uid = 888060
+    ids = [db.add_note(uid, f"Заметка {i}") for i in range(7)]
+
+    assert [n["id"] for n in db.iter_notes(uid, chunk_size=3)] == ids
+
+
+@pytest.mark.parametrize("fmt", ["md", "jsonl", "csv"])
+@pytest.mark.parametrize("compression", [None, "gz", "zip"])
+def test_export_parses_back(notes_io, fmt, compression):
+    chunks = notes_io.iter_export(fmt, "tester", STATS, NOTES, datetime(2025, 1, 3))
+    buf, name = notes_io.build_export(chunks, f"export.{fmt}", compression)
+
+    assert notes_io.detect_format(name) == (fmt, compression)
+    with buf, notes_io.open_text(buf, compression) as lines:
+        parsed = list(notes_io.iter_import(fmt, lines))
+
+    assert parsed == [{"text": n["text"], "created_at": n["created_at"]} for n in NOTES]
+
+
+def test_import_notes_batches_quota_and_stats(db_module):
+    db = db_module
+    uid = 888070
+    for i in range(45):
+        db.add_note(uid, f"Старая {i}")
+
+    notes = [{"text": f"Новая {i}", "created_at": "2024-05-01 00:00:00"} for i in range(4)]
+    notes += ["   ", "Новая 4", "Новая 5", "Новая 6"]
+    reports = db.import_notes(uid, notes, batch_size=4)
+
+    assert reports == [
+        {"batch": 1, "imported": 4, "skipped_limit": 0, "skipped_empty": 0, "skipped_long": 0},
+        {"batch": 2, "imported": 1, "skipped_limit": 2, "skipped_empty": 1, "skipped_long": 0},
+    ]
+    stats = db.get_combined_stats(uid)
+    assert stats["total_notes"] == 50
+    assert stats["total_created"] == 50, "На каждую импортированную заметку - запись create в stats"
+
+    imported = [n for n in db.list_all_notes(uid) if n["text"].startswith("Новая")]
+    assert [n["text"] for n in imported] == ["Новая 0", "Новая 1", "Новая 2", "Новая 3", "Новая 4"]
+    assert imported[0]["created_at"] == "2024-05-01 00:00:00"
+
+
+def test_import_skips_notes_over_max_length(db_module):
+    db = db_module
+    uid = 888080
+
+    reports = db.import_notes(uid, ["x" * db.NOTE_MAX_LENGTH, "y" * (db.NOTE_MAX_LENGTH + 1), "z"])
+
+    assert reports == [{"batch": 1, "imported": 2, "skipped_limit": 0, "skipped_empty": 0, "skipped_long": 1}]
+    assert sorted(len(n["text"]) for n in db.list_all_notes(uid)) == [1, db.NOTE_MAX_LENGTH]
+
+
+@pytest.mark.parametrize("compression", ["gz", "zip"])
+def test_open_text_stops_decompression_bomb(notes_io, compression):
+    # 11 МБ нулей сжимаются в килобайты, но распаковываются только до лимита
+    chunks = iter(["\n" * (notes_io.IMPORT_MAX_TEXT_SIZE + 1024 * 1024)])
+    buf, _ = notes_io.build_export(chunks, "export.jsonl", compression)
+
+    with buf, notes_io.open_text(buf, compression) as lines:
+        with pytest.raises(notes_io.ImportFileError, match="больше 10 МБ"):
+            list(notes_io.iter_import("jsonl", lines))
+
+
+@pytest.mark.parametrize("bad_line", ['{"text": 5}', "[1, 2]", "{not json"])
+def test_invalid_jsonl_line_keeps_committed_batches(db_module, notes_io, bad_line):
+    db = db_module
+    uid = 888090
+    raw = "".join(json.dumps({"text": f"Заметка {i}"}) + "\n" for i in range(3)) + bad_line + "\n"
+
+    with notes_io.open_text(io.BytesIO(raw.encode())) as lines:
+        with pytest.raises(db.ImportInterrupted) as exc_info:
+            db.import_notes(uid, notes_io.iter_import("jsonl", lines), batch_size=2)
+
+    error = exc_info.value
+    assert isinstance(error.error, notes_io.ImportFileError) and error.error.line == 4
+    assert [r["imported"] for r in error.reports] == [2, 1], "Прочитанное до ошибки записано"
+    assert len(db.list_all_notes(uid)) == 3
+
+
+def test_csv_error_reports_line(notes_io):
+    lines = io.StringIO('text,created_at\n"ok",\n"' + "x" * 200_000 + '",\n')
+
+    with pytest.raises(notes_io.ImportFileError) as exc_info:
+        list(notes_io.iter_import("csv", lines))
+    assert exc_info.value.line == 3
@@ -0,0 +1,157 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+
+OK_BODY = {"choices": [{"message": {"content": "OK"}}]}
+MSGS = [{"role": "user", "content": "x"}]
+
+
+@pytest.fixture()
+def aio(openrouter_module, monkeypatch):
+    """Асинхронный клиент с ключом и быстрыми повторами; URL подставляет mock_server."""
+    import openrouter_async
+
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(openrouter_module, "retry_policy", openrouter_module.RetryPolicy(
+        max_attempts=3, base_delay_s=0.01, max_delay_s=0.02, deadline_s=5
+    ))
+    monkeypatch.setattr(openrouter_module, "breakers", {})
+    return openrouter_async
+
+
+@asynccontextmanager
+async def mock_server(monkeypatch, handler):
+    """Локальный сервер вместо openrouter.ai: все POST идут в handler."""
+    import openrouter
+
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    monkeypatch.setattr(openrouter, "OPENROUTER_API", f"http://127.0.0.1:{port}/api/v1/chat/completions")
+    try:
+        yield
+    finally:
+        import openrouter_async
+
+        await openrouter_async.aclose_client()
+        await runner.cleanup()
+
+
+def test_achat_once_ok_errors_and_shared_session(aio, monkeypatch):
+    seen = []
+
+    async def handler(request):
+        body = await request.json()
+        seen.append((request.headers["Authorization"], body["model"]))
+        if body["model"] == "bad-key":
+            return web.json_response({"error": "no"}, status=401)
+        if body["model"] == "garbage":
+            return web.Response(text="not json")
+        return web.json_response(OK_BODY)
+
+    async def scenario():
+        async with mock_server(monkeypatch, handler):
+            text, ms = await aio.achat_once(MSGS, model="m")
+            session = aio.get_async_client().session
+            await aio.achat_once(MSGS, model="m")
+            assert aio.get_async_client().session is session, "Одна сессия (пул) на event loop"
+
+            with pytest.raises(aio.OpenRouterError) as excinfo:
+                await aio.achat_once(MSGS, model="bad-key")
+            assert excinfo.value.status == 401 and "OPENROUTER_API_KEY" in excinfo.value.msg
+
+            with pytest.raises(aio.OpenRouterError) as excinfo:
+                await aio.achat_once(MSGS, model="garbage")
+            assert excinfo.value.status == 500
+            return text, ms
+
+    text, ms = asyncio.run(scenario())
+
+    assert text == "OK" and ms >= 0
+    assert seen[0] == ("Bearer test-key", "m")
+
+
+def test_achat_stream_yields_deltas_and_maps_errors(aio, monkeypatch):
+    async def handler(request):
+        body = await request.json()
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await resp.write(b": keep-alive\n\n")
+        for part in ("Hel", "lo"):
+            chunk = {"choices": [{"delta": {"content": part}}]}
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if body["model"] == "broken":
+            await resp.write(b'data: {"error": {"code": 502, "message": "upstream"}}\n\n')
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def scenario():
+        async with mock_server(monkeypatch, handler):
+            deltas = [d async for d in aio.achat_stream(MSGS, model="m")]
+            received = []
+            with pytest.raises(aio.OpenRouterError) as excinfo:
+                async for d in aio.achat_stream(MSGS, model="broken"):
+                    received.append(d)
+            return deltas, received, excinfo.value.status
+
+    deltas, received, status = asyncio.run(scenario())
+
+    assert deltas == ["Hel", "lo"]
+    assert received == ["Hel", "lo"] and status == 502
+
+
+def test_achat_once_retries_transient_statuses(aio, monkeypatch, openrouter_module):
+    calls = []
+
+    async def handler(request):
+        calls.append(1)
+        if len(calls) == 1:
+            return web.json_response({"error": "busy"}, status=503)
+        return web.json_response(OK_BODY)
+
+    async def scenario():
+        async with mock_server(monkeypatch, handler):
+            return await aio.achat_once(MSGS, model="m")
+
+    before = openrouter_module.metrics["retries"]
+    text, _ = asyncio.run(scenario())
+
+    assert text == "OK" and len(calls) == 2
+    assert openrouter_module.metrics["retries"] == before + 1
+
+
+def test_cancellation_closes_request_and_spares_breaker(aio, monkeypatch, openrouter_module):
+    state = {}
+
+    async def handler(request):
+        body = await request.json()
+        if body["model"] == "slow":
+            state["started"].set()
+            # держим запрос до конца теста, а не фиксированную паузу: cleanup сервера ждёт обработчик
+            await asyncio.wait_for(state["release"].wait(), 10)
+        return web.json_response(OK_BODY)
+
+    async def scenario():
+        state["started"], state["release"] = asyncio.Event(), asyncio.Event()
+        async with mock_server(monkeypatch, handler):
+            try:
+                task = asyncio.create_task(aio.achat_once(MSGS, model="slow"))
+                await asyncio.wait_for(state["started"].wait(), 5)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                # пул остаётся рабочим
+                text, _ = await aio.achat_once(MSGS, model="m")
+                return text
+            finally:
+                state["release"].set()
+
+    assert asyncio.run(scenario()) == "OK"
+    assert openrouter_module.get_breaker("slow").snapshot()["calls"] == 0, "Отмена - не сбой модели"
@@ -96,4 +96,363 @@ def test_chat_once_5xx_raises_openrouter_error(openrouter_module, monkeypatch):
 
     err = excinfo.value
     assert err.status == 503
-    assert "Сервис недоступен" in str(err)
\ No newline at end of file
+    assert "Сервис недоступен" in str(err)
+
+@responses.activate
+def test_chat_once_reuses_shared_session(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"choices": [{"message": {"content": "OK"}}]}, status=200)
+    monkeypatch.setenv(name="OPENROUTER_API_KEY", value="test-key")
+    openrouter = reload(openrouter_module)
+
+    for _ in range(2):
+        openrouter.chat_once([{"role": "user", "content": "ping"}], model="m", timeout_s=7)
+    client = openrouter.get_client()
+
+    assert client is openrouter.get_client(), "Клиент (и его Session) общий для всех вызовов"
+    assert client.session.headers["Authorization"] == "Bearer test-key"
+    assert len(responses.calls) == 2
+    adapter = client.session.get_adapter(url)
+    assert adapter._pool_maxsize == openrouter.OPENROUTER_POOL_SIZE
+
+
+def test_client_splits_connect_and_read_timeouts(openrouter_module, mocker):
+    client = openrouter_module.OpenRouterClient("k", connect_timeout=2)
+    post = mocker.patch.object(client.session, "post")
+
+    client.post({"model": "m"}, timeout_s=30)
+
+    assert post.call_args.kwargs["timeout"] == (2, 30)
+
+
+def _sse(*events):
+    return "".join(f"data: {e}\n\n" for e in events)
+
+
+@responses.activate
+def test_chat_stream_yields_deltas(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    body = ": OPENROUTER PROCESSING\n\n" + _sse(
+        json.dumps({"choices": [{"delta": {"role": "assistant"}}]}),
+        json.dumps({"choices": [{"delta": {"content": "При"}}]}),
+        json.dumps({"choices": [{"delta": {"content": "вет"}}]}),
+        "[DONE]",
+    )
+    responses.add(responses.POST, url, body=body, status=200, content_type="text/event-stream")
+    monkeypatch.setenv(name="OPENROUTER_API_KEY", value="test-key")
+    openrouter = reload(openrouter_module)
+
+    deltas = list(openrouter.chat_stream([{"role": "user", "content": "ping"}], model="m"))
+
+    assert deltas == ["При", "вет"]
+    assert json.loads(responses.calls[0].request.body.decode())["stream"] is True
+
+
+@responses.activate
+def test_chat_stream_maps_errors(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    monkeypatch.setenv(name="OPENROUTER_API_KEY", value="test-key")
+    openrouter = reload(openrouter_module)
+    monkeypatch.setattr(openrouter.retry_policy, "sleep", lambda s: None)
+
+    responses.add(responses.POST, url, json={"error": "bad"}, status=429)
+    with pytest.raises(openrouter.OpenRouterError) as excinfo:
+        list(openrouter.chat_stream([{"role": "user", "content": "x"}], model="m"))
+    assert excinfo.value.status == 429
+
+    responses.reset()
+    body = _sse(json.dumps({"choices": [{"delta": {"content": "на"}}]}), json.dumps({"error": {"code": 502}}))
+    responses.add(responses.POST, url, body=body, status=200, content_type="text/event-stream")
+    stream = openrouter.chat_stream([{"role": "user", "content": "x"}], model="m")
+    assert next(stream) == "на"
+    with pytest.raises(openrouter.OpenRouterError) as excinfo:
+        next(stream)
+    assert excinfo.value.status == 502
+
+
+OK_BODY = {"choices": [{"message": {"content": "OK"}}]}
+
+
+@pytest.fixture()
+def retrying_openrouter(openrouter_module, monkeypatch):
+    """Модуль с ключом и политикой повторов, которая не спит, а записывает паузы."""
+    monkeypatch.setenv(name="OPENROUTER_API_KEY", value="test-key")
+    openrouter = reload(openrouter_module)
+    delays = []
+    openrouter.retry_policy = openrouter.RetryPolicy(
+        max_attempts=4, base_delay_s=0.5, max_delay_s=5, deadline_s=60, sleep=delays.append
+    )
+    openrouter.rate_limiter = openrouter.RateLimiter(global_rpm=0, model_rpm=0, key_rpm=0)
+    return openrouter, delays
+
+
+@responses.activate
+def test_retry_schedule_with_jitter_and_retry_after(retrying_openrouter):
+    openrouter, delays = retrying_openrouter
+    url = openrouter.OPENROUTER_API
+    responses.add(responses.POST, url, json={"error": "busy"}, status=503)
+    responses.add(responses.POST, url, json={"error": "limit"}, status=429, headers={"Retry-After": "4"})
+    responses.add(responses.POST, url, json={"error": "gw"}, status=502)
+    responses.add(responses.POST, url, json=OK_BODY, status=200)
+
+    text, _ = openrouter.chat_once([{"role": "user", "content": "ping"}], model="m", timeout_s=30)
+
+    assert text == "OK"
+    assert len(responses.calls) == 4
+    assert 0.5 <= delays[0] <= 1.5, "Первая пауза: random(base, base * 3)"
+    assert delays[1] >= 4, "Retry-After - нижняя граница паузы"
+    assert 0.5 <= delays[2] <= 5, "Пауза не больше max_delay_s"
+    assert openrouter.metrics["retries"] == 3
+    assert openrouter.metrics["retry_exhausted"] == 0
+
+
+@responses.activate
+def test_no_retry_for_non_transient_errors(retrying_openrouter):
+    openrouter, delays = retrying_openrouter
+    responses.add(responses.POST, openrouter.OPENROUTER_API, json={"error": "bad"}, status=401)
+
+    with pytest.raises(openrouter.OpenRouterError) as excinfo:
+        openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+
+    assert excinfo.value.status == 401
+    assert len(responses.calls) == 1 and delays == []
+
+
+@responses.activate
+def test_retry_gives_up_at_attempts_and_deadline(retrying_openrouter):
+    openrouter, delays = retrying_openrouter
+    url = openrouter.OPENROUTER_API
+    responses.add(responses.POST, url, json={"error": "busy"}, status=503)
+
+    with pytest.raises(openrouter.OpenRouterError) as excinfo:
+        openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+    assert excinfo.value.status == 503
+    assert len(responses.calls) == 4, "max_attempts попыток"
+    assert openrouter.metrics["retry_exhausted"] == 1
+
+    # Retry-After длиннее оставшегося дедлайна - повторять бессмысленно
+    responses.reset()
+    responses.add(responses.POST, url, json={"error": "limit"}, status=429, headers={"Retry-After": "120"})
+    with pytest.raises(openrouter.OpenRouterError):
+        openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_retry_on_connection_error(retrying_openrouter):
+    import requests
+
+    openrouter, delays = retrying_openrouter
+    url = openrouter.OPENROUTER_API
+    responses.add(responses.POST, url, body=requests.ConnectionError("reset"))
+    responses.add(responses.POST, url, json=OK_BODY, status=200)
+
+    text, _ = openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+
+    assert text == "OK" and len(delays) == 1
+
+
+def test_circuit_breaker_state_machine(openrouter_module):
+    now = [0.0]
+    breaker = openrouter_module.CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, slow_ms=1000,
+                                               open_s=30, clock=lambda: now[0])
+
+    for ok, ms in ((True, 10), (False, 10), (True, 10)):
+        breaker.record(ok, ms)
+    assert breaker.state == "closed", "Пока вызовов меньше min_calls - не размыкаем"
+    breaker.record(True, 5000)  # медленный вызов считается неудачей
+    assert breaker.state == "open" and not breaker.allow()
+    assert breaker.snapshot()["retry_in_s"] == 30
+
+    now[0] = 30
+    assert breaker.allow(), "После open_s пропускаем пробный вызов"
+    assert breaker.state == "half_open" and not breaker.allow(), "Проба одна"
+    breaker.record(False, 10)
+    assert breaker.state == "open"
+
+    now[0] = 60
+    assert breaker.allow()
+    breaker.record(True, 10)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+@responses.activate
+def test_chat_once_feeds_model_breaker(retrying_openrouter):
+    openrouter, _ = retrying_openrouter
+    url = openrouter.OPENROUTER_API
+    breaker = openrouter.breakers["m"] = openrouter.CircuitBreaker(window=2, min_calls=2, failure_rate=1)
+
+    responses.add(responses.POST, url, json={"error": "bad key"}, status=401)
+    with pytest.raises(openrouter.OpenRouterError):
+        openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+    assert breaker.snapshot()["calls"] == 0, "Ошибки ключа/запроса - не вина модели"
+
+    responses.reset()
+    responses.add(responses.POST, url, json={"error": "busy"}, status=503)
+    for _ in range(2):
+        with pytest.raises(openrouter.OpenRouterError):
+            openrouter.chat_once([{"role": "user", "content": "x"}], model="m")
+    assert breaker.state == "open"
+    assert openrouter.get_breaker("other").state == "closed", "Breaker у каждой модели свой"
+
+
+def _fake_time():
+    now = [0.0]
+
+    def sleep(s):
+        now[0] += s
+
+    return now, sleep
+
+
+def test_rate_limiter_buckets_wait_and_fail_fast(openrouter_module):
+    now, sleep = _fake_time()
+    limiter = openrouter_module.RateLimiter(global_rpm=600, global_burst=10, model_rpm=60, model_burst=2,
+                                            key_rpm=0, max_waiters=1, clock=lambda: now[0], sleep=sleep)
+
+    assert limiter.acquire("m", "k", wait_s=0) == 0
+    assert limiter.acquire("m", "k", wait_s=0) == 0
+    assert limiter.acquire("other", "k", wait_s=0) == 0, "У каждой модели своё ведро"
+
+    with pytest.raises(openrouter_module.RateLimitExceeded) as excinfo:
+        limiter.acquire("m", "k", wait_s=0)
+    assert excinfo.value.status == 429 and excinfo.value.scope == "model"
+
+    assert limiter.acquire("m", "k", wait_s=5) == pytest.approx(1.0), "Ждём ровно до следующего токена"
+
+    snap = limiter.snapshot()
+    assert {(b["scope"], b["name"]) for b in snap["buckets"]} == {("global", ""), ("model", "m"), ("model", "other")}
+    assert snap["stats"] == {"granted": 4, "waited": 1, "rejected": 1}
+
+
+def test_rate_limiter_queue_full(openrouter_module):
+    limiter = openrouter_module.RateLimiter(global_rpm=60, global_burst=1, model_rpm=0, key_rpm=0, max_waiters=1)
+    limiter.acquire("m")
+    limiter._waiters = 1  # место в очереди уже занято другим потоком
+
+    with pytest.raises(openrouter_module.RateLimitExceeded) as excinfo:
+        limiter.acquire("m", wait_s=30)
+    assert "переполнена" in str(excinfo.value)
+    assert not openrouter_module.is_model_failure(excinfo.value), "Свой лимит - не сбой модели"
+
+
+@responses.activate
+def test_chat_many_completion_order_errors_and_concurrency(retrying_openrouter):
+    import threading
+
+    openrouter, _ = retrying_openrouter
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def reply(request):
+        model = json.loads(request.body)["model"]
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep({"slow": 0.6, "bad": 0.05}.get(model, 0.1))
+        with lock:
+            active[0] -= 1
+        if model == "bad":
+            return 400, {}, json.dumps({"error": "bad"})
+        return 200, {}, json.dumps({"choices": [{"message": {"content": model}}]})
+
+    responses.add_callback(responses.POST, openrouter.OPENROUTER_API, callback=reply)
+    batch = ({"messages": [{"role": "user", "content": "x"}], "model": m} for m in ("slow", "bad", "a", "b"))
+
+    results = list(openrouter.chat_many(batch, max_concurrency=2))
+
+    assert [i for i, _ in results] == [1, 2, 3, 0], "В порядке готовности, с исходными индексами"
+    assert isinstance(results[0][1], openrouter.OpenRouterError) and results[0][1].status == 400
+    assert [r[0] for _, r in results[1:]] == ["a", "b", "slow"]
+    assert peak[0] == 2, "Не больше max_concurrency запросов одновременно"
+
+
+def test_stream_handle_closes_stream_waiting_for_first_token(retrying_openrouter, monkeypatch):
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    openrouter, _ = retrying_openrouter
+    teardown = threading.Event()
+
+    class Silent(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            self.wfile.flush()
+            teardown.wait(10)  # заголовки есть, первого токена нет
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Silent)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(openrouter, "OPENROUTER_API", f"http://127.0.0.1:{server.server_port}/")
+    monkeypatch.setattr(openrouter, "breakers", {})
+    handle = openrouter.StreamHandle()
+    result = []
+
+    def read():
+        result.append(list(openrouter.chat_stream([{"role": "user", "content": "x"}], model="m", handle=handle)))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.2)
+    t0 = time.perf_counter()
+    handle.close()
+    reader.join(5)
+    teardown.set()
+    server.shutdown()
+    server.server_close()
+
+    assert not reader.is_alive() and time.perf_counter() - t0 < 1, "close() будит поток, ждущий первый токен"
+    assert result == [[]], "Закрытый поток завершается без ошибки"
+    assert openrouter.get_breaker("m").snapshot()["calls"] == 0, "Отмена не считается сбоем модели"
+
+
+def test_chat_many_stops_at_deadline_and_cancels_queued(retrying_openrouter, monkeypatch):
+    import threading
+
+    openrouter, _ = retrying_openrouter
+    started = []
+    release = threading.Event()
+
+    def chat_once(messages, *, model, deadline, **kwargs):
+        started.append(model)
+        assert deadline - time.monotonic() <= 0.3
+        if model == "slow":
+            release.wait(5)
+            raise openrouter.OpenRouterError(504, "timeout")
+        return model, 1
+
+    monkeypatch.setattr(openrouter, "chat_once", chat_once)
+    requests = ({"messages": [], "model": m} for m in ("fast", "slow", "queued"))
+
+    t0 = time.perf_counter()
+    results = list(openrouter.chat_many(requests, max_concurrency=1, deadline=time.monotonic() + 0.3))
+    elapsed = time.perf_counter() - t0
+    release.set()
+    time.sleep(0.05)
+
+    assert results == [(0, ("fast", 1))]
+    assert elapsed < 1, "Пакет не ждёт запросы дольше дедлайна"
+    assert started == ["fast", "slow"], "Запрос, не начатый до дедлайна, не отправляется"
+
+
+def test_chat_once_deadline_bounds_limiter_wait_and_timeout(retrying_openrouter, monkeypatch):
+    openrouter, _ = retrying_openrouter
+    seen = {}
+
+    def fake_chat_once(messages, *, timeout_s, **kwargs):
+        seen["timeout_s"] = timeout_s
+        return "ok", 1
+
+    monkeypatch.setattr(openrouter, "_chat_once", fake_chat_once)
+    openrouter.chat_once([], model="m", timeout_s=30, deadline=time.monotonic() + 2)
+    assert 0 < seen["timeout_s"] <= 2, "Таймаут запроса - остаток до дедлайна"
+
+    with pytest.raises(openrouter.OpenRouterError) as excinfo:
+        openrouter.chat_once([], model="m", deadline=time.monotonic() - 1)
+    assert excinfo.value.status == 504
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+import telebot
+from telebot import apihelper
+
+import webhook
+
+SECRET = "s3cret"
+
+
+@pytest.fixture()
+def fake_api(monkeypatch):
+    """Локальный Bot API: запоминает вызовы (метод, параметры) и отвечает ok."""
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            path, _, query = self.path.partition("?")
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+            params = {k: v[0] for k, v in parse_qs(query + "&" + body).items()}
+            method = path.rsplit("/", 1)[-1]
+            calls.append((method, params))
+            result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}} \
+                if method == "sendMessage" else True
+            payload = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(apihelper, "API_URL", f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}")
+    yield calls
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def echo_bot():
+    bot = telebot.TeleBot("123:abc")
+    release = threading.Event()
+
+    @bot.message_handler(commands=["ping"])
+    def ping(message):
+        release.wait(5)  # медленный обработчик не задерживает ответ Telegram
+        bot.reply_to(message, "pong")
+
+    bot.release = release
+    return bot
+
+
+@pytest.fixture()
+def webhook_server(echo_bot):
+    server = webhook.make_server(echo_bot, SECRET, host="127.0.0.1", port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}{webhook.WEBHOOK_PATH}"
+    server.shutdown()
+    server.server_close()
+
+
+def ping_update(update_id: int = 1) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/ping",
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "U"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    }
+
+
+def wait_for(predicate, timeout_s: float = 5) -> bool:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_update_acknowledged_before_handler_finishes(fake_api, echo_bot, webhook_server):
+    t0 = time.perf_counter()
+    r = requests.post(webhook_server, json=ping_update(), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+    assert r.status_code == 200
+    assert time.perf_counter() - t0 < 1, "Ответ Telegram не ждёт обработчик"
+    assert not fake_api
+
+    echo_bot.release.set()
+    assert wait_for(lambda: fake_api)
+    method, params = fake_api[0]
+    assert method == "sendMessage" and params["text"] == "pong" and params["chat_id"] == "7"
+
+
+def test_rejects_wrong_secret_path_and_bad_body(fake_api, echo_bot, webhook_server):
+    echo_bot.release.set()
+    assert requests.post(webhook_server, json=ping_update()).status_code == 403
+    assert requests.post(webhook_server, json=ping_update(),
+                         headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}).status_code == 403
+    assert requests.get(webhook_server).status_code == 405
+    assert requests.post(webhook_server + "/other", json=ping_update(),
+                         headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}).status_code == 404
+    assert requests.post(webhook_server, data=b"{not json",
+                         headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}).status_code == 400
+
+    time.sleep(0.1)
+    assert not fake_api, "Ни один апдейт не дошёл до обработчиков"
+
+
+def test_run_webhook_registers_and_removes_webhook(fake_api, echo_bot, monkeypatch):
+    servers = []
+    original = webhook.make_server
+
+    def make_server(*args, **kwargs):
+        servers.append(original(*args, **{**kwargs, "host": "127.0.0.1", "port": 0}))
+        return servers[0]
+
+    monkeypatch.setattr(webhook, "make_server", make_server)
+    worker = threading.Thread(target=webhook.run_webhook, args=(echo_bot, "https://bot.example.com/"),
+                              kwargs={"secret_token": SECRET}, daemon=True)
+    worker.start()
+
+    assert wait_for(lambda: fake_api)
+    servers[0].shutdown()
+    worker.join(5)
+
+    (set_method, set_params), (remove_method, remove_params) = fake_api
+    assert set_method == "setWebhook"
+    assert set_params["url"] == "https://bot.example.com" + webhook.WEBHOOK_PATH
+    assert set_params["secret_token"] == SECRET and set_params["drop_pending_updates"] == "True"
+    assert remove_method == "setWebhook" and not remove_params.get("url"), "remove_webhook - setWebhook без url"
+
+
+def test_run_webhook_requires_public_url(echo_bot):
+    with pytest.raises(RuntimeError):
+        webhook.run_webhook(echo_bot, "")
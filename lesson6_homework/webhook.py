@@ -0,0 +1,110 @@
+"""
+Режим webhook: Telegram сам присылает апдейты POST-запросами вместо long polling.
+
+Встроенный WSGI-сервер (wsgiref, поток на запрос) проверяет секрет из заголовка
+X-Telegram-Bot-Api-Secret-Token, передаёт апдейт в bot.process_new_updates
+(у TeleBot с threaded=True обработчики выполняются в его пуле потоков)
+и сразу отвечает 200 - Telegram не ждёт, пока отработает команда.
+
+Настройки (.env):
+    WEBHOOK_URL     - публичный адрес за HTTPS/балансировщиком, например https://bot.example.com
+    WEBHOOK_PATH    - путь, на который Telegram шлёт апдейты
+    WEBHOOK_HOST, WEBHOOK_PORT - где слушать локально
+    WEBHOOK_SECRET  - секрет для заголовка; не задан - случайный на каждый запуск
+"""
+from __future__ import annotations
+
+import hmac
+import json
+import os
+import secrets
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server as _make_wsgi_server
+
+import telebot
+from telebot import types
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+SECRET_HEADER = "HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN"
+# Апдейты Telegram - килобайты; всё, что больше, не читаем
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_app(bot: telebot.TeleBot, secret_token: str, path: str = WEBHOOK_PATH):
+    """WSGI-приложение: принимает апдейты на path с правильным секретом."""
+
+    def app(environ, start_response):
+        def respond(status: str) -> list[bytes]:
+            start_response(status, [("Content-Type", "text/plain"), ("Content-Length", "0")])
+            return []
+
+        if environ.get("PATH_INFO") != path:
+            return respond("404 Not Found")
+        if environ.get("REQUEST_METHOD") != "POST":
+            return respond("405 Method Not Allowed")
+        if not hmac.compare_digest(environ.get(SECRET_HEADER, "").encode(), secret_token.encode()):
+            return respond("403 Forbidden")
+
+        try:
+            size = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return respond("400 Bad Request")
+        if size > MAX_BODY_SIZE:
+            return respond("413 Payload Too Large")
+
+        try:
+            update = types.Update.de_json(json.loads(environ["wsgi.input"].read(size)))
+        except (ValueError, KeyError, TypeError):
+            return respond("400 Bad Request")
+
+        try:
+            bot.process_new_updates([update])
+        except Exception as e:
+            # 200 всё равно: иначе Telegram будет присылать тот же апдейт снова
+            print(f"Ошибка при обработке апдейта {update.update_id}: {e!r}")
+        return respond("200 OK")
+
+    return app
+
+
+def make_server(bot: telebot.TeleBot, secret_token: str, *,
+                host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH) -> WSGIServer:
+    """Сервер, готовый к serve_forever(); port=0 - любой свободный (server.server_port)."""
+    return _make_wsgi_server(host, port, make_app(bot, secret_token, path),
+                             server_class=ThreadingWSGIServer, handler_class=_QuietHandler)
+
+
+def run_webhook(bot: telebot.TeleBot, public_url: str = WEBHOOK_URL, *,
+                secret_token: str = WEBHOOK_SECRET,
+                host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH) -> None:
+    """
+    Регистрирует webhook в Telegram и обслуживает запросы до остановки.
+    Накопившиеся апдейты отбрасываются, как skip_pending=True у infinity_polling.
+    """
+    if not public_url:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_URL в .env")
+    secret_token = secret_token or secrets.token_urlsafe(32)
+
+    server = make_server(bot, secret_token, host=host, port=port, path=path)
+    try:
+        bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret_token, drop_pending_updates=True)
+        host, port = server.server_address[:2]
+        print(f"Webhook: {public_url.rstrip('/')}{path} -> {host}:{port}")
+        server.serve_forever()
+    finally:
+        server.server_close()
+        bot.remove_webhook()